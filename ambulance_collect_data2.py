@@ -1,13 +1,10 @@
-import glob
 import os
 import sys
 import carla
 import random
 import time
-import cv2
 import math
 import numpy as np
-import csv
 
 try:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
@@ -15,46 +12,133 @@ except IndexError:
     pass
 
 from agents.navigation.behavior_agent import BehaviorAgent
+from green_wave import GreenWave, RunMetrics, save_summary
+from image_writer import AsyncImageWriter, ImageFileSink
+from intersection_index import load_or_build
+from preemption import PreemptionScheduler
+from runtime_metrics import REGISTRY, callback_metrics, controller_seconds, start_exporter, tick_metrics
+from dataset_shards import ShardWriter
+from route_cache import map_cache
+from scenario import Scenario
+from spawn_manager import SpawnManager
+from stuck_watchdog import EVENT_SCHEMA, StuckWatchdog
+from telemetry_sink import TelemetrySink, export_csv
 
-frame_count = 0
 dataset_path = "D:/dataset/"
-os.makedirs(dataset_path, exist_ok=True)
-
-# log data in csv
-csv_file = open(os.path.join(dataset_path, "controls.csv"), mode='w', newline='')
-csv_writer = csv.writer(csv_file)
-csv_writer.writerow(["frame", "steering", "throttle", "brake"])
 
 max_frames = 50000  # Stop at 50,000 frames
 
+# "files" writes {frame}.jpg per frame, "shards" packs frames + controls into tar shards with an index
+output_mode = "files"
+samples_per_shard = 1000
+shard_writer = None
+
+# jpeg encoding/saving happens on worker threads, the sensor callback only queues frames
+# backpressure: "block" stalls the callback, "drop_oldest"/"drop_newest" drop and count frames
+image_writer_workers = 4
+image_writer_queue_size = 64
+image_writer_policy = "block"
+image_writer = None
+
+# stuck/crashed vehicles are moved to a clear spawn point, frames are not captured while the ambulance stands still
+stuck_seconds = 30.0
+suspect_seconds = 5.0
+capture_paused = False
+
+# "corridor" pre-clears the signals along the planned route just before the ambulance gets there (green_wave.py),
+# "reactive" turns the red light the ambulance is stopped at green. Both runs save the same metrics to compare,
+# reactive stays the default so new datasets match the earlier ones
+signal_mode = "reactive"
+
+# one seed for spawns, routes and traffic. record_scenario = True also keeps a CARLA recording of the run
+# (re-render it with scenario.py replay), off by default since the file grows with the run
+record_scenario = False
+
+# spawn points tried for the ambulance before giving up
+spawn_attempts = 20
+
+# live tick/callback/writer metrics on http://127.0.0.1:METRICS_PORT/metrics (default 9100, 0 = off) and
+# {output_path}/metrics.json every METRICS_INTERVAL seconds, see runtime_metrics.py
+world_tick_seconds, tick_seconds, ticks_total = tick_metrics()
+callback_seconds, callback_frame_lag = callback_metrics("process_image")
+last_tick_frame = None
+
+CONTROL_SCHEMA = [("frame", np.int64), ("steering", np.float32), ("throttle", np.float32), ("brake", np.float32)]
+
 def process_image(image):
-    """ Process and save image from camera """
-    global frame_count
-    image_data = np.frombuffer(image.raw_data, dtype=np.uint8)
-    image_data = image_data.reshape((image.height, image.width, 4))[:, :, :3]  # Convert BGRA to BGR
-    image_data = cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB) #convert to rgb
-    img_filename = os.path.join(dataset_path, f"{frame_count}.jpg")
-    cv2.imwrite(img_filename, image_data)  # Save image
-    frame_count += 1
+    """ Queue image from camera to be saved as {image.frame}.jpg """
+    start = time.perf_counter()
+    if last_tick_frame is not None:
+        callback_frame_lag.observe(last_tick_frame - image.frame)
+    if capture_paused:
+        return  # near-identical frames of a stuck ambulance
+    image_writer.submit(image)
+    callback_seconds.observe(time.perf_counter() - start)
 
 
 def get_clear_spawn_point(world):
-    """ Get a spawn point that is clear of obstacles """
-    spawn_points = world.get_map().get_spawn_points()
-    for _ in range(10):
-        spawn_point = random.choice(spawn_points)
-        return spawn_point
-    return random.choice(spawn_points)
+    """ Get a spawn point that is clear of obstacles, returns (spawn point index, transform) """
+    route_cache = map_cache(world)
+    spot = route_cache.clear_spawn_point(world, radius=5.0)
+    if spot is None:
+        # every spawn point has a vehicle next to it, let the spawn itself decide
+        index = random.randrange(len(route_cache.spawn_points))
+        return index, route_cache.spawn_points[index]
+    return spot
+
+
+def main(host='localhost', port=2000, tm_port=8000, output_path=dataset_path, frames=max_frames,
+         town=None, weather=None, image_size=224, traffic_vehicles=0, seed=None, metrics_port=None):
+    """ Drive the ambulance around and record camera frames + controls, returns the writer summary
 
+    The defaults are the standalone run, scenario_farm.py passes a job's map/seed/weather/etc.
+    metrics_port None takes METRICS_PORT, 0 serves no endpoint (metrics.json is still written).
+    """
+    global image_writer, shard_writer, capture_paused, last_tick_frame
+    spawn_manager = None
+    world = None
+    settings = None
+    traffic_manager = None
+    scenario = None
+    route_cache = None
+    watchdog = None
+    scheduler = None
+    green_wave = None
+    signal_metrics = None
+    now = None
+    capture_paused = False
+    last_tick_frame = None
 
-def main():
-    global frame_count
-    actor_list = []
+    os.makedirs(output_path, exist_ok=True)
+    metrics = start_exporter(os.path.join(output_path, "metrics.json"), port=metrics_port)
+
+    # log controls in column buffers, controls.csv is exported from them at the end
+    telemetry = TelemetrySink(os.path.join(output_path, "telemetry"),
+                              {"controls": CONTROL_SCHEMA, "watchdog": EVENT_SCHEMA})
+
+    if output_mode == "shards":
+        shard_writer = ShardWriter(os.path.join(output_path, "shards"), samples_per_shard)
+        image_sink = shard_writer
+    else:
+        image_sink = ImageFileSink(output_path)
+    image_writer = AsyncImageWriter(image_sink, num_workers=image_writer_workers,
+                                    max_queue=image_writer_queue_size, policy=image_writer_policy)
     try:
         
-        client = carla.Client('localhost', 2000)
+        client = carla.Client(host, port)
         client.set_timeout(10.0)
+        scenario = Scenario(client, output_path, seed=seed, name="ambulance", record=record_scenario,
+                            params={"frames": frames, "image_size": image_size, "traffic_vehicles": traffic_vehicles,
+                                    "output_mode": output_mode, "signal_mode": signal_mode})
+        scenario.add_log("controls", os.path.join(output_path, "controls.csv"))
+        scenario.add_log("telemetry", telemetry.directory)
+        scenario.add_log("signals", os.path.join(output_path, "green_wave.json"))
+        scenario.add_log("metrics", os.path.join(output_path, "metrics.json"))
         world = client.get_world()
+        if town and not world.get_map().name.endswith(town):
+            world = client.load_world(town)
+        if weather:
+            world.set_weather(getattr(carla.WeatherParameters, weather))
     
         
         # !!! needs synchronous mode to work, 20fps (0.05 timestep) so launch carla with -fps 20 in commandline!!!
@@ -62,94 +146,187 @@ def main():
         settings.synchronous_mode = True
         settings.fixed_delta_seconds = 0.05  # 20 FPS
         world.apply_settings(settings)
-        traffic_manager = client.get_trafficmanager()
+        traffic_manager = client.get_trafficmanager(tm_port)
+        traffic_manager.set_synchronous_mode(True)
         traffic_manager.set_global_distance_to_leading_vehicle(2.5)
         traffic_manager.set_respawn_dormant_vehicles(True)
+        # seeded before anything spawns, a fresh seed is picked (and saved in scenario.json) when none is given
+        seed = scenario.seed_everything(world, traffic_manager)
 
         blueprint_library = world.get_blueprint_library()
 
+        # spawn points, route planner and planned routes, fetched/built once per map
+        route_cache = map_cache(world)
+
+        # tracks every actor so they are destroyed in one batch, even after a crash
+        spawn_manager = SpawnManager(client, world, seed=seed, tm_port=traffic_manager.get_port())
+
+        # background traffic on autopilot
+        traffic = []
+        if traffic_vehicles:
+            traffic = spawn_manager.spawn_vehicles(traffic_vehicles, 'vehicle.*', autopilot=True)
+
         # spawn ambulance
         vehicle_bp = blueprint_library.find('vehicle.ambulance.ford')
-        spawn_point = get_clear_spawn_point(world)
-        vehicle = world.spawn_actor(vehicle_bp, spawn_point)
-        actor_list.append(vehicle)
+        vehicle_bp.set_attribute('role_name', 'ambulance')  # how scenario.replay finds it again
+        vehicle = None
+        for _ in range(spawn_attempts):
+            location_index, spawn_point = get_clear_spawn_point(world)
+            vehicle = spawn_manager.spawn_vehicle(vehicle_bp, spawn_point)
+            if vehicle is not None:
+                break
+        else:
+            raise RuntimeError(f"Could not spawn the ambulance: all {spawn_attempts} spawn points tried were blocked")
 
-        agent = BehaviorAgent(vehicle, behavior="normal")
+        agent = BehaviorAgent(vehicle, behavior="normal", map_inst=route_cache.map, grp_inst=route_cache.planner)
         agent._look_ahead_steps = 5 
 
-        # attach rgb camera (224x224)
+        # attach rgb camera (224x224 by default)
         camera_bp = blueprint_library.find('sensor.camera.rgb')
-        camera_bp.set_attribute('image_size_x', '224')
-        camera_bp.set_attribute('image_size_y', '224')
+        camera_bp.set_attribute('image_size_x', str(image_size))
+        camera_bp.set_attribute('image_size_y', str(image_size))
         camera_bp.set_attribute('fov', '90')
         camera_transform = carla.Transform(carla.Location(x=1.5, z=2.0))
         camera = world.spawn_actor(camera_bp, camera_transform, attach_to=vehicle, attachment_type=carla.AttachmentType.Rigid)
-        actor_list.append(camera)
+        spawn_manager.register(camera)
 
         # start recording
         camera.listen(lambda image: process_image(image))
         
         print("Ambulance spawned. Driving in a loop!")
 
-        # Run sim
-        # try to implement counter to detect if vehicle stuck and teleport it later (wip)
-        # last_position = vehicle.get_transform().location
-        # stuck_count = 0
-        
-        # pick random waypoint as destination
-        def get_random_destination():
-            spawn_points = world.get_map().get_spawn_points()
-            return random.choice(spawn_points).location
-        
-        destination = get_random_destination()
-        agent.set_destination(destination)
-        print(f"Initial destination set to: {destination}")
+        # watches the ambulance and the background traffic, one snapshot per tick
+        watchdog = StuckWatchdog(client, world, [vehicle] + traffic, route_cache, settings.fixed_delta_seconds,
+                                 stuck_seconds=stuck_seconds, suspect_seconds=suspect_seconds,
+                                 collision_vehicles=[vehicle], spawn_manager=spawn_manager)
+
+        # signals along the route, the same index and metrics serve both signal modes
+        intersection_index = load_or_build(world, carla_map=route_cache.map)
+        signal_metrics = RunMetrics(intersection_index, signal_mode)
+        traffic_ids = [actor.id for actor in traffic]
+        if signal_mode == "corridor":
+            scheduler = PreemptionScheduler(verbose=False)
+            green_wave = GreenWave(intersection_index, scheduler)
+
+        # destinations rotate through the spawn points so the drive covers the whole map
+        destinations = route_cache.destination_rotation()
+
+        def set_next_route(start_index):
+            """ Route the ambulance from a spawn point to the next destination, returns the destination index """
+            destination_index = next(destinations)
+            if destination_index == start_index:
+                destination_index = next(destinations)
+            destination = route_cache.set_route(agent, start_index, destination_index)
+            if green_wave:
+                # the same (memoized) route the agent was given
+                green_wave.plan(vehicle.id, route_cache.route(start_index, destination_index))
+            print(f"New destination set to: {destination}")
+            return destination_index
+
+        # routes between spawn points are planned once and reused from the cache
+        location_index = set_next_route(location_index)
+
+        watchdog_seconds = controller_seconds("watchdog")
+        signals_seconds = controller_seconds("signals")
+        agent_seconds = controller_seconds("agent")
+        REGISTRY.gauge("capture_paused", "1 while frames are skipped for a stuck ambulance",
+                       fn=lambda: int(capture_paused))
+
+        scenario.start(world, weather)
         
-        while frame_count < max_frames:
-            world.tick()
-            if vehicle.is_at_traffic_light():
+        while image_writer.received < frames:
+            # frame id of this tick, matches image.frame of the camera frame saved for it
+            tick_start = time.perf_counter()
+            frame = world.tick()
+            last_tick_frame = frame
+            world_tick_seconds.observe(time.perf_counter() - tick_start)
+            snapshot = world.get_snapshot()
+            now = snapshot.timestamp.elapsed_seconds
+            controller_start = time.perf_counter()
+            watchdog_events = watchdog.update(snapshot)
+            watchdog_seconds.observe(time.perf_counter() - controller_start)
+            for event in watchdog_events:
+                telemetry.append("watchdog", *watchdog.event_record(event))
+                if event["actor_id"] == vehicle.id and event["spawn_index"] is not None:
+                    # the ambulance was moved, plan on from where it is now
+                    signal_metrics.finish_leg(now, reached=False)
+                    location_index = set_next_route(event["spawn_index"])
+            capture_paused = watchdog.is_suspect(vehicle.id)
+
+            controller_start = time.perf_counter()
+            ego = snapshot.find(vehicle.id)
+            if ego is not None:
+                transform = ego.get_transform()
+                velocity = ego.get_velocity()
+                location = (transform.location.x, transform.location.y)
+                yaw = math.radians(transform.rotation.yaw)
+                speed = math.hypot(velocity.x, velocity.y)
+                if green_wave:
+                    green_wave.update(now, vehicle.id, location, speed)
+                    scheduler.update(now, {vehicle.id: location})
+                signal_metrics.update(now, location, (math.cos(yaw), math.sin(yaw)), speed, snapshot, traffic_ids)
+
+            if signal_mode == "reactive" and vehicle.is_at_traffic_light():
                 traffic_light = vehicle.get_traffic_light()
                 if traffic_light.get_state() == carla.TrafficLightState.Red:
                     traffic_light.set_state(carla.TrafficLightState.Green)
                     traffic_light.set_green_time(4.0)
+            signals_seconds.observe(time.perf_counter() - controller_start)
+
+            controller_start = time.perf_counter()
             if agent.done():
                 # makes ambulance loop infinitely by finding a new destination once the current one is reached
                 print("Destination reached. Setting new destination.")
-                destination = get_random_destination()
-                agent.set_destination(destination)
-                print(f"New destination set to: {destination}")
+                signal_metrics.finish_leg(now)
+                location_index = set_next_route(location_index)
 
             control = agent.run_step()
             vehicle.apply_control(control)
+            agent_seconds.observe(time.perf_counter() - controller_start)
 
-            # record controls data to csv
-            csv_writer.writerow([frame_count, control.steer, control.throttle, control.brake])
-            
-            '''
-                current_position = vehicle.get_transform().location
-                if current_position.distance(last_position) < 0.1:  # Stuck check
-                    stuck_count += 1
-                else:
-                    stuck_count = 0  # Reset if moving
-
-                last_position = current_position
-
-                # **Reset vehicle if stuck for too long**
-                if stuck_count > 40:
-                    print("Vehicle is stuck! Resetting position...")
-                    vehicle.set_transform(get_clear_spawn_point(world))
-                    stuck_count = 0
-            '''
+            # record controls data, skipped along with the frames while the ambulance stands still
+            if not capture_paused:
+                telemetry.append("controls", frame, control.steer, control.throttle, control.brake)
+                if shard_writer:
+                    shard_writer.add_controls(frame, control.steer, control.throttle, control.brake)
+            tick_seconds.observe(time.perf_counter() - tick_start)
+            ticks_total.inc()
 
     except KeyboardInterrupt:
         print("\nStopping simulation...")
 
     finally:
+        if scenario is not None and world is not None:
+            scenario.stop(world)
         print("Destroying actors...")
-        for actor in actor_list:
-            actor.destroy()
-        csv_file.close()
-        world.apply_settings(settings)  # Reset to asynchronous mode
+        if spawn_manager:
+            spawn_manager.destroy_all()
+        image_writer.close()
+        image_writer.print_summary()
+        if route_cache:
+            route_cache.print_stats()
+        if watchdog:
+            watchdog.print_summary()
+        if scheduler:
+            scheduler.release_all(now)
+            scheduler.print_summary()
+        if green_wave:
+            green_wave.print_summary()
+        if signal_metrics:
+            signal_metrics.print_summary()
+            save_summary(os.path.join(output_path, "green_wave.json"), signal_metrics, green_wave, scheduler)
+        telemetry.close()
+        export_csv(telemetry.directory, "controls", os.path.join(output_path, "controls.csv"))
+        if world is not None and settings is not None:
+            settings.synchronous_mode = False
+            world.apply_settings(settings)  # Reset to asynchronous mode
+        if traffic_manager is not None:
+            traffic_manager.set_synchronous_mode(False)
+        metrics.close()
+
+    summary = image_writer.summary()
+    summary["seed"] = scenario.seed if scenario is not None else seed
+    return summary
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
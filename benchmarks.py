@@ -0,0 +1,389 @@
+"""Latency, allocation and throughput benchmarks of the per-frame hot paths.
+
+Runs in-process against fake_carla, so no server is needed and the same
+scale and seed always give the same scene. Stages:
+
+    process_image             AsyncImageWriter.submit() from the camera callback (ambulance_collect_data2)
+    camera_callback           vehicle_state() + InferencePipeline.submit() (drive_with_classification_model),
+                              the model is a no-op so only our side of the pipeline is timed
+    detect_pedestrians        PedestrianMonitor.update() on the tick's snapshot
+    traffic_light_controller  get_waypoint() + lane -> light lookup + PreemptionScheduler.request() per ambulance
+    get_intersection          IntersectionIndex.intersection()
+    runtime_metrics           one tick's worth of runtime_metrics updates of ambulance_collect_data2
+                              (tick_budget_percent is the share of a 50 ms tick it costs)
+
+Every stage reports p50/p95/p99/max latency per call, calls per second,
+bytes allocated per call (tracemalloc peak, measured in a separate pass so
+tracing doesn't skew the timings) and bytes still held afterwards. Results
+can be saved as a JSON baseline; later runs are compared against it and the
+exit code is 1 when p50/p95 latency, allocations or throughput got worse by
+more than the threshold:
+
+    python benchmarks.py --save-baseline            # cache/benchmarks/baseline.json
+    python benchmarks.py --threshold 0.25           # compare, exit 1 on regression
+    python benchmarks.py --stages detect_pedestrians --vehicles 500 --pedestrians 5000 --profile
+
+Baselines are machine specific, which is why they live in cache/. The fake
+map and actors cost nothing like the real RPCs, so absolute numbers only
+cover the Python side of each stage.
+"""
+import argparse
+import cProfile
+import itertools
+import json
+import os
+import platform
+import pstats
+import time
+import tracemalloc
+
+import numpy as np
+
+import fake_carla
+
+carla = fake_carla.install()  # before anything below imports carla
+
+from detection_log import vehicle_state  # noqa: E402
+from image_writer import AsyncImageWriter  # noqa: E402
+from inference_pipeline import InferencePipeline  # noqa: E402
+from intersection_index import IntersectionIndex  # noqa: E402
+from pedestrian_detection import PedestrianMonitor  # noqa: E402
+from preemption import PreemptionScheduler  # noqa: E402
+from runtime_metrics import Registry, callback_metrics, controller_seconds, tick_metrics  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "benchmarks", "baseline.json")
+DEFAULT_THRESHOLD = 0.2
+
+# metric -> (1 lower is better | -1 higher is better, absolute slack ignored as noise)
+TRACKED_METRICS = {
+    "p50_us": (1, 1.0),
+    "p95_us": (1, 2.0),
+    "alloc_bytes_per_call": (1, 256),
+    "throughput_per_s": (-1, 0.0),
+}
+
+STAGE_METRICS = ("iterations", "p50_us", "p95_us", "p99_us", "max_us", "mean_us", "throughput_per_s",
+                 "alloc_bytes_per_call", "retained_bytes_per_call")
+
+
+class NullSink:
+    """Image sink that only counts bytes, keeps disk speed out of the writer benchmark."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def write(self, frame, encoded_bytes):
+        self.frames += 1
+        self.bytes += len(encoded_bytes)
+
+    def close(self):
+        pass
+
+
+class NullModel:
+    """Stands in for the YOLO model, returns no detections."""
+
+    def __call__(self, images, **kwargs):
+        return [None] * len(images)
+
+
+def capture_frames(world, vehicle, resolution, count=8):
+    """Frames of a camera on the vehicle over count ticks, the fake reuses its buffers so they stay valid."""
+    blueprint = world.get_blueprint_library().find("sensor.camera.rgb")
+    blueprint.set_attribute("image_size_x", str(resolution))
+    blueprint.set_attribute("image_size_y", str(resolution))
+    camera = world.spawn_actor(blueprint, carla.Transform(carla.Location(x=1.5, z=2.0)), attach_to=vehicle)
+    images = []
+    camera.listen(images.append)
+    for _ in range(count):
+        world.tick()
+    camera.destroy()
+    return images
+
+
+def measure(call, iterations, before=None, warmup=10, alloc_iterations=50, profile=None):
+    """Latency percentiles and allocations of call(), before() runs untimed ahead of every call."""
+    for _ in range(warmup):
+        if before:
+            before()
+        call()
+
+    times = np.empty(iterations, dtype=np.int64)
+    if profile is not None:
+        profile.enable()
+    for i in range(iterations):
+        if before:
+            before()
+        start = time.perf_counter_ns()
+        call()
+        times[i] = time.perf_counter_ns() - start
+    if profile is not None:
+        profile.disable()
+
+    # tracemalloc slows every allocation down, so it gets its own pass
+    peaks = np.empty(alloc_iterations, dtype=np.int64)
+    tracemalloc.start()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    for i in range(alloc_iterations):
+        if before:
+            before()
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[i] = peak - base
+    end_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) / 1000.0
+    return {
+        "iterations": iterations,
+        "p50_us": float(p50),
+        "p95_us": float(p95),
+        "p99_us": float(p99),
+        "max_us": float(times.max() / 1000.0),
+        "mean_us": float(times.mean() / 1000.0),
+        "throughput_per_s": float(iterations / (times.sum() / 1e9)) if times.sum() else None,
+        "alloc_bytes_per_call": float(peaks.mean()),
+        "retained_bytes_per_call": float((end_bytes - start_bytes) / alloc_iterations),
+    }
+
+
+def bench_process_image(world, vehicles, args, profile=None):
+    images = itertools.cycle(capture_frames(world, vehicles[0], args.resolution))
+    writer = AsyncImageWriter(NullSink(), num_workers=4)
+    stats = measure(lambda: writer.submit(next(images)), args.iterations, profile=profile)
+    writer.close()
+    # the callback cost above, the frames the writer pool actually encoded per second here
+    writer_stats = writer.summary()
+    stats["frames_written_per_s"] = writer_stats["frames_per_s"]
+    stats["writer_max_queue_depth"] = writer_stats["max_queue_depth"]
+    return stats
+
+
+def bench_camera_callback(world, vehicles, args, profile=None):
+    ego = vehicles[0]
+    images = itertools.cycle(capture_frames(world, ego, args.resolution))
+    pipeline = InferencePipeline(NullModel(), imgsz=args.resolution, batch_size=4, adaptive_stride=False)
+
+    def camera_callback():
+        state = vehicle_state(ego)
+        pipeline.submit(next(images), source="camera", meta=state)
+
+    stats = measure(camera_callback, args.iterations, profile=profile)
+    pipeline.close()
+    summary = pipeline.summary()
+    stats["inferred"] = summary["processed"]
+    stats["dropped"] = summary["dropped"]
+    stats["buffer_allocations"] = sum(pool["allocations"] for pool in summary["frame_buffers"].values())
+    return stats
+
+
+def bench_detect_pedestrians(world, vehicles, args, profile=None):
+    monitor = PedestrianMonitor(world, vehicles, detection_range=10.0)
+    snapshot = None
+
+    def tick():
+        nonlocal snapshot
+        world.tick()
+        snapshot = world.get_snapshot()
+
+    stats = measure(lambda: monitor.update(snapshot), args.iterations, before=tick, profile=profile)
+    stats["vehicles"] = len(monitor.vehicle_ids)
+    stats["pedestrians"] = len(monitor.pedestrian_ids)
+    return stats
+
+
+def _intersection_index(world):
+    lights = world.get_actors().filter("traffic.traffic_light")
+    return IntersectionIndex.build(world.get_map(), lights, radius=30.0, signature="fake"), lights
+
+
+def bench_traffic_light_controller(world, vehicles, args, profile=None):
+    """Same steps as traffic_lights.traffic_light_controller(), which only exists inside that script."""
+    carla_map = world.get_map()
+    index, _ = _intersection_index(world)
+    scheduler = PreemptionScheduler(hold_time=15.0, verbose=False)
+    ambulances = itertools.cycle(vehicles[:max(1, args.ambulances)])
+    clock = itertools.count()
+
+    def traffic_light_controller():
+        vehicle = next(ambulances)
+        now = next(clock) * 0.05
+        vehicle_waypoint = carla_map.get_waypoint(vehicle.get_location())
+        approach = index.approach_for_waypoint(vehicle_waypoint)
+        if approach:
+            current, stop_location, stop_forward = approach
+            scheduler.request(vehicle.id, current, index.intersection(current), stop_location, stop_forward, now)
+
+    stats = measure(traffic_light_controller, args.iterations, profile=profile)
+    scheduler.release_all()
+    stats["preemptions"] = scheduler.summary()["preemptions"]
+    return stats
+
+
+def bench_get_intersection(world, vehicles, args, profile=None):
+    index, lights = _intersection_index(world)
+    order = itertools.cycle(np.random.default_rng(args.seed).permutation(len(lights)).tolist())
+    stats = measure(lambda: index.intersection(lights[next(order)]), args.iterations, profile=profile)
+    stats["lights"] = len(lights)
+    return stats
+
+
+def bench_runtime_metrics(world, vehicles, args, profile=None):
+    """The metric updates ambulance_collect_data2.py makes per tick, in a registry of their own."""
+    registry = Registry()
+    world_tick_seconds, tick_seconds, ticks_total = tick_metrics(registry)
+    controllers = [controller_seconds(name, registry) for name in ("watchdog", "signals", "agent")]
+    callback_seconds, callback_frame_lag = callback_metrics("process_image", registry)
+    frames_written = registry.counter("image_writer_frames_total", labels={"result": "written"})
+    bytes_written = registry.counter("image_writer_bytes_total")
+    write_seconds = registry.histogram("image_writer_write_seconds")
+
+    def instrumented_tick():
+        start = time.perf_counter()
+        world_tick_seconds.observe(time.perf_counter() - start)
+        for controller in controllers:
+            controller.observe(time.perf_counter() - start)
+        callback_frame_lag.observe(1)
+        callback_seconds.observe(time.perf_counter() - start)
+        frames_written.inc()
+        bytes_written.inc(40000)
+        write_seconds.observe(time.perf_counter() - start)
+        tick_seconds.observe(time.perf_counter() - start)
+        ticks_total.inc()
+
+    stats = measure(instrumented_tick, args.iterations, profile=profile)
+    stats["tick_budget_percent"] = stats["mean_us"] / 50000.0 * 100
+    start = time.perf_counter()
+    registry.render()
+    stats["render_us"] = (time.perf_counter() - start) * 1e6
+    return stats
+
+
+STAGES = {
+    "process_image": bench_process_image,
+    "camera_callback": bench_camera_callback,
+    "detect_pedestrians": bench_detect_pedestrians,
+    "traffic_light_controller": bench_traffic_light_controller,
+    "get_intersection": bench_get_intersection,
+    "runtime_metrics": bench_runtime_metrics,
+}
+
+
+def run(args):
+    """{stage: metrics} for the selected stages, each on a fresh fake world of the given scale."""
+    results = {}
+    for name in args.stages:
+        world = fake_carla.FakeWorld(vehicles=max(1, args.vehicles), pedestrians=args.pedestrians,
+                                     junctions=args.junctions, seed=args.seed)
+        settings = world.get_settings()
+        settings.synchronous_mode = True
+        settings.fixed_delta_seconds = 0.05
+        world.apply_settings(settings)
+        vehicles = list(world.get_actors().filter("vehicle.*"))
+
+        profile = cProfile.Profile() if args.profile else None
+        results[name] = STAGES[name](world, vehicles, args, profile)
+        print_stage(name, results[name])
+        if profile is not None:
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(args.profile_top)
+    return results
+
+
+def print_stage(name, stats):
+    print(f"{name}: p50 {stats['p50_us']:.1f} us, p95 {stats['p95_us']:.1f} us, p99 {stats['p99_us']:.1f} us, "
+          f"max {stats['max_us']:.1f} us, {stats['throughput_per_s']:.0f} calls/s, "
+          f"{stats['alloc_bytes_per_call'] / 1024:.1f} KiB allocated/call, "
+          f"{stats['retained_bytes_per_call']:.0f} B retained/call")
+    extras = {key: value for key, value in stats.items() if key not in STAGE_METRICS}
+    if extras:
+        print("    " + ", ".join(f"{key} {value:.3g}" if isinstance(value, float) else f"{key} {value}"
+                                 for key, value in extras.items()))
+
+
+def scale_of(args):
+    return {"vehicles": args.vehicles, "pedestrians": args.pedestrians, "junctions": args.junctions,
+            "resolution": args.resolution, "ambulances": args.ambulances, "seed": args.seed}
+
+
+def save_baseline(path, args, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    baseline = {
+        "created": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scale": scale_of(args),
+        "stages": results,
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"Saved baseline to {path}")
+
+
+def compare(baseline, results, threshold=DEFAULT_THRESHOLD):
+    """[(stage, metric, baseline, current)] of every tracked metric that regressed past threshold."""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            continue
+        for metric, (direction, slack) in TRACKED_METRICS.items():
+            before, now = base.get(metric), stats.get(metric)
+            if before is None or now is None:
+                continue
+            if direction > 0:
+                worse = now > before * (1 + threshold) + slack
+            else:
+                worse = now < before / (1 + threshold) - slack
+            if worse:
+                regressions.append((name, metric, before, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-frame hot paths against a fake CARLA")
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES), default=list(STAGES))
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--pedestrians", type=int, default=1000)
+    parser.add_argument("--junctions", type=int, default=64)
+    parser.add_argument("--ambulances", type=int, default=4)
+    parser.add_argument("--resolution", type=int, default=320)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed relative regression, 0.2 = 20%% slower / more allocations")
+    parser.add_argument("--profile", action="store_true", help="cProfile the timed loop of every stage")
+    parser.add_argument("--profile-top", type=int, default=15)
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save_baseline:
+        save_baseline(args.baseline, args, results)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("scale") != scale_of(args):
+        print(f"Baseline scale {baseline.get('scale')} differs from this run's {scale_of(args)}, not comparing")
+        return 0
+    regressions = compare(baseline, results, args.threshold)
+    for name, metric, before, now in regressions:
+        print(f"REGRESSION {name} {metric}: {before:.1f} -> {now:.1f}")
+    if regressions:
+        return 1
+    print(f"No regressions past {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
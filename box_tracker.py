@@ -0,0 +1,462 @@
+"""Tracker-assisted frame skipping: full YOLO runs on some frames, boxes are tracked on the rest.
+
+Every camera gets a BoxTracker, a constant-velocity Kalman filter over
+(cx, cy, w, h) per track with every track's state in one (tracks, 8) array
+and the covariances in one (tracks, 8, 8) array, so predicting and updating
+the whole set is a handful of batched NumPy ops. Detections are matched to
+the predicted boxes greedily by IoU (same class only) and keep their track
+id across frames; frames without a detector run get the predicted boxes of
+the confirmed tracks.
+
+DetectionSchedule decides per frame whether the detector runs: the interval
+between runs shrinks with ego speed (the scene changes faster) and a run is
+forced as soon as the predicted box positions get too uncertain. The
+inference pipeline's stride stays the lower bound, so the detector is never
+asked for more than it can keep up with.
+
+The gain is measured on a replayed drive: replay_detection.py gives the
+detector's boxes for every frame, evaluate() replays the schedule over them
+and reports detector runs against box recall/precision versus every frame,
+next to the plain fixed stride:
+
+    python box_tracker.py evaluate replay_results/detection_data_yolo12m_320.csv --telemetry recordings/drive1/telemetry.csv
+"""
+import argparse
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+
+from detection_log import detection_arrays
+
+# DeepSORT-style noise, standard deviations as a fraction of the box size
+POSITION_STD = 1.0 / 20
+VELOCITY_STD = 1.0 / 160
+
+
+def iou_matrix(a, b):
+    """IoU of every box in a (N, 4) against every box in b (M, 4), both xyxy."""
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def greedy_match(iou, threshold):
+    """(rows, cols) of pairs matched best IoU first, each row and column used once."""
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_rows, used_cols = set(), set()
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64)
+
+
+def to_xyxy(state):
+    cx, cy = state[:, 0], state[:, 1]
+    w, h = np.maximum(state[:, 2], 1.0), np.maximum(state[:, 3], 1.0)
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def to_cxcywh(xyxy):
+    return np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2, (xyxy[:, 1] + xyxy[:, 3]) / 2,
+                     xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1]], axis=1)
+
+
+class FrameBoxes:
+    """Boxes of one frame with their track ids, kind is "detected" (detector output) or "tracked" (predicted)."""
+
+    __slots__ = ("kind", "xyxy", "conf", "classes", "track_ids")
+
+    def __init__(self, kind, xyxy, conf, classes, track_ids):
+        self.kind = kind
+        self.xyxy = xyxy
+        self.conf = conf
+        self.classes = classes
+        self.track_ids = track_ids
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def columns(self, frame, sensor="camera"):
+        """DETECTION_SCHEMA columns of these boxes."""
+        return {
+            "sensor": [sensor] * len(self), "frame_number": np.full(len(self), frame, dtype=np.int64),
+            "class": list(self.classes), "confidence": self.conf,
+            "x1": self.xyxy[:, 0], "y1": self.xyxy[:, 1], "x2": self.xyxy[:, 2], "y2": self.xyxy[:, 3],
+            "box_source": [self.kind] * len(self), "track_id": self.track_ids,
+        }
+
+
+class BoxTracker:
+    """Constant velocity Kalman tracks of one camera, matched to detections by IoU."""
+
+    def __init__(self, iou_threshold=0.3, max_age=10, min_hits=2):
+        self.iou_threshold = iou_threshold
+        # tracks are dropped (and no longer output) this many frames after their last detection
+        self.max_age = max_age
+        # a track is output on tracked frames once it was detected this often
+        self.min_hits = min_hits
+
+        self._x = np.zeros((0, 8))  # cx, cy, w, h and their velocities in pixels per frame
+        self._P = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.classes = np.zeros(0, dtype=object)
+        self.conf = np.zeros(0, dtype=np.float32)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.last_detected = np.zeros(0, dtype=np.int64)  # frame of each track's last detection
+        self.frame = None
+        self._next_id = 0
+        self.tracks_created = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _transition(steps):
+        F = np.eye(8)
+        F[range(4), range(4, 8)] = steps
+        return F
+
+    @staticmethod
+    def _noise(size, position_scale, velocity_scale):
+        """(tracks, 8, 8) diagonal covariances scaled by each track's box size."""
+        std = np.concatenate([np.repeat((position_scale * size)[:, None], 4, axis=1),
+                              np.repeat((velocity_scale * size)[:, None], 4, axis=1)], axis=1)
+        noise = np.zeros((len(size), 8, 8))
+        noise[:, range(8), range(8)] = std ** 2
+        return noise
+
+    def _size(self, x):
+        return np.maximum(np.maximum(x[:, 2], x[:, 3]), 1.0)
+
+    def _predicted(self, frame):
+        """(state, covariance) of every track moved on to frame, without changing the tracker."""
+        steps = frame - self.frame if self.frame is not None and frame is not None else 0
+        if steps <= 0 or not len(self.ids):
+            return self._x, self._P
+        F = self._transition(steps)
+        x = self._x @ F.T
+        P = F @ self._P @ F.T + steps * self._noise(self._size(self._x), POSITION_STD, VELOCITY_STD)
+        return x, P
+
+    def _advance(self, frame):
+        self._x, self._P = self._predicted(frame)
+        if frame is not None and (self.frame is None or frame > self.frame):
+            self.frame = frame
+        # forget tracks that went unseen for too long
+        keep = self.frame - self.last_detected <= self.max_age
+        if not keep.all():
+            self._select(keep)
+
+    def _select(self, keep):
+        self._x, self._P = self._x[keep], self._P[keep]
+        self.ids, self.classes, self.conf = self.ids[keep], self.classes[keep], self.conf[keep]
+        self.hits, self.last_detected = self.hits[keep], self.last_detected[keep]
+
+    def update(self, frame, xyxy, conf, classes):
+        """Match a frame's detections to the tracks. Returns FrameBoxes of the detections with their track ids."""
+        self._advance(frame)
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        conf = np.asarray(conf, dtype=np.float32)
+        classes = np.asarray(list(classes), dtype=object)
+
+        iou = iou_matrix(to_xyxy(self._x), xyxy)
+        iou[self.classes[:, None] != classes[None, :]] = 0.0
+        rows, cols = greedy_match(iou, self.iou_threshold)
+
+        if len(rows):
+            z = to_cxcywh(xyxy[cols])
+            P = self._P[rows]
+            S = P[:, :4, :4] + self._noise(self._size(self._x[rows]), POSITION_STD, 0.0)[:, :4, :4]
+            K = P[:, :, :4] @ np.linalg.inv(S)
+            self._x[rows] += (K @ (z - self._x[rows, :4])[:, :, None])[:, :, 0]
+            self._P[rows] = P - K @ P[:, :4, :]
+            self.conf[rows] = conf[cols]
+            self.hits[rows] += 1
+            self.last_detected[rows] = self.frame
+
+        track_ids = np.full(len(xyxy), -1, dtype=np.int64)
+        track_ids[cols] = self.ids[rows]
+        new = np.nonzero(track_ids < 0)[0]
+        if len(new):
+            x = np.zeros((len(new), 8))
+            x[:, :4] = to_cxcywh(xyxy[new])
+            size = self._size(x)
+            self._x = np.concatenate([self._x, x])
+            self._P = np.concatenate([self._P, self._noise(size, 2 * POSITION_STD, 10 * VELOCITY_STD)])
+            new_ids = np.arange(self._next_id, self._next_id + len(new), dtype=np.int64)
+            self._next_id += len(new)
+            self.tracks_created += len(new)
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.classes = np.concatenate([self.classes, classes[new]])
+            self.conf = np.concatenate([self.conf, conf[new]])
+            self.hits = np.concatenate([self.hits, np.ones(len(new), dtype=np.int64)])
+            self.last_detected = np.concatenate([self.last_detected, np.full(len(new), self.frame, dtype=np.int64)])
+            track_ids[new] = new_ids
+        return FrameBoxes("detected", xyxy.astype(np.float32), conf, list(classes), track_ids)
+
+    def propagate(self, frame):
+        """FrameBoxes of the confirmed tracks predicted to a frame the detector skipped."""
+        self._advance(frame)
+        shown = self.hits >= self.min_hits
+        # confidence is the one of the track's last detection, not a measurement of this frame: confidence
+        # statistics have to skip box_source == "tracked" rows
+        return FrameBoxes("tracked", to_xyxy(self._x[shown]).astype(np.float32), self.conf[shown].copy(),
+                          self.classes[shown].tolist(), self.ids[shown].copy())
+
+    def uncertainty(self, frame=None):
+        """Largest predicted box centre standard deviation, as a fraction of the box size, at frame."""
+        x, P = self._predicted(frame)
+        if not len(x):
+            return 0.0
+        return float(np.max(np.sqrt(P[:, 0, 0] + P[:, 1, 1]) / self._size(x)))
+
+
+class DetectionSchedule:
+    """When to run the detector: shorter intervals at speed, and whenever tracks get too uncertain."""
+
+    def __init__(self, max_interval=8, min_interval=2, fast_speed_kmh=60.0, max_uncertainty=0.3):
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        self.fast_speed_kmh = fast_speed_kmh
+        self.max_uncertainty = max_uncertainty
+
+    def interval(self, speed_kmh):
+        """Frames between detector runs, max_interval standing still down to min_interval at fast_speed_kmh."""
+        fraction = min(1.0, max(0.0, speed_kmh / self.fast_speed_kmh))
+        return max(self.min_interval, int(round(self.max_interval - fraction * (self.max_interval - self.min_interval))))
+
+    def should_detect(self, frames_since, speed_kmh, uncertainty, min_interval=1):
+        if frames_since is None:
+            return True
+        if frames_since < min_interval:
+            return False  # the detector can't keep up with more
+        return uncertainty > self.max_uncertainty or frames_since >= self.interval(speed_kmh)
+
+
+class TrackerSet:
+    """A BoxTracker per camera plus the detect-or-track decision for every incoming frame.
+
+    should_detect() is called from sensor callbacks, detected()/tracked() from
+    the inference thread in frame order, so tracker access goes through a lock.
+    """
+
+    def __init__(self, schedule=None, speed_of=None, **tracker_kwargs):
+        self.schedule = schedule or DetectionSchedule()
+        # frame meta -> ego speed in km/h, the drive script's meta is vehicle_state()
+        self.speed_of = speed_of or (lambda meta: 0.0)
+        self.tracker_kwargs = tracker_kwargs
+        self.trackers = {}
+        self._last_detect = {}
+        self._lock = threading.Lock()
+        self.detected_frames = 0
+        self.tracked_frames = 0
+        self.detected_boxes = 0
+        self.tracked_boxes = 0
+        self.tracking_seconds = 0.0
+
+    def _tracker(self, source):
+        tracker = self.trackers.get(source)
+        if tracker is None:
+            tracker = self.trackers[source] = BoxTracker(**self.tracker_kwargs)
+        return tracker
+
+    def should_detect(self, source, frame, meta=None, min_interval=1):
+        """Decide for a new frame of a camera, the answer is remembered as that camera's last detector run."""
+        last = self._last_detect.get(source)
+        frames_since = frame - last if last is not None else None
+        with self._lock:
+            uncertainty = self._tracker(source).uncertainty(frame)
+        detect = self.schedule.should_detect(frames_since, self.speed_of(meta) if meta is not None else 0.0,
+                                             uncertainty, min_interval)
+        if detect:
+            self._last_detect[source] = frame
+        return detect
+
+    def detected(self, source, frame, result):
+        """FrameBoxes (with track ids) of the detector result of a frame."""
+        columns = detection_arrays(result, frame, source)
+        xyxy = np.stack([columns["x1"], columns["y1"], columns["x2"], columns["y2"]], axis=1)
+        return self.update(source, frame, xyxy, columns["confidence"], columns["class"])
+
+    def update(self, source, frame, xyxy, conf, classes):
+        start = time.perf_counter()
+        with self._lock:
+            boxes = self._tracker(source).update(frame, xyxy, conf, classes)
+            self.detected_frames += 1
+            self.detected_boxes += len(boxes)
+            self.tracking_seconds += time.perf_counter() - start
+        return boxes
+
+    def tracked(self, source, frame):
+        """FrameBoxes predicted for a frame the detector skipped."""
+        start = time.perf_counter()
+        with self._lock:
+            boxes = self._tracker(source).propagate(frame)
+            self.tracked_frames += 1
+            self.tracked_boxes += len(boxes)
+            self.tracking_seconds += time.perf_counter() - start
+        return boxes
+
+    def summary(self):
+        frames = self.detected_frames + self.tracked_frames
+        return {
+            "detected_frames": self.detected_frames,
+            "tracked_frames": self.tracked_frames,
+            "detector_fraction": self.detected_frames / frames if frames else None,
+            "detected_boxes": self.detected_boxes,
+            "tracked_boxes": self.tracked_boxes,
+            "tracks": sum(tracker.tracks_created for tracker in self.trackers.values()),
+            "tracking_ms_per_frame": self.tracking_seconds / frames * 1000 if frames else None,
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        if not stats["detector_fraction"]:
+            return
+        print(f"Tracker: detector on {stats['detected_frames']} of "
+              f"{stats['detected_frames'] + stats['tracked_frames']} frames ({stats['detector_fraction']:.0%}), "
+              f"{stats['tracked_boxes']} tracked boxes from {stats['tracks']} tracks, "
+              f"{stats['tracking_ms_per_frame']:.2f} ms tracking per frame")
+
+
+def read_detections(csv_path, telemetry_path=None):
+    """(frames, speed_kmh, {frame: (xyxy, conf, classes)}) of a replay_detection.py CSV.
+
+    Frames without boxes have no CSV rows, so the frame list (and speed) comes
+    from the recording's telemetry.csv when given. Tracked rows (box_source
+    "tracked", from a live run with TRACK_BOXES=1) are skipped, only detector
+    output is a reference.
+    """
+    boxes = {}
+    speeds = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            frame = int(row["frame_number"])
+            speeds[frame] = float(row["speed_kmh"])
+            if row.get("box_source") != "tracked":
+                boxes.setdefault(frame, []).append(row)
+    if telemetry_path:
+        with open(telemetry_path, newline="") as f:
+            for row in csv.DictReader(f):
+                speeds[int(row["frame_number"])] = float(row["speed_kmh"])
+        frames = sorted(speeds)
+    else:
+        frames = list(range(min(boxes), max(boxes) + 1)) if boxes else []
+
+    detections = {}
+    for frame, rows in boxes.items():
+        xyxy = np.array([[float(row[k]) for k in ("x1", "y1", "x2", "y2")] for row in rows])
+        detections[frame] = (xyxy, np.array([float(row["confidence"]) for row in rows], dtype=np.float32),
+                             [row["class"] for row in rows])
+    speed = np.array([speeds.get(frame, 0.0) for frame in frames])
+    return frames, speed, detections
+
+
+def _score(reference, output, match_iou):
+    """(reference boxes, output boxes, matched, IoU sum) of one frame, matches need the same class."""
+    ref_xyxy, _, ref_classes = reference
+    xyxy, classes = output
+    iou = iou_matrix(ref_xyxy, xyxy)
+    if iou.size:
+        iou[np.asarray(ref_classes, dtype=object)[:, None] != np.asarray(classes, dtype=object)[None, :]] = 0.0
+    rows, cols = greedy_match(iou, match_iou)
+    return len(ref_xyxy), len(xyxy), len(rows), float(iou[rows, cols].sum()) if len(rows) else 0.0
+
+
+def evaluate(frames, speed, detections, schedule=None, stride=4, match_iou=0.5, **tracker_kwargs):
+    """Replay the detect/track schedule and a fixed stride over per-frame detector output.
+
+    The detector's boxes on every frame are the reference: a strategy scores
+    the boxes it would have had on each frame (detector output on the frames it
+    runs the detector, tracked boxes or nothing on the others) against them.
+    """
+    empty = (np.zeros((0, 4)), np.zeros(0, dtype=np.float32), [])
+    tracker = TrackerSet(schedule=schedule, speed_of=float, **tracker_kwargs)
+    names = ("tracker", f"stride {stride}")
+    counts = {name: {"reference": 0, "output": 0, "matched": 0, "iou": 0.0, "runs": 0} for name in names}
+    for i, frame in enumerate(frames):
+        reference = detections.get(frame, empty)
+        if tracker.should_detect("camera", frame, speed[i]):
+            tracker.update("camera", frame, *reference)
+            tracked = ((reference[0], reference[2]), 1)
+        else:
+            boxes = tracker.tracked("camera", frame)
+            tracked = ((boxes.xyxy, boxes.classes), 0)
+        # the fixed stride has nothing at all between detector runs
+        strided = ((reference[0], reference[2]), 1) if i % stride == 0 else ((empty[0], empty[2]), 0)
+        for name, (output, run) in zip(names, (tracked, strided)):
+            reference_boxes, output_boxes, matched, iou_sum = _score(reference, output, match_iou)
+            totals = counts[name]
+            totals["reference"] += reference_boxes
+            totals["output"] += output_boxes
+            totals["matched"] += matched
+            totals["iou"] += iou_sum
+            totals["runs"] += run
+
+    results = {}
+    for name, totals in counts.items():
+        results[name] = {
+            "frames": len(frames),
+            "detector_runs": totals["runs"],
+            "detector_fraction": totals["runs"] / len(frames) if frames else None,
+            "recall": totals["matched"] / totals["reference"] if totals["reference"] else None,
+            "precision": totals["matched"] / totals["output"] if totals["output"] else None,
+            "mean_iou": totals["iou"] / totals["matched"] if totals["matched"] else None,
+        }
+    results["tracker"]["tracking_ms_per_frame"] = tracker.summary()["tracking_ms_per_frame"]
+    return results
+
+
+def print_evaluation(results):
+    print(f"{'':12s}{'detector runs':>16s}{'recall':>9s}{'precision':>11s}{'mean IoU':>10s}")
+    for name, stats in results.items():
+        cells = [f"{stats[key]:.3f}" if stats[key] is not None else "-" for key in ("recall", "precision", "mean_iou")]
+        print(f"{name:12s}{stats['detector_runs']:>8d} ({stats['detector_fraction']:4.0%}){cells[0]:>9s}"
+              f"{cells[1]:>11s}{cells[2]:>10s}")
+    if results["tracker"]["tracking_ms_per_frame"] is not None:
+        print(f"Tracking cost: {results['tracker']['tracking_ms_per_frame']:.2f} ms per frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    evaluate_parser = sub.add_parser("evaluate", help="replay the schedule over every-frame detections")
+    evaluate_parser.add_argument("csv", help="replay_detection.py output, the detector run on every frame")
+    evaluate_parser.add_argument("--telemetry", help="the recording's telemetry.csv (frames without boxes, speed)")
+    evaluate_parser.add_argument("--max-interval", type=int, default=8)
+    evaluate_parser.add_argument("--min-interval", type=int, default=2)
+    evaluate_parser.add_argument("--max-uncertainty", type=float, default=0.3)
+    evaluate_parser.add_argument("--stride", type=int, default=4, help="fixed stride to compare against")
+    evaluate_parser.add_argument("--output", help="also save the results as JSON")
+    args = parser.parse_args()
+
+    if args.command == "evaluate":
+        frames, speed, detections = read_detections(args.csv, args.telemetry)
+        schedule = DetectionSchedule(max_interval=args.max_interval, min_interval=args.min_interval,
+                                     max_uncertainty=args.max_uncertainty)
+        results = evaluate(frames, speed, detections, schedule, stride=args.stride)
+        print_evaluation(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
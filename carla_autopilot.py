@@ -1,45 +1,27 @@
 import carla
 import time
-import random
+
+from spawn_manager import SpawnManager
 
 client = carla.Client('localhost', 2000)
 client.set_timeout(10.0)
 world = client.get_world()
 
-blueprint_library = world.get_blueprint_library()
-
-# Get all vehicle blueprints
-vehicle_blueprints = blueprint_library.filter('vehicle.*')
-
-# Get all available spawn points
-spawn_points = world.get_map().get_spawn_points()
-
 number_of_vehicles = 10
+seed = 0  # same vehicles at the same spawn points every run
 
-# Shuffle the spawn points for random positions
-random.shuffle(spawn_points)
-vehicles_list = []
-
-for i in range(number_of_vehicles):
-    bp = random.choice(vehicle_blueprints)
-    spawn_point = spawn_points[i]
-    
-    vehicle = world.try_spawn_actor(bp, spawn_point)
-    if vehicle:
-        vehicle.set_autopilot(True)
-        vehicles_list.append(vehicle)
-        print(f"Spawned vehicle {vehicle.type_id} at {spawn_point.location}")
-    else:
-        print(f"Failed to spawn vehicle at {spawn_point.location}")
+# spawns in one batch (random blueprints at shuffled spawn points) and destroys everything on exit
+spawn_manager = SpawnManager(client, world, seed=seed)
 
 try:
+    vehicles_list = spawn_manager.spawn_vehicles(number_of_vehicles, 'vehicle.*', autopilot=True)
+    for vehicle in vehicles_list:
+        print(f"Spawned vehicle {vehicle.type_id} ({vehicle.id})")
+    spawn_manager.print_report()
+
     # Let the simulation run for a while
     time.sleep(30)
 finally:
     print("Destroying vehicles...")
-    for vehicle in vehicles_list:
-        vehicle.destroy()
-    print("Done.")
-
-
-
+    spawn_manager.destroy_all()
+    print("Done.")
\ No newline at end of file
@@ -0,0 +1,364 @@
+"""Rebuild the Figures/ confidence plots from any number of detection logs.
+
+Logs are streamed chunk by chunk (detection_data.csv style CSVs, or the
+telemetry directories written by telemetry_sink) and reduced to confidence
+histograms per class, per speed bin and per resolution with one bincount per
+chunk, so memory stays flat no matter how big the logs are. Quantiles, box
+stats and violin shapes all come from the histograms (bin width 0.001).
+
+Only detector output is counted: rows with box_source "tracked" (boxes the
+tracker carried over skipped frames, with the confidence of their last
+detection) are dropped unless detected_only=False (--include-tracked).
+
+Every log's histograms are cached next to its path, size and mtime, so adding
+a run only reads the new log:
+
+    python confidence_analysis.py detection_data.csv replay_results/*.csv --output Figures
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from detection_log import match_frames
+from telemetry_sink import iter_parts, read_table
+
+NUM_BINS = 1000
+BIN_EDGES = np.linspace(0.0, 1.0, NUM_BINS + 1)
+BIN_CENTERS = (BIN_EDGES[:-1] + BIN_EDGES[1:]) / 2
+DIMENSIONS = ("class", "speed_bin", "resolution")
+CACHE_DIR = os.path.join("cache", "confidence")
+CACHE_VERSION = 1
+CHUNK_ROWS = 200000
+BOX_COLOR = "#3274a1"
+
+
+class ConfidenceStats:
+    """Confidence histograms (and sums, for exact means) grouped by class, speed bin and resolution."""
+
+    def __init__(self, speed_bin_width=5.0):
+        self.speed_bin_width = speed_bin_width
+        self.histograms = {dimension: {} for dimension in DIMENSIONS}
+        self.sums = {dimension: {} for dimension in DIMENSIONS}
+        self.rows = 0
+
+    def speed_bins(self, speed_kmh):
+        # right-closed bins like the original plot, (0, 5] -> 0, (5, 10] -> 1, with 0 km/h in the first
+        return np.maximum(np.ceil(np.asarray(speed_kmh, dtype=np.float64) / self.speed_bin_width) - 1, 0).astype(np.int64)
+
+    def _add_grouped(self, dimension, keys, confidence_bins, confidence):
+        unique, codes = np.unique(keys, return_inverse=True)
+        codes = codes.ravel()
+        counts = np.bincount(codes * NUM_BINS + confidence_bins, minlength=len(unique) * NUM_BINS)
+        counts = counts.reshape(len(unique), NUM_BINS)
+        sums = np.bincount(codes, weights=confidence, minlength=len(unique))
+        histograms = self.histograms[dimension]
+        for i, key in enumerate(unique.tolist()):
+            if key in histograms:
+                histograms[key] += counts[i]
+                self.sums[dimension][key] += sums[i]
+            else:
+                histograms[key] = counts[i].copy()
+                self.sums[dimension][key] = float(sums[i])
+
+    def add_chunk(self, classes, confidence, speed_kmh, resolution):
+        """Fold one chunk of detections into the histograms."""
+        confidence = np.asarray(confidence, dtype=np.float64)
+        if len(confidence) == 0:
+            return
+        confidence_bins = np.clip((confidence * NUM_BINS).astype(np.int64), 0, NUM_BINS - 1)
+        self._add_grouped("class", np.asarray(classes).astype(str), confidence_bins, confidence)
+        self._add_grouped("speed_bin", self.speed_bins(speed_kmh), confidence_bins, confidence)
+        self._add_grouped("resolution", np.asarray(resolution).astype(np.int64), confidence_bins, confidence)
+        self.rows += len(confidence)
+
+    def merge(self, other):
+        for dimension in DIMENSIONS:
+            for key, histogram in other.histograms[dimension].items():
+                if key in self.histograms[dimension]:
+                    self.histograms[dimension][key] += histogram
+                    self.sums[dimension][key] += other.sums[dimension][key]
+                else:
+                    self.histograms[dimension][key] = histogram.copy()
+                    self.sums[dimension][key] = other.sums[dimension][key]
+        self.rows += other.rows
+        return self
+
+    def save(self, path, source):
+        data = {"version": np.array(CACHE_VERSION), "rows": np.array(self.rows),
+                "speed_bin_width": np.array(self.speed_bin_width), "source": np.array(source)}
+        for dimension in DIMENSIONS:
+            keys = list(self.histograms[dimension])
+            data[f"{dimension}_keys"] = np.array(keys)
+            data[f"{dimension}_histograms"] = (np.stack([self.histograms[dimension][key] for key in keys])
+                                               if keys else np.zeros((0, NUM_BINS), dtype=np.int64))
+            data[f"{dimension}_sums"] = np.array([self.sums[dimension][key] for key in keys], dtype=np.float64)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """(stats, source) from a cache file, None if it's from another version."""
+        with np.load(path) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                return None
+            stats = cls(float(data["speed_bin_width"]))
+            stats.rows = int(data["rows"])
+            for dimension in DIMENSIONS:
+                keys = data[f"{dimension}_keys"].tolist()
+                for key, histogram, total in zip(keys, data[f"{dimension}_histograms"], data[f"{dimension}_sums"]):
+                    stats.histograms[dimension][key] = histogram.astype(np.int64)
+                    stats.sums[dimension][key] = float(total)
+            return stats, data["source"].item()
+
+    def keys(self, dimension):
+        return sorted(self.histograms[dimension])
+
+    def count(self, dimension, key):
+        return int(self.histograms[dimension][key].sum())
+
+    def mean(self, dimension, key):
+        count = self.count(dimension, key)
+        return self.sums[dimension][key] / count if count else float("nan")
+
+    def quantiles(self, dimension, key, qs):
+        return histogram_quantiles(self.histograms[dimension][key], qs)
+
+    def speed_label(self, speed_bin):
+        low = speed_bin * self.speed_bin_width
+        return f"({low:.1f}, {low + self.speed_bin_width:.1f}]"
+
+
+def histogram_quantiles(histogram, qs):
+    """Quantiles of the binned values, linearly interpolated inside the bin."""
+    cumulative = np.cumsum(histogram)
+    total = cumulative[-1]
+    if total == 0:
+        return np.full(len(qs), np.nan)
+    targets = np.asarray(qs, dtype=np.float64) * total
+    index = np.clip(np.searchsorted(cumulative, targets, side="left"), 0, NUM_BINS - 1)
+    before = np.where(index > 0, cumulative[index - 1], 0)
+    inside = np.where(histogram[index] > 0, (targets - before) / np.maximum(histogram[index], 1), 0.0)
+    return BIN_EDGES[index] + np.clip(inside, 0.0, 1.0) / NUM_BINS
+
+
+def iter_csv_chunks(path, chunk_rows=CHUNK_ROWS, detected_only=True):
+    """(classes, confidence, speed_kmh, resolution) arrays for chunk_rows rows at a time."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [header.index(name) for name in ("class", "confidence", "speed_kmh", "resolution")]
+        # logs from before the tracker have no box_source, all their rows are detector output
+        source = header.index("box_source") if detected_only and "box_source" in header else None
+        chunk = []
+        for row in reader:
+            if source is not None and row[source] == "tracked":
+                continue
+            chunk.append([row[i] for i in columns])
+            if len(chunk) == chunk_rows:
+                yield _chunk_arrays(chunk)
+                chunk = []
+        if chunk:
+            yield _chunk_arrays(chunk)
+
+
+def _chunk_arrays(chunk):
+    classes, confidence, speed, resolution = zip(*chunk)
+    return (np.array(classes), np.array(confidence, dtype=np.float64), np.array(speed, dtype=np.float64),
+            np.array(resolution, dtype=np.float64))
+
+
+def iter_telemetry_chunks(directory, detected_only=True):
+    """Same chunks from a telemetry_sink directory, one detections part at a time."""
+    frames = read_table(directory, "frames", columns=["sensor", "frame_number", "speed_kmh", "resolution"])
+    if not frames:
+        return
+    columns = ["sensor", "frame_number", "class", "confidence", "box_source"]
+    for part in iter_parts(directory, "detections", columns=columns):
+        matched, rows = match_frames(frames, part)
+        if detected_only and "box_source" in part:
+            detected = part["box_source"][matched] != "tracked"
+            matched[matched] = detected
+            rows = rows[detected]
+        yield (part["class"][matched], part["confidence"][matched],
+               frames["speed_kmh"][rows], frames["resolution"][rows])
+
+
+def file_stats(path, speed_bin_width=5.0, cache_dir=CACHE_DIR, detected_only=True):
+    """ConfidenceStats for one log, from the cache when the log hasn't changed since."""
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        parts = sorted(glob.glob(os.path.join(path, "*", "part-*")))
+        stamp = f"{len(parts)}:{sum(os.path.getsize(p) for p in parts)}:{max((os.path.getmtime(p) for p in parts), default=0)}"
+    else:
+        stamp = f"{os.path.getsize(path)}:{os.path.getmtime(path)}"
+    source = f"{path}|{stamp}|{speed_bin_width}|{'detected' if detected_only else 'all'}"
+
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        key = path if detected_only else path + "|all"
+        cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npz")
+        if os.path.exists(cache_path):
+            cached = ConfidenceStats.load(cache_path)
+            if cached is not None and cached[1] == source:
+                return cached[0], True
+
+    stats = ConfidenceStats(speed_bin_width)
+    chunks = (iter_telemetry_chunks(path, detected_only) if os.path.isdir(path)
+              else iter_csv_chunks(path, detected_only=detected_only))
+    for classes, confidence, speed, resolution in chunks:
+        stats.add_chunk(classes, confidence, speed, resolution)
+    if cache_path:
+        stats.save(cache_path, source)
+    return stats, False
+
+
+def analyze(paths, speed_bin_width=5.0, cache_dir=CACHE_DIR, detected_only=True):
+    """Merged ConfidenceStats over every log, detector output only unless detected_only=False."""
+    start = time.perf_counter()
+    total = ConfidenceStats(speed_bin_width)
+    cached = 0
+    for path in paths:
+        stats, hit = file_stats(path, speed_bin_width, cache_dir, detected_only)
+        total.merge(stats)
+        cached += hit
+    print(f"{total.rows} detections from {len(paths)} logs ({cached} cached) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return total
+
+
+def box_stats(histogram, label):
+    """matplotlib bxp() stats from a histogram, whiskers at 1.5 IQR like the seaborn plots."""
+    q1, median, q3 = histogram_quantiles(histogram, (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    occupied = BIN_CENTERS[histogram > 0]
+    inside = occupied[(occupied >= q1 - 1.5 * iqr) & (occupied <= q3 + 1.5 * iqr)]
+    return {
+        "label": label, "med": median, "q1": q1, "q3": q3,
+        "whislo": inside.min() if len(inside) else q1, "whishi": inside.max() if len(inside) else q3,
+        # one marker per occupied bin outside the whiskers
+        "fliers": occupied[(occupied < q1 - 1.5 * iqr) | (occupied > q3 + 1.5 * iqr)],
+    }
+
+
+def violin_stats(histogram, bandwidth_bins=15):
+    """matplotlib violin() stats, the histogram smoothed with a gaussian kernel."""
+    kernel = np.exp(-0.5 * (np.arange(-3 * bandwidth_bins, 3 * bandwidth_bins + 1) / bandwidth_bins) ** 2)
+    density = np.convolve(histogram, kernel / kernel.sum(), mode="same")
+    occupied = np.nonzero(histogram)[0]
+    low, high = occupied[0], occupied[-1] + 1
+    median = histogram_quantiles(histogram, (0.5,))[0]
+    return {"coords": BIN_CENTERS[low:high], "vals": density[low:high], "mean": median, "median": median,
+            "min": BIN_CENTERS[low], "max": BIN_CENTERS[high - 1]}
+
+
+def render_figures(stats, output_dir="Figures"):
+    """Write the three Figures/ plots, returns their paths."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+
+    classes = [key for key in stats.keys("class") if stats.count("class", key)]
+    fig, ax = plt.subplots(figsize=(10.5, 8.3))
+    if classes:
+        violins = [violin_stats(stats.histograms["class"][key]) for key in classes]
+        positions = np.arange(len(classes))
+        parts = ax.violin(violins, positions=positions, widths=0.8, showextrema=False)
+        for body in parts["bodies"]:
+            body.set_facecolor(BOX_COLOR)
+            body.set_edgecolor("#3f3f3f")
+            body.set_alpha(1.0)
+        for position, key, violin in zip(positions, classes, violins):
+            # quartile lines across the violin, like seaborn's inner="quart"
+            scale = 0.4 / violin["vals"].max()
+            for q, style in zip(stats.quantiles("class", key, (0.25, 0.5, 0.75)), (":", "--", ":")):
+                half = np.interp(q, violin["coords"], violin["vals"]) * scale
+                ax.plot([position - half, position + half], [q, q], color="#3f3f3f", linestyle=style, linewidth=1)
+        ax.set_xticks(positions)
+        ax.set_xticklabels(classes, rotation=45)
+    ax.set_xlabel("class")
+    ax.set_ylabel("confidence")
+    ax.set_title("Class-Specific Confidence Distributions")
+    paths.append(_save(fig, output_dir, "Class-Specific Confidence Distributions.png"))
+
+    speed_bins = [key for key in stats.keys("speed_bin") if stats.count("speed_bin", key)]
+    fig, ax = plt.subplots(figsize=(12, 8))
+    _boxplot(ax, [box_stats(stats.histograms["speed_bin"][key], stats.speed_label(key)) for key in speed_bins])
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.set_xlabel("speed_bin")
+    ax.set_ylabel("confidence")
+    ax.set_title("Confidence Distribution Across Speed Ranges (km/h)")
+    paths.append(_save(fig, output_dir, "Confidence Distribution Across Speed Ranges.png"))
+
+    resolutions = [key for key in stats.keys("resolution") if stats.count("resolution", key)]
+    fig, ax = plt.subplots(figsize=(8.7, 5.6))
+    _boxplot(ax, [box_stats(stats.histograms["resolution"][key], str(key)) for key in resolutions])
+    ax.set_xlabel("resolution")
+    ax.set_ylabel("confidence")
+    ax.set_title("Overall Confidence Distribution by Resolution")
+    paths.append(_save(fig, output_dir, "Overall Confidence Distribution by Resolution.png"))
+    return paths
+
+
+def _boxplot(ax, boxes):
+    if not boxes:
+        return
+    ax.bxp(boxes, widths=0.8, patch_artist=True, showfliers=True,
+           boxprops={"facecolor": BOX_COLOR, "edgecolor": "#3f3f3f"},
+           medianprops={"color": "#3f3f3f"}, whiskerprops={"color": "#3f3f3f"}, capprops={"color": "#3f3f3f"},
+           flierprops={"marker": "o", "markerfacecolor": "none", "markeredgecolor": "#3f3f3f"})
+
+
+def _save(fig, output_dir, name):
+    path = os.path.join(output_dir, name)
+    fig.tight_layout()
+    fig.savefig(path)
+    fig.clf()
+    return path
+
+
+def print_summary(stats):
+    for dimension in DIMENSIONS:
+        print(dimension)
+        for key in stats.keys(dimension):
+            count = stats.count(dimension, key)
+            if not count:
+                continue
+            label = stats.speed_label(key) if dimension == "speed_bin" else key
+            q1, median, q3 = stats.quantiles(dimension, key, (0.25, 0.5, 0.75))
+            print(f"  {label}: {count} detections, mean {stats.mean(dimension, key):.3f}, "
+                  f"median {median:.3f}, IQR {q1:.3f}-{q3:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confidence plots from detection logs")
+    parser.add_argument("logs", nargs="+", help="detection CSVs or telemetry directories")
+    parser.add_argument("--output", default="Figures")
+    parser.add_argument("--speed-bin", type=float, default=5.0, help="speed bin width in km/h")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="empty string to disable the cache")
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("--include-tracked", action="store_true",
+                        help="also count tracker-propagated boxes (box_source tracked)")
+    args = parser.parse_args()
+
+    stats = analyze(args.logs, args.speed_bin, args.cache_dir or None, detected_only=not args.include_tracked)
+    print_summary(stats)
+    if not args.no_plots:
+        for path in render_figures(stats, args.output):
+            print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
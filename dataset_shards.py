@@ -0,0 +1,261 @@
+"""Sharded dataset format for the ambulance imitation-learning data.
+
+Instead of one {frame}.jpg per frame plus controls.csv, samples are packed
+WebDataset style into fixed size tar shards ({frame}.jpg + {frame}.json per
+sample). index.json lists every sample with its shard, byte offset and size
+and its steering/throttle/brake labels, so readers can memory-map a shard and
+slice JPEGs out of it without parsing tar headers.
+
+Usage:
+    python dataset_shards.py convert D:/dataset/ D:/dataset_shards/
+    python dataset_shards.py bench D:/dataset_shards/
+"""
+import csv
+import io
+import json
+import mmap
+import os
+import sys
+import tarfile
+import threading
+import time
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# frames encoder threads may deliver images out of order by, pending controls/images older than this are dropped
+REORDER_FRAMES = 64
+
+
+class ShardWriter:
+    """Packs frames and their control labels into tar shards.
+
+    Images (from the image writer's encoder threads) and controls (from the
+    main loop) arrive separately, a sample is written once both halves for a
+    frame are in. Controls of frames that never get an image (e.g. capture
+    paused), and images that never get controls, are dropped once a sample
+    reorder_frames newer has been written.
+    Can be used as the sink of image_writer.AsyncImageWriter.
+    """
+
+    def __init__(self, output_dir, samples_per_shard=1000, prefix="shard", reorder_frames=REORDER_FRAMES):
+        self.output_dir = output_dir
+        self.samples_per_shard = samples_per_shard
+        self.prefix = prefix
+        self.reorder_frames = reorder_frames
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._images = {}
+        self._controls = {}
+        self._tar = None
+        self._tar_path = None
+        self._shard_samples = []
+        self.shards = []
+        self.unlabeled = 0
+
+    def write(self, frame, jpeg_bytes):
+        """Image writer sink interface."""
+        self.add_image(frame, jpeg_bytes)
+
+    def add_image(self, frame, jpeg_bytes):
+        with self._lock:
+            controls = self._controls.pop(frame, None)
+            if controls is None:
+                self._images[frame] = jpeg_bytes
+            else:
+                self._add_sample(frame, jpeg_bytes, controls)
+
+    def add_controls(self, frame, steering, throttle, brake):
+        with self._lock:
+            controls = (float(steering), float(throttle), float(brake))
+            jpeg_bytes = self._images.pop(frame, None)
+            if jpeg_bytes is None:
+                self._controls[frame] = controls
+            else:
+                self._add_sample(frame, jpeg_bytes, controls)
+
+    def _add_sample(self, frame, jpeg_bytes, controls):
+        if self._tar is None:
+            name = f"{self.prefix}-{len(self.shards):06d}.tar"
+            self._tar_path = os.path.join(self.output_dir, name)
+            self._tar = tarfile.open(self._tar_path + ".tmp", "w", format=tarfile.USTAR_FORMAT)
+            self._shard_samples = []
+
+        key = f"{frame:010d}"
+        offset = self._add_member(key + ".jpg", jpeg_bytes)
+        steering, throttle, brake = controls
+        label = json.dumps({"frame": frame, "steering": steering, "throttle": throttle, "brake": brake})
+        self._add_member(key + ".json", label.encode("utf-8"))
+        self._shard_samples.append([frame, offset, len(jpeg_bytes), steering, throttle, brake])
+        self._drop_stale(self._controls, frame - self.reorder_frames)
+        self._drop_stale(self._images, frame - self.reorder_frames)
+
+        if len(self._shard_samples) >= self.samples_per_shard:
+            self._finish_shard()
+
+    def _drop_stale(self, pending, oldest_frame):
+        # both halves arrive in (nearly) frame order, so the stale ones are at the front of the dict
+        while pending:
+            frame = next(iter(pending))
+            if frame >= oldest_frame:
+                break
+            del pending[frame]
+            self.unlabeled += 1
+
+    def _add_member(self, name, data):
+        """Append a member to the open shard and return the byte offset of its data."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # the tar offset now sits after the data padded to a whole block
+        padded = (len(data) + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+        return self._tar.offset - padded
+
+    def _finish_shard(self):
+        self._tar.close()
+        os.replace(self._tar_path + ".tmp", self._tar_path)
+        self.shards.append({"name": os.path.basename(self._tar_path), "samples": self._shard_samples})
+        self._tar = None
+        self._shard_samples = []
+
+    def close(self):
+        """Close the last shard and write index.json."""
+        with self._lock:
+            if self._tar is not None:
+                self._finish_shard()
+            # frames that never got both an image and controls can't be used for training
+            self.unlabeled += len(self._images) + len(self._controls)
+            self._images.clear()
+            self._controls.clear()
+            index = {
+                "samples_per_shard": self.samples_per_shard,
+                "fields": ["frame", "offset", "size", "steering", "throttle", "brake"],
+                "shards": self.shards,
+            }
+            tmp_path = os.path.join(self.output_dir, INDEX_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, os.path.join(self.output_dir, INDEX_FILE))
+
+        total = sum(len(shard["samples"]) for shard in self.shards)
+        print(f"Wrote {total} samples in {len(self.shards)} shards to {self.output_dir} "
+              f"({self.unlabeled} unpaired frames skipped)")
+
+
+def _release(view):
+    try:
+        view.release()
+    except BufferError:
+        pass  # the consumer still exports it, freed together with that export
+
+
+class ShardReader:
+    """Streams (frame, jpeg, (steering, throttle, brake)) samples out of shards.
+
+    mode="mmap" memory-maps each shard and yields memoryview slices (zero
+    copy), mode="read" reads each shard with one sequential read. The jpeg
+    view is only valid until the next sample, copy it with bytes() to keep it.
+    A consumer still holding an export of it (e.g. np.frombuffer(jpeg)) when
+    the reader moves on or the loop is left doesn't break the reader: the
+    view, and in mmap mode the shard's mapping, are then freed with that
+    export instead of released right away.
+    """
+
+    def __init__(self, dataset_dir, mode="mmap"):
+        if mode not in ("mmap", "read"):
+            raise ValueError(f"Unknown read mode {mode!r}, expected 'mmap' or 'read'")
+        self.dataset_dir = dataset_dir
+        self.mode = mode
+        with open(os.path.join(dataset_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.shards = self.index["shards"]
+
+    def __len__(self):
+        return sum(len(shard["samples"]) for shard in self.shards)
+
+    def frames(self):
+        """Frame numbers in dataset order."""
+        return [sample[0] for shard in self.shards for sample in shard["samples"]]
+
+    def labels(self):
+        """(steering, throttle, brake) rows in dataset order."""
+        return [tuple(sample[3:6]) for shard in self.shards for sample in shard["samples"]]
+
+    def iter_shard(self, shard_number):
+        shard = self.shards[shard_number]
+        path = os.path.join(self.dataset_dir, shard["name"])
+        with open(path, "rb") as f:
+            if self.mode == "mmap":
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+            view = memoryview(buffer)
+            try:
+                for frame, offset, size, steering, throttle, brake in shard["samples"]:
+                    jpeg = view[offset:offset + size]
+                    try:
+                        yield frame, jpeg, (steering, throttle, brake)
+                    finally:
+                        _release(jpeg)
+            finally:
+                _release(view)
+                if self.mode == "mmap":
+                    try:
+                        buffer.close()
+                    except BufferError:
+                        pass  # unmapped when the consumer drops its export
+
+    def __iter__(self):
+        for shard_number in range(len(self.shards)):
+            yield from self.iter_shard(shard_number)
+
+
+def convert_flat_dataset(source_dir, output_dir, samples_per_shard=1000):
+    """Pack an existing {frame}.jpg + controls.csv dataset into shards."""
+    writer = ShardWriter(output_dir, samples_per_shard)
+    missing = 0
+    with open(os.path.join(source_dir, "controls.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            frame = int(row["frame"])
+            img_filename = os.path.join(source_dir, f"{frame}.jpg")
+            if not os.path.exists(img_filename):
+                missing += 1
+                continue
+            with open(img_filename, "rb") as img_file:
+                writer.add_image(frame, img_file.read())
+            writer.add_controls(frame, row["steering"], row["throttle"], row["brake"])
+    writer.close()
+    if missing:
+        print(f"{missing} frames in controls.csv had no image")
+    return writer
+
+
+def benchmark_read(dataset_dir, mode="mmap"):
+    """Sequential read throughput over every sample, touching each JPEG's bytes."""
+    reader = ShardReader(dataset_dir, mode)
+    start = time.perf_counter()
+    total_bytes = 0
+    count = 0
+    checksum = 0
+    for _, jpeg, _ in reader:
+        total_bytes += jpeg.nbytes
+        # sum every byte, so the mmap path pages in as much data as the read path copies
+        checksum += int(np.frombuffer(jpeg, np.uint8).sum())
+        count += 1
+    elapsed = time.perf_counter() - start
+    rate = total_bytes / 1e9 / elapsed if elapsed > 0 else float("inf")
+    print(f"{mode}: {count} samples, {total_bytes / 1e6:.1f} MB in {elapsed:.3f}s ({rate:.2f} GB/s)")
+    return rate
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        convert_flat_dataset(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "bench":
+        benchmark_read(sys.argv[2], "mmap")
+        benchmark_read(sys.argv[2], "read")
+    else:
+        print(__doc__)
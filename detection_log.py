@@ -0,0 +1,140 @@
+"""Row layout of detection_data.csv shared by the live and offline detection scripts.
+
+The live run logs through telemetry_sink instead of row by row: ego state
+goes into a "frames" table once per frame and camera, boxes into a
+"detections" table keyed by (sensor, frame). export_detection_csv() joins
+them back into the 18 columns. box_source tells detector output ("detected")
+from boxes box_tracker.py predicted for a frame the detector skipped
+("tracked"), track_id is -1 for rows logged without a tracker.
+"""
+import csv
+
+import numpy as np
+
+from telemetry_sink import CATEGORY, csv_values, read_table
+
+DETECTION_COLUMNS = [
+    'frame_number', 'timestamp', 'class', 'confidence',
+    'x1', 'y1', 'x2', 'y2', 'speed_kmh', 'location_x',
+    'location_y', 'location_z', 'velocity_x', 'velocity_y',
+    'velocity_z', 'resolution', 'box_source', 'track_id'  # 18 columns total
+]
+
+FRAME_SCHEMA = [
+    ('sensor', CATEGORY), ('frame_number', np.int64), ('timestamp', np.float64), ('speed_kmh', np.float32),
+    ('location_x', np.float32), ('location_y', np.float32), ('location_z', np.float32),
+    ('velocity_x', np.float32), ('velocity_y', np.float32), ('velocity_z', np.float32),
+    ('resolution', np.int16),
+]
+
+DETECTION_SCHEMA = [
+    ('sensor', CATEGORY), ('frame_number', np.int64), ('class', CATEGORY), ('confidence', np.float32),
+    ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32),
+    ('box_source', CATEGORY), ('track_id', np.int64),
+]
+
+
+def vehicle_state(vehicle):
+    """(speed_kmh, (x, y, z), (vx, vy, vz)) of a vehicle, read once per frame."""
+    location = vehicle.get_transform().location
+    velocity = vehicle.get_velocity()
+    speed_kmh = 3.6 * velocity.length()
+    return speed_kmh, (location.x, location.y, location.z), (velocity.x, velocity.y, velocity.z)
+
+
+def detection_rows(result, frame, timestamp, state, resolution):
+    """CSV rows for every box of one ultralytics result."""
+    speed_kmh, location, velocity = state
+    boxes = result.boxes
+    # one tensor -> list conversion per field instead of .item() per box
+    xyxy = boxes.xyxy.tolist()
+    confs = boxes.conf.tolist()
+    classes = boxes.cls.tolist()
+    rows = []
+    for (x1, y1, x2, y2), conf, cls in zip(xyxy, confs, classes):
+        rows.append([
+            frame,
+            timestamp,
+            result.names[int(cls)],
+            conf,
+            x1,
+            y1,
+            x2,
+            y2,
+            speed_kmh,
+            location[0],
+            location[1],
+            location[2],
+            velocity[0],
+            velocity[1],
+            velocity[2],
+            resolution,
+            'detected',
+            -1
+        ])
+    return rows
+
+
+def frame_record(frame, timestamp, state, resolution, sensor='camera'):
+    """One FRAME_SCHEMA row."""
+    speed_kmh, location, velocity = state
+    return (sensor, frame, timestamp, speed_kmh, *location, *velocity, resolution)
+
+
+def detection_arrays(result, frame, sensor='camera'):
+    """DETECTION_SCHEMA columns for every box of one ultralytics result."""
+    boxes = result.boxes
+    xyxy = boxes.xyxy.cpu().numpy()
+    return {
+        'sensor': [sensor] * len(xyxy),
+        'frame_number': np.full(len(xyxy), frame, dtype=np.int64),
+        'class': [result.names[int(cls)] for cls in boxes.cls.tolist()],
+        'confidence': boxes.conf.cpu().numpy(),
+        'x1': xyxy[:, 0], 'y1': xyxy[:, 1], 'x2': xyxy[:, 2], 'y2': xyxy[:, 3],
+        'box_source': ['detected'] * len(xyxy), 'track_id': np.full(len(xyxy), -1, dtype=np.int64),
+    }
+
+
+def match_frames(frames, detections):
+    """(matched, frame_rows): which detections have a frame row, and that row, joined on (sensor, frame)."""
+    num_frames = len(frames['frame_number'])
+    if 'sensor' in frames and 'sensor' in detections:
+        sensors = np.concatenate([frames['sensor'], detections['sensor']]).astype(str)
+        _, codes = np.unique(sensors, return_inverse=True)
+        codes = codes.ravel().astype(np.int64)
+        num_sensors = int(codes.max()) + 1 if len(codes) else 1
+        frame_keys = frames['frame_number'] * num_sensors + codes[:num_frames]
+        detection_keys = detections['frame_number'] * num_sensors + codes[num_frames:]
+    else:
+        frame_keys, detection_keys = frames['frame_number'], detections['frame_number']
+    if num_frames == 0:
+        return np.zeros(len(detection_keys), dtype=bool), np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(frame_keys, kind='stable')
+    sorted_keys = frame_keys[order]
+    position = np.searchsorted(sorted_keys, detection_keys).clip(0, num_frames - 1)
+    # a detection without its frame row can only come from a log cut off mid-flush
+    matched = sorted_keys[position] == detection_keys
+    return matched, order[position[matched]]
+
+
+def export_detection_csv(telemetry_dir, csv_path):
+    """Join the frames and detections tables back into detection_data.csv, returns the row count."""
+    frames = read_table(telemetry_dir, 'frames')
+    detections = read_table(telemetry_dir, 'detections')
+    rows = []
+    if frames and detections:
+        matched, frame_rows = match_frames(frames, detections)
+        # logs from before the tracker have neither column, all their boxes are detector output
+        count = int(matched.sum())
+        defaults = {'box_source': np.full(count, 'detected'), 'track_id': np.full(count, -1, dtype=np.int64)}
+        columns = [detections[column][matched] if column in detections
+                   else frames[column][frame_rows] if column in frames else defaults[column]
+                   for column in DETECTION_COLUMNS]
+        rows = zip(*(csv_values(column) for column in columns))
+
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(DETECTION_COLUMNS)
+        writer.writerows(rows)
+    return int(matched.sum()) if frames and detections else 0
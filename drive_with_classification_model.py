@@ -1,13 +1,25 @@
 import sys
 import os
+import time
+
+process_start = time.perf_counter()  # startup times below count from here
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 import carla
-import pygame
-from pygame.locals import *
 import numpy as np
-import torch
 import cv2
-from ultralytics import YOLO
-import csv
+
+from box_tracker import DetectionSchedule, TrackerSet
+from detection_log import (DETECTION_SCHEMA, FRAME_SCHEMA, detection_arrays, export_detection_csv,
+                           frame_record, vehicle_state)
+from inference_pipeline import InferencePipeline
+from model_cache import load_models, warm_up
+from replay_detection import DriveRecorder
+from runtime_metrics import callback_metrics, controller_seconds, start_exporter, tick_metrics
+from sensor_rig import SensorRig, parse_rig
+from telemetry_sink import TelemetrySink
 
 # Yolov12 provided by Ultralytics
 '''
@@ -47,27 +59,73 @@ if not carla_path:
     )
 sys.path.append(carla_path)
 
-# load yolov12 medium classification model
-model = YOLO("yolo12m.pt")
-model.eval()
+# yolov12 medium classification model, YOLO_MODEL=yolo12n.pt YOLO_DEVICE=cpu for cpu-only machines
+model_path = os.environ.get("YOLO_MODEL", "yolo12m.pt")
+device = os.environ.get("YOLO_DEVICE")
+
+# loads the .pt as before, YOLO_FORMAT=onnx (or torchscript) exports once per camera resolution and caches
+# the export in cache/models (model_cache.py)
+model_format = os.environ.get("YOLO_FORMAT", "pt")
+
+# frames per model() call, can mix frames from several cameras
+batch_size = int(os.environ.get("YOLO_BATCH_SIZE", "4"))
+if model_format == "torchscript":
+    batch_size = 1  # traced at a fixed batch, partial batches would fail
+
+# record every camera frame + telemetry for offline replay (replay_detection.py)
+record_dir = os.environ.get("DETECTION_RECORD_DIR")
+
+# cameras on the ambulance, e.g. SENSOR_RIG=224,320,640 compares three resolutions in one drive (see sensor_rig.py)
+sensor_rig = parse_rig(os.environ.get("SENSOR_RIG", "320"))
 
-# set up pygame window to display inference
-pygame.init()
-screen = pygame.display.set_mode((640, 600))
-pygame.display.set_caption("YOLOv12m object detection")
+# TRACK_BOXES=1 runs the detector on some frames and tracks boxes on the rest (box_tracker.py), more often the faster
+# we drive, DETECT_MAX_INTERVAL caps the frames between runs. Off by default: tracked rows repeat the confidence of
+# their track's last detection, so only box_source == "detected" rows belong in confidence statistics
+track_boxes = os.environ.get("TRACK_BOXES", "0") == "1"
+detect_max_interval = int(os.environ.get("DETECT_MAX_INTERVAL", "8"))
+
+# live tick/callback/inference metrics on http://127.0.0.1:METRICS_PORT/metrics (default 9100, 0 = off),
+# snapshot in telemetry/metrics.json every METRICS_INTERVAL seconds (runtime_metrics.py)
+world_tick_seconds, tick_seconds, ticks_total = tick_metrics()
+callback_seconds, callback_frame_lag = callback_metrics("camera_callback")
+render_seconds = controller_seconds("render")
+
+# HEADLESS=1 runs without the pygame window (CI, render nodes), MAX_TICKS=n stops the drive after n ticks
+headless = os.environ.get("HEADLESS", "0") == "1"
+max_ticks = int(os.environ.get("MAX_TICKS", "0"))
+
+# seconds since process start of each startup step, written to telemetry/startup.json
+startup = {}
+
+def mark(step):
+    startup.setdefault(step, time.perf_counter() - process_start)
+
+def prepare_model(imgsz_values):
+    # load (or export once) the model for every camera resolution, then warm it up before the first tick
+    model, infos = load_models(model_path, imgsz_values, model_format, batch=batch_size, device=device)
+    mark('model_loaded_s')
+    warm_up(model, imgsz_values, batch=batch_size, device=device)
+    mark('model_warm_s')
+    return model, infos
 
 def main():
-    global frame_count
-    frame_count = 0
-    
-    csv_file = open('detection_data.csv', 'w', newline='')
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow([
-    'frame_number', 'timestamp', 'class', 'confidence', 
-    'x1', 'y1', 'x2', 'y2', 'speed_kmh', 'location_x', 
-    'location_y', 'location_z', 'velocity_x', 'velocity_y', 
-    'velocity_z', 'resolution'  # 16 columns total
-])
+    mark('imports_s')
+    # the model loads and warms up on its own thread while we connect and spawn
+    imgsz_values = [spec.resolution for spec in sensor_rig]
+    loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-loader')
+    model_future = loader.submit(prepare_model, imgsz_values)
+
+    if not headless:
+        # pygame only when there is a window to show detections in
+        import pygame
+        pygame.init()
+        screen = pygame.display.set_mode((640, 600))
+        pygame.display.set_caption("YOLOv12m object detection")
+        mark('display_s')
+
+    # columnar log, ego state once per frame + boxes per frame, exported to detection_data.csv at the end
+    telemetry = TelemetrySink('telemetry', {'frames': FRAME_SCHEMA, 'detections': DETECTION_SCHEMA})
+    metrics = start_exporter(os.path.join(telemetry.directory, 'metrics.json'))
     
     client = carla.Client('192.168.1.124', 2000)
     client.set_timeout(10.0)
@@ -89,98 +147,135 @@ def main():
     vehicle = world.spawn_actor(vehicle_bp, spawn_point)
     vehicle.set_autopilot(True, tm.get_port())
 
-    # set up rgb camera sensor
-    camera_bp = blueprint_library.find('sensor.camera.rgb')
-    camera_bp.set_attribute('image_size_x', '320')
-    camera_bp.set_attribute('image_size_y', '320')
+    # set up rgb camera sensors, every camera runs inference at its own resolution
+    rig = SensorRig(world, vehicle, sensor_rig)
+    resolutions = rig.imgsz_by_source()
+    mark('carla_ready_s')
 
-    camera = world.spawn_actor(
-        camera_bp,
-        carla.Transform(carla.Location(x=1.5, z=2.0)),
-        attach_to=vehicle
-    )
-    
-    latest_surface = None
+    model, model_infos = model_future.result()
+    loader.shutdown()
+    mark('model_ready_s')
 
-    def camera_callback(image):
-        global frame_count, current_resolution
-        nonlocal latest_surface
-        current_resolution = 320
-        if frame_count % 4 == 0:
-            array = np.frombuffer(image.raw_data, dtype=np.uint8)
-            array = array.reshape((image.height, image.width, 4))[:, :, :3]
-            img = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
-
-            results = list(model(img, imgsz=current_resolution, stream=True, conf=0.5))
-            
-            if results:
-                result = results[0]
-                vehicle_location = vehicle.get_transform().location
-                vehicle_velocity = vehicle.get_velocity()
-                speed_kmh = 3.6 * vehicle_velocity.length()
-
-                for box in result.boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    conf = box.conf.item()
-                    cls = box.cls.item()
-                    label = result.names[int(cls)]
-                    
-                    csv_writer.writerow([
-                        image.frame,
-                        image.timestamp,
-                        label,
-                        conf,
-                        x1,  
-                        y1,  
-                        x2,  
-                        y2,  
-                        speed_kmh,
-                        vehicle_location.x,
-                        vehicle_location.y,
-                        vehicle_location.z,
-                        vehicle_velocity.x,
-                        vehicle_velocity.y,
-                        vehicle_velocity.z,
-                        current_resolution
-                    ])
-
-                rendered_img = result.plot()
-                
-                rendered_img = cv2.cvtColor(rendered_img, cv2.COLOR_BGR2RGB)
-                rendered_img = cv2.resize(rendered_img, (640, 600))
-                
-                # update pygame surface
-                surface = pygame.surfarray.make_surface(rendered_img.swapaxes(0, 1))
-                latest_surface = surface
+    # runs on the inference thread once detections (or tracked boxes, result None) for a frame are available
+    def write_detections(record, result):
+        if result is not None and 'first_inference_s' not in startup:
+            mark('first_inference_s')
+        if result is not None and 'first_detection_s' not in startup and len(result.boxes):
+            mark('first_detection_s')
+            print(f"Time to first detection: {startup['first_detection_s']:.2f}s")
+        telemetry.append('frames', *frame_record(record.frame, record.timestamp, record.meta,
+                                                 resolutions[record.source], record.source))
+        if record.boxes is not None:
+            telemetry.extend('detections', **record.boxes.columns(record.frame, record.source))
+        else:
+            telemetry.extend('detections', **detection_arrays(result, record.frame, record.source))
+
+    # frame meta is vehicle_state(), speed_kmh first
+    tracker = TrackerSet(DetectionSchedule(max_interval=detect_max_interval),
+                         speed_of=lambda state: state[0]) if track_boxes else None
+    pipeline = InferencePipeline(model, imgsz=rig.primary.resolution, conf=0.5, batch_size=batch_size,
+                                 device=device, on_result=write_detections, source_imgsz=resolutions,
+                                 tracker=tracker)
+
+    # replay_detection can rescale, so only the highest resolution camera is recorded
+    recorder = DriveRecorder(record_dir) if record_dir else None
+    last_tick_frame = None
 
-        frame_count += 1
+    def camera_callback(spec, image):
+        # only copy the frame (plus the vehicle state it was taken in) and queue it for inference
+        start = time.perf_counter()
+        if last_tick_frame is not None:
+            callback_frame_lag.observe(last_tick_frame - image.frame)
+        state = vehicle_state(vehicle)
+        if recorder and spec.name == rig.primary.name:
+            recorder.record(image, state)
+        pipeline.submit(image, source=spec.name, meta=state)
+        callback_seconds.observe(time.perf_counter() - start)
 
-    camera.listen(camera_callback)
+    rig.listen(camera_callback)
+
+    # render buffers reused every frame, the surface is written in place instead of rebuilt
+    render_size = (640, 600)
+    resized_bgr = np.empty((render_size[1], render_size[0], 3), dtype=np.uint8)
+    latest_surface = None
 
     try:
-        clock = pygame.time.Clock()
-        while True:
+        clock = pygame.time.Clock() if not headless else None
+        ticks = 0
+        while not max_ticks or ticks < max_ticks:
             # carla tick world by 1 frame
-            world.tick()
+            tick_start = time.perf_counter()
+            last_tick_frame = world.tick()
+            world_tick_seconds.observe(time.perf_counter() - tick_start)
+            ticks_total.inc()
+            ticks += 1
+            mark('first_tick_s')
+            if headless:
+                tick_seconds.observe(time.perf_counter() - tick_start)
+                continue
+            # the frame limiter's sleep is not part of the tick
+            busy = time.perf_counter() - tick_start
             clock.tick(20)
+            render_start = time.perf_counter()
 
             for event in pygame.event.get():
-                if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                     raise KeyboardInterrupt
 
+            # render the newest detection result
+            latest = pipeline.latest()
+            if latest:
+                rendered_img = latest[1].plot()
+
+                # resize first so the colour swap only touches the display-size frame, both into one buffer
+                cv2.resize(rendered_img, render_size, dst=resized_bgr)
+                cv2.cvtColor(resized_bgr, cv2.COLOR_BGR2RGB, dst=resized_bgr)
+
+                # update pygame surface
+                if latest_surface is None:
+                    latest_surface = pygame.Surface(render_size)
+                pygame.surfarray.blit_array(latest_surface, resized_bgr.swapaxes(0, 1))
+
             # update pygame display every frame
             if latest_surface:
                 screen.blit(latest_surface, (0, 0))
                 pygame.display.flip()
+            rendered = time.perf_counter() - render_start
+            render_seconds.observe(rendered)
+            tick_seconds.observe(busy + rendered)
 
     finally:
         #  destroy objects
-        csv_file.close()
-        camera.destroy()
+        rig.stop()
+        pipeline.close()
+        pipeline.print_summary()
+        if tracker:
+            tracker.print_summary()
+        rig.print_summary(pipeline.summary())
+        if recorder:
+            recorder.close()
+        telemetry.close()
+        telemetry.print_summary()
+        export_detection_csv(telemetry.directory, 'detection_data.csv')
+        print_startup(model_infos, telemetry.directory)
+        metrics.close()
+        rig.destroy()
         vehicle.destroy()
         settings.synchronous_mode = False
         world.apply_settings(settings)
-        pygame.quit()
+        if not headless:
+            pygame.quit()
+
+def print_startup(model_infos, directory):
+    """ Print the startup steps and save them to {directory}/startup.json to track startup regressions """
+    cached = all(info['cached'] for info in model_infos.values())
+    print(f"Startup ({'headless' if headless else 'window'}, {model_format} model, "
+          f"{'cached' if cached else 'exported/loaded'}): "
+          + ", ".join(f"{step[:-2]} {seconds:.2f}s" for step, seconds in startup.items()))
+    report = dict(startup, format=model_format, model=model_path, headless=headless, model_cached=cached,
+                  imgsz=sorted(model_infos), created=time.time())
+    with open(os.path.join(directory, 'startup.json'), 'w') as f:
+        json.dump(report, f, indent=2)
 
 if __name__ == '__main__':
     main()
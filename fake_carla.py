@@ -0,0 +1,922 @@
+"""In-process stand-in for the part of the CARLA Python API our scripts use.
+
+Enough of Client, World, Map, Actor, TrafficLight, sensors, Image and the
+batch commands to run the hot paths (camera callbacks, pedestrian
+detection, signal preemption, spawning) without a server, at any scale:
+
+    import fake_carla
+    carla = fake_carla.install(vehicles=500, pedestrians=2000, junctions=100)
+    world = carla.Client("localhost", 2000).get_world()
+
+install() registers the module as `carla`, so call it before anything does
+`import carla`. The world is synthetic: junctions on a square grid, four
+approaches with one traffic light each, vehicles and walkers moving in
+straight lines (wrapping at the map edge) and cameras delivering random
+BGRA frames from a small reused set. Sensor callbacks run inline in
+world.tick() rather than on sensor threads. Nothing here models physics or
+rendering cost, it only exists to time and test our side of the API.
+"""
+import enum
+import fnmatch
+import itertools
+import math
+import sys
+import types
+
+import numpy as np
+
+MAP_NAME = "Carla/Maps/FakeTown"
+BLOCK_SIZE = 100.0  # junction spacing in metres
+STOP_OFFSET = 10.0  # stop line distance from the junction centre
+SPAWN_OFFSET = 30.0  # spawn point distance before the stop line, clear of the next junction's
+FRAME_VARIANTS = 4  # distinct synthetic frames per camera resolution
+
+# scale of the world Client.get_world() creates, set by install()
+DEFAULT_SCALE = {"vehicles": 0, "pedestrians": 0, "junctions": 16, "seed": 0}
+
+_worlds = {}  # (host, port) -> FakeWorld, clients of the same "server" share it
+
+
+class Vector3D:
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def length(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, factor):
+        return type(self)(self.x * factor, self.y * factor, self.z * factor)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(x={self.x:.6f}, y={self.y:.6f}, z={self.z:.6f})"
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return (self - other).length()
+
+
+class Rotation:
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+
+class Transform:
+    def __init__(self, location=None, rotation=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+
+    def get_forward_vector(self):
+        yaw, pitch = math.radians(self.rotation.yaw), math.radians(self.rotation.pitch)
+        return Vector3D(math.cos(pitch) * math.cos(yaw), math.cos(pitch) * math.sin(yaw), math.sin(pitch))
+
+
+class Timestamp:
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class TrafficLightState(enum.Enum):
+    Red = 0
+    Yellow = 1
+    Green = 2
+    Off = 3
+    Unknown = 4
+
+
+class AttachmentType(enum.Enum):
+    Rigid = 0
+    SpringArm = 1
+
+
+class WeatherParameters:
+    def __init__(self, name="Default"):
+        self.name = name
+
+
+for _preset in ("Default", "ClearNoon", "CloudyNoon", "WetNoon", "WetCloudyNoon", "MidRainyNoon",
+                "HardRainNoon", "SoftRainNoon", "ClearSunset", "CloudySunset", "WetSunset", "ClearNight"):
+    setattr(WeatherParameters, _preset, WeatherParameters(_preset))
+
+
+class VehicleControl:
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WorldSettings:
+    def __init__(self, synchronous_mode=False, fixed_delta_seconds=None, no_rendering_mode=False):
+        self.synchronous_mode = synchronous_mode
+        self.fixed_delta_seconds = fixed_delta_seconds
+        self.no_rendering_mode = no_rendering_mode
+
+    def copy(self):
+        return WorldSettings(self.synchronous_mode, self.fixed_delta_seconds, self.no_rendering_mode)
+
+
+class ActorAttribute:
+    def __init__(self, id, value, recommended_values=()):
+        self.id = id
+        self.value = str(value)
+        self.recommended_values = list(recommended_values)
+
+    def as_str(self):
+        return self.value
+
+    def as_int(self):
+        return int(self.value)
+
+    def as_float(self):
+        return float(self.value)
+
+
+class ActorBlueprint:
+    def __init__(self, id, attributes=None):
+        self.id = id
+        self.tags = id.split(".")
+        self._attributes = {name: ActorAttribute(name, *spec) for name, spec in (attributes or {}).items()}
+
+    def has_attribute(self, name):
+        return name in self._attributes
+
+    def get_attribute(self, name):
+        return self._attributes[name]
+
+    def set_attribute(self, name, value):
+        if name not in self._attributes:
+            raise IndexError(f"Blueprint {self.id} has no attribute {name!r}")
+        self._attributes[name].value = str(value)
+
+    def copy(self):
+        blueprint = ActorBlueprint(self.id)
+        blueprint._attributes = {name: ActorAttribute(name, attribute.value, attribute.recommended_values)
+                                 for name, attribute in self._attributes.items()}
+        return blueprint
+
+    def values(self):
+        return {name: attribute.value for name, attribute in self._attributes.items()}
+
+
+_COLORS = ["255,255,255", "0,0,0", "200,20,20", "20,60,200"]
+_BLUEPRINTS = [
+    ActorBlueprint("vehicle.ford.ambulance", {"role_name": ("autopilot",)}),
+    ActorBlueprint("vehicle.tesla.model3", {"role_name": ("autopilot",), "color": ("255,255,255", _COLORS)}),
+    ActorBlueprint("vehicle.audi.a2", {"role_name": ("autopilot",), "color": ("20,60,200", _COLORS)}),
+    ActorBlueprint("vehicle.lincoln.mkz_2020", {"role_name": ("autopilot",), "color": ("0,0,0", _COLORS)}),
+    ActorBlueprint("walker.pedestrian.0001", {"role_name": ("pedestrian",), "is_invincible": ("true",),
+                                              "speed": ("1.4", ["0.0", "1.4", "3.0"])}),
+    ActorBlueprint("walker.pedestrian.0002", {"role_name": ("pedestrian",), "is_invincible": ("true",),
+                                              "speed": ("1.2", ["0.0", "1.2", "2.8"])}),
+    ActorBlueprint("controller.ai.walker"),
+    ActorBlueprint("sensor.camera.rgb", {"role_name": ("front",), "image_size_x": ("800",),
+                                         "image_size_y": ("600",), "fov": ("90",), "sensor_tick": ("0.0",)}),
+    ActorBlueprint("sensor.other.collision", {"role_name": ("front",)}),
+]
+
+
+class BlueprintLibrary:
+    def __init__(self, blueprints):
+        self._blueprints = list(blueprints)
+
+    def find(self, id):
+        for blueprint in self._blueprints:
+            if blueprint.id == id:
+                return blueprint.copy()
+        raise IndexError(f"Blueprint {id!r} not found")
+
+    def filter(self, pattern):
+        return BlueprintLibrary(blueprint.copy() for blueprint in self._blueprints
+                                if fnmatch.fnmatchcase(blueprint.id, pattern))
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __getitem__(self, i):
+        return self._blueprints[i]
+
+
+class Image:
+    """A camera frame, raw_data is a BGRA buffer like carla.Image's."""
+
+    def __init__(self, frame, timestamp, width, height, fov, raw_data, transform):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.fov = fov
+        self.raw_data = raw_data
+        self.transform = transform
+
+
+class Waypoint:
+    def __init__(self, road_id, lane_id, transform, section_id=0, is_junction=False):
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.section_id = section_id
+        self.s = 0.0
+        self.is_junction = is_junction
+        self.transform = transform
+        self.id = hash((road_id, section_id, lane_id))
+
+
+class Map:
+    """junctions on a square grid, four approaches (one lane, one light) each."""
+
+    DIRECTIONS = ((1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0))
+
+    def __init__(self, junctions=16, name=MAP_NAME):
+        self.name = name
+        self.columns = max(1, math.ceil(math.sqrt(junctions)))
+        self.extent = self.columns * BLOCK_SIZE
+        i = np.arange(junctions)
+        self.centers = np.stack([(i % self.columns + 0.5) * BLOCK_SIZE,
+                                 (i // self.columns + 0.5) * BLOCK_SIZE], axis=1)
+        self.forward = np.array(self.DIRECTIONS)
+
+    @property
+    def num_junctions(self):
+        return len(self.centers)
+
+    def _approach(self, junction, k, back):
+        forward = self.forward[k]
+        x, y = self.centers[junction] - (STOP_OFFSET + back) * forward
+        yaw = math.degrees(math.atan2(forward[1], forward[0]))
+        return Transform(Location(x, y, 0.0), Rotation(yaw=yaw))
+
+    def stop_waypoint(self, junction, k):
+        """Stop line waypoint of approach k (road junction * 4 + k + 1, lane -1)."""
+        return Waypoint(junction * 4 + k + 1, -1, self._approach(junction, k, 0.0))
+
+    def get_spawn_points(self):
+        return [self._approach(j, k, SPAWN_OFFSET) for j in range(self.num_junctions) for k in range(4)]
+
+    def get_waypoint(self, location, project_to_road=True):
+        """Every location is on the approach lane of the nearest junction it is heading into."""
+        column = min(self.columns - 1, max(0, int(location.x // BLOCK_SIZE)))
+        row = int(location.y // BLOCK_SIZE)
+        junction = min(self.num_junctions - 1, max(0, row * self.columns + column))
+        dx, dy = location.x - self.centers[junction, 0], location.y - self.centers[junction, 1]
+        # the approach coming from the location's side of the junction
+        if abs(dx) >= abs(dy):
+            k = 0 if dx < 0 else 2
+        else:
+            k = 1 if dy < 0 else 3
+        yaw = math.degrees(math.atan2(self.forward[k, 1], self.forward[k, 0]))
+        return Waypoint(junction * 4 + k + 1, -1, Transform(Location(location.x, location.y, 0.0), Rotation(yaw=yaw)))
+
+    def to_opendrive(self):
+        return f'<OpenDRIVE name="{self.name}" junctions="{self.num_junctions}" block="{BLOCK_SIZE}"/>'
+
+
+class Actor:
+    def __init__(self, world, actor_id, type_id, attributes, row=None, parent=None, offset=None):
+        self._world = world
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = attributes
+        self.parent = parent
+        self._row = row
+        self._offset = offset
+        self.is_alive = True
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        if self.parent is not None:
+            transform = self.parent.get_transform()
+            if self._offset is not None:
+                transform.location = transform.location + self._offset.location
+            return transform
+        x, y, z, yaw = self._world._state[self._row, :4]
+        return Transform(Location(x, y, z), Rotation(yaw=yaw))
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        if self.parent is not None:
+            return self.parent.get_velocity()
+        return Vector3D(*self._world._state[self._row, 4:6])
+
+    def set_transform(self, transform):
+        self._world._place(self._row, transform)
+
+    def set_target_velocity(self, velocity):
+        self._world._state[self._row, 4:6] = (velocity.x, velocity.y)
+
+    def destroy(self):
+        return self._world._destroy(self.id)
+
+
+class Vehicle(Actor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._control = VehicleControl()
+
+    def set_autopilot(self, enabled=True, tm_port=8000):
+        self._world._set_autopilot(self, enabled)
+
+    def apply_control(self, control):
+        self._control = control
+
+    def get_control(self):
+        return self._control
+
+    def is_at_traffic_light(self):
+        return False
+
+    def get_traffic_light(self):
+        return None
+
+
+class Walker(Actor):
+    pass
+
+
+class WalkerAIController(Actor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._max_speed = 1.4
+        self._target = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.parent.set_target_velocity(Vector3D())
+
+    def set_max_speed(self, speed):
+        self._max_speed = speed
+        self._steer()
+
+    def go_to_location(self, location):
+        self._target = location
+        self._steer()
+
+    def _steer(self):
+        if self._target is None or not self.parent.is_alive:
+            return
+        direction = self._target - self.parent.get_location()
+        distance = math.hypot(direction.x, direction.y)
+        if distance > 0:
+            self.parent.set_target_velocity(Vector3D(direction.x, direction.y) * (self._max_speed / distance))
+
+
+class TrafficLight(Actor):
+    def __init__(self, *args, stop_waypoints=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state = TrafficLightState.Red
+        self._frozen = False
+        self._stop_waypoints = list(stop_waypoints)
+        self._group = [self]
+
+    def get_state(self):
+        return self.state
+
+    def set_state(self, state):
+        self.state = state
+
+    def freeze(self, freeze):
+        self._frozen = freeze
+
+    def is_frozen(self):
+        return self._frozen
+
+    def get_stop_waypoints(self):
+        return list(self._stop_waypoints)
+
+    def get_group_traffic_lights(self):
+        return list(self._group)
+
+
+class Sensor(Actor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._callback = None
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def _sense(self, frame, timestamp):
+        pass
+
+
+class Camera(Sensor):
+    def _sense(self, frame, timestamp):
+        width = int(self.attributes["image_size_x"])
+        height = int(self.attributes["image_size_y"])
+        raw_data = self._world._frame_buffer(width, height, frame)
+        self._callback(Image(frame, timestamp, width, height, float(self.attributes["fov"]), raw_data,
+                             self.get_transform()))
+
+
+class ActorList(list):
+    def filter(self, pattern):
+        return ActorList(actor for actor in self if fnmatch.fnmatchcase(actor.type_id, pattern))
+
+    def find(self, actor_id):
+        for actor in self:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+
+class ActorSnapshot:
+    __slots__ = ("id", "_state")
+
+    def __init__(self, actor_id, state):
+        self.id = actor_id
+        self._state = state
+
+    def get_transform(self):
+        x, y, z, yaw = self._state[:4]
+        return Transform(Location(x, y, z), Rotation(yaw=yaw))
+
+    def get_velocity(self):
+        return Vector3D(self._state[4], self._state[5])
+
+    def get_angular_velocity(self):
+        return Vector3D()
+
+    def get_acceleration(self):
+        return Vector3D()
+
+
+class WorldSnapshot:
+    """Actor states of one frame, iterating yields one ActorSnapshot per actor."""
+
+    def __init__(self, frame, timestamp, actor_ids, states):
+        self.id = frame
+        self.frame = frame
+        self.timestamp = timestamp
+        self._ids = actor_ids
+        self._states = states
+
+    def __iter__(self):
+        return (ActorSnapshot(actor_id, state) for actor_id, state in zip(self._ids, self._states.tolist()))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._ids
+
+    def find(self, actor_id):
+        try:
+            return ActorSnapshot(actor_id, self._states[self._ids.index(actor_id)].tolist())
+        except ValueError:
+            return None
+
+
+class FakeWorld:
+    """A synthetic world, see the module docstring."""
+
+    _episodes = itertools.count(1)
+
+    def __init__(self, vehicles=0, pedestrians=0, junctions=16, seed=0, map_name=MAP_NAME):
+        self.id = next(self._episodes)
+        self.rng = np.random.default_rng(seed)
+        self._map = Map(junctions, map_name)
+        self._settings = WorldSettings()
+        self._weather = WeatherParameters.Default
+        self._frame = 0
+        self._elapsed = 0.0
+        self._snapshot = None
+        self._actor_ids = itertools.count(1)
+        self._actors = {}
+        self._sensors = []
+        self._frames = {}
+
+        # x, y, z, yaw, vx, vy per moving actor row, rows of destroyed actors are reused
+        self._state = np.zeros((64, 6))
+        self._row_actor = np.zeros(64, dtype=np.int64)  # 0 = free row
+        self._free_rows = list(range(63, -1, -1))
+        self._vehicle_rows = set()
+
+        self._spawn_traffic_lights()
+        if vehicles:
+            self.populate_vehicles(vehicles)
+        if pedestrians:
+            self.populate_pedestrians(pedestrians)
+
+    # --- bookkeeping -------------------------------------------------------
+
+    def _new_row(self):
+        if not self._free_rows:
+            size = len(self._state)
+            self._state = np.concatenate([self._state, np.zeros((size, 6))])
+            self._row_actor = np.concatenate([self._row_actor, np.zeros(size, dtype=np.int64)])
+            self._free_rows = list(range(2 * size - 1, size - 1, -1))
+        return self._free_rows.pop()
+
+    def _place(self, row, transform):
+        self._state[row, :4] = (transform.location.x, transform.location.y, transform.location.z,
+                                transform.rotation.yaw)
+        self._snapshot = None
+
+    def _add(self, cls, blueprint_id, attributes, transform=None, parent=None, **kwargs):
+        actor_id = next(self._actor_ids)
+        row = None
+        if parent is None:
+            row = self._new_row()
+            self._row_actor[row] = actor_id
+            self._state[row] = 0.0
+            self._place(row, transform or Transform())
+        actor = cls(self, actor_id, blueprint_id, attributes, row=row, parent=parent,
+                    offset=transform if parent is not None else None, **kwargs)
+        self._actors[actor_id] = actor
+        if isinstance(actor, Vehicle) and row is not None:
+            self._vehicle_rows.add(row)
+        if isinstance(actor, Sensor):
+            self._sensors.append(actor)
+        return actor
+
+    def _destroy(self, actor_id):
+        actor = self._actors.pop(actor_id, None)
+        if actor is None:
+            return False
+        actor.is_alive = False
+        if actor._row is not None:
+            self._row_actor[actor._row] = 0
+            self._state[actor._row] = 0.0
+            self._free_rows.append(actor._row)
+            self._vehicle_rows.discard(actor._row)
+        if isinstance(actor, Sensor):
+            actor.stop()
+            self._sensors.remove(actor)
+        self._snapshot = None
+        return True
+
+    def _set_autopilot(self, vehicle, enabled):
+        if enabled:
+            speed = self.rng.uniform(5.0, 12.0)
+            yaw = math.radians(self._state[vehicle._row, 3])
+            self._state[vehicle._row, 4:6] = (speed * math.cos(yaw), speed * math.sin(yaw))
+        else:
+            self._state[vehicle._row, 4:6] = 0.0
+
+    def _frame_buffer(self, width, height, frame):
+        variants = self._frames.get((width, height))
+        if variants is None:
+            variants = self._frames[(width, height)] = [
+                memoryview(self.rng.integers(0, 256, width * height * 4, dtype=np.uint8)) for _ in range(FRAME_VARIANTS)]
+        return variants[frame % FRAME_VARIANTS]
+
+    def _spawn_traffic_lights(self):
+        carla_map = self._map
+        for junction in range(carla_map.num_junctions):
+            lights = []
+            for k in range(4):
+                stop = carla_map.stop_waypoint(junction, k)
+                # the pole stands on the right side of the lane, just behind the stop line
+                forward = carla_map.forward[k]
+                pole = Location(stop.transform.location.x + 4.0 * forward[1],
+                                stop.transform.location.y - 4.0 * forward[0], 0.0)
+                light = self._add(TrafficLight, "traffic.traffic_light", {"role_name": ""},
+                                  Transform(pole, stop.transform.rotation), stop_waypoints=[stop])
+                lights.append(light)
+            for light in lights:
+                light._group = lights
+
+    # --- scale helpers (not in the CARLA API) ------------------------------
+
+    def populate_vehicles(self, count, autopilot=True):
+        """Spawn count vehicles at random spots on the map, moving when autopilot is on."""
+        vehicles = []
+        extent = self._map.extent
+        for x, y, yaw in zip(self.rng.uniform(0, extent, count), self.rng.uniform(0, extent, count),
+                             self.rng.choice([0.0, 90.0, 180.0, -90.0], count)):
+            vehicle = self._add(Vehicle, "vehicle.tesla.model3", {"role_name": "autopilot"},
+                                Transform(Location(x, y, 0.0), Rotation(yaw=yaw)))
+            vehicle.set_autopilot(autopilot)
+            vehicles.append(vehicle)
+        return vehicles
+
+    def populate_pedestrians(self, count, speed=1.4):
+        """Spawn count walkers wandering in random directions."""
+        walkers = []
+        extent = self._map.extent
+        heading = self.rng.uniform(-np.pi, np.pi, count)
+        for x, y, angle in zip(self.rng.uniform(0, extent, count), self.rng.uniform(0, extent, count), heading):
+            walker = self._add(Walker, "walker.pedestrian.0001", {"role_name": "pedestrian"},
+                               Transform(Location(x, y, 0.0), Rotation(yaw=math.degrees(angle))))
+            walker.set_target_velocity(Vector3D(speed * math.cos(angle), speed * math.sin(angle)))
+            walkers.append(walker)
+        return walkers
+
+    # --- carla.World -------------------------------------------------------
+
+    def get_map(self):
+        return self._map
+
+    def get_settings(self):
+        return self._settings.copy()
+
+    def apply_settings(self, settings):
+        self._settings = settings.copy()
+        return self._frame
+
+    def get_weather(self):
+        return self._weather
+
+    def set_weather(self, weather):
+        self._weather = weather
+
+    def set_pedestrians_seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def get_blueprint_library(self):
+        return BlueprintLibrary(_BLUEPRINTS)
+
+    def get_random_location_from_navigation(self):
+        x, y = self.rng.uniform(0, self._map.extent, 2)
+        return Location(x, y, 0.0)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self._actors.values())
+        return ActorList(self._actors[actor_id] for actor_id in actor_ids if actor_id in self._actors)
+
+    def get_actor(self, actor_id):
+        return self._actors.get(actor_id)
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        try:
+            return self.spawn_actor(blueprint, transform, attach_to, attachment_type)
+        except RuntimeError:
+            return None
+
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=AttachmentType.Rigid):
+        kind = blueprint.id.split(".")[0]
+        if kind == "vehicle" and attach_to is None and self._occupied(transform.location):
+            raise RuntimeError("Spawn failed because of collision at spawn position")
+        cls = {"vehicle": Vehicle, "walker": Walker, "traffic": TrafficLight}.get(kind, Actor)
+        if blueprint.id == "controller.ai.walker":
+            cls = WalkerAIController
+        elif blueprint.id.startswith("sensor.camera"):
+            cls = Camera
+        elif kind == "sensor":
+            cls = Sensor
+        return self._add(cls, blueprint.id, blueprint.values(), transform, parent=attach_to)
+
+    def _occupied(self, location, radius=2.0):
+        if not self._vehicle_rows:
+            return False
+        vehicles = list(self._vehicle_rows)
+        gaps = np.hypot(self._state[vehicles, 0] - location.x, self._state[vehicles, 1] - location.y)
+        return bool((gaps < radius).any())
+
+    def tick(self, seconds=10.0):
+        """Advance one step: move every actor, then call every listening sensor."""
+        dt = self._settings.fixed_delta_seconds or 0.05
+        self._frame += 1
+        self._elapsed += dt
+        state = self._state
+        state[:, 0:2] += state[:, 4:6] * dt
+        np.mod(state[:, 0:2], self._map.extent, out=state[:, 0:2])
+        self._snapshot = None
+        timestamp = self._elapsed
+        for sensor in list(self._sensors):
+            if sensor.is_listening:
+                sensor._sense(self._frame, timestamp)
+        return self._frame
+
+    def wait_for_tick(self, seconds=10.0):
+        self.tick()
+        return self.get_snapshot()
+
+    def get_snapshot(self):
+        if self._snapshot is None or self._snapshot.frame != self._frame:
+            rows = np.nonzero(self._row_actor)[0]
+            dt = self._settings.fixed_delta_seconds or 0.05
+            self._snapshot = WorldSnapshot(self._frame, Timestamp(self._frame, self._elapsed, dt),
+                                           self._row_actor[rows].tolist(), self._state[rows])
+        return self._snapshot
+
+
+class TrafficManager:
+    def __init__(self, port=8000):
+        self.port = port
+        self.options = {}
+
+    def get_port(self):
+        return self.port
+
+    def set_synchronous_mode(self, mode=True):
+        self.options["synchronous_mode"] = mode
+
+    def set_random_device_seed(self, seed):
+        self.options["seed"] = seed
+
+    def set_global_distance_to_leading_vehicle(self, distance):
+        self.options["distance_to_leading_vehicle"] = distance
+
+    def set_respawn_dormant_vehicles(self, enabled=True):
+        self.options["respawn_dormant_vehicles"] = enabled
+
+    def set_hybrid_physics_mode(self, enabled=True):
+        self.options["hybrid_physics_mode"] = enabled
+
+
+# --- carla.command ----------------------------------------------------------
+
+FutureActor = 0
+
+
+class _Command:
+    def __init__(self):
+        self._then = []
+
+    def then(self, command):
+        self._then.append(command)
+        return self
+
+
+class SpawnActor(_Command):
+    def __init__(self, blueprint, transform, parent=None):
+        super().__init__()
+        self.blueprint = blueprint
+        self.transform = transform
+        self.parent_id = parent
+
+
+class DestroyActor(_Command):
+    def __init__(self, actor):
+        super().__init__()
+        self.actor_id = getattr(actor, "id", actor)
+
+
+class SetAutopilot(_Command):
+    def __init__(self, actor, enabled, tm_port=8000):
+        super().__init__()
+        self.actor_id = getattr(actor, "id", actor)
+        self.enabled = enabled
+
+
+class ApplyTransform(_Command):
+    def __init__(self, actor, transform):
+        super().__init__()
+        self.actor_id = getattr(actor, "id", actor)
+        self.transform = transform
+
+
+class ApplyTargetVelocity(_Command):
+    def __init__(self, actor, velocity):
+        super().__init__()
+        self.actor_id = getattr(actor, "id", actor)
+        self.velocity = velocity
+
+
+class Response:
+    def __init__(self, actor_id=0, error=""):
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+command = types.ModuleType("carla.command")
+for _cls in (SpawnActor, DestroyActor, SetAutopilot, ApplyTransform, ApplyTargetVelocity, Response):
+    setattr(command, _cls.__name__, _cls)
+command.FutureActor = FutureActor
+
+
+def _run_command(world, cmd, future_id=0):
+    """Execute one batch command, returns the actor id it made or acted on."""
+    actor_id = getattr(cmd, "actor_id", None)
+    if actor_id == FutureActor:
+        actor_id = future_id
+    if isinstance(cmd, SpawnActor):
+        parent = world.get_actor(cmd.parent_id) if cmd.parent_id else None
+        actor_id = world.spawn_actor(cmd.blueprint, cmd.transform, attach_to=parent).id
+    else:
+        actor = world.get_actor(actor_id)
+        if actor is None:
+            raise RuntimeError(f"Actor {actor_id} not found")
+        if isinstance(cmd, DestroyActor):
+            actor.destroy()
+        elif isinstance(cmd, SetAutopilot):
+            actor.set_autopilot(cmd.enabled)
+        elif isinstance(cmd, ApplyTransform):
+            actor.set_transform(cmd.transform)
+        elif isinstance(cmd, ApplyTargetVelocity):
+            actor.set_target_velocity(cmd.velocity)
+    for follow_up in cmd._then:
+        _run_command(world, follow_up, actor_id)
+    return actor_id
+
+
+class Client:
+    def __init__(self, host="localhost", port=2000, worker_threads=0):
+        self.host = host
+        self.port = port
+        self.timeout = 5.0
+        self._traffic_managers = {}
+
+    @property
+    def _world(self):
+        world = _worlds.get((self.host, self.port))
+        if world is None:
+            world = _worlds[(self.host, self.port)] = FakeWorld(**DEFAULT_SCALE)
+        return world
+
+    def set_timeout(self, seconds):
+        self.timeout = seconds
+
+    def get_server_version(self):
+        return "fake"
+
+    def get_client_version(self):
+        return "fake"
+
+    def get_world(self):
+        return self._world
+
+    def get_available_maps(self):
+        return [MAP_NAME]
+
+    def load_world(self, map_name, reset_settings=True):
+        scale = dict(DEFAULT_SCALE, junctions=self._world._map.num_junctions)
+        world = _worlds[(self.host, self.port)] = FakeWorld(map_name=map_name, **scale)
+        return world
+
+    def get_trafficmanager(self, port=8000):
+        manager = self._traffic_managers.get(port)
+        if manager is None:
+            manager = self._traffic_managers[port] = TrafficManager(port)
+        return manager
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        world = self._world
+        responses = []
+        for cmd in commands:
+            try:
+                responses.append(Response(_run_command(world, cmd)))
+            except RuntimeError as e:
+                responses.append(Response(0, str(e)))
+        if do_tick:
+            world.tick()
+        return responses
+
+    def apply_batch(self, commands):
+        self.apply_batch_sync(commands)
+
+    def start_recorder(self, filename, additional_data=False):
+        return filename
+
+    def stop_recorder(self):
+        pass
+
+    def replay_file(self, filename, start, duration, follow_id, replay_sensors=False):
+        return f"Replaying {filename} (fake, nothing to replay)"
+
+    def set_replayer_time_factor(self, time_factor):
+        pass
+
+    def stop_replayer(self, keep_actors):
+        pass
+
+    def show_recorder_file_info(self, filename, show_all):
+        return f"{filename}: fake recorder, no data"
+
+
+def install(**scale):
+    """Register this module as `carla` and set the scale of new worlds, returns the module."""
+    DEFAULT_SCALE.update(scale)
+    _worlds.clear()
+    module = sys.modules[__name__]
+    sys.modules["carla"] = module
+    sys.modules["carla.command"] = command
+    return module
@@ -0,0 +1,326 @@
+"""Route lookahead green wave for emergency vehicles, plus the numbers to judge it by.
+
+The reactive controllers only act once the ambulance is already on a lane
+controlled by a light (traffic_lights.py) or stopped at it
+(vehicle.is_at_traffic_light()), so it still brakes at every junction.
+GreenWave works from the planned route instead: when a route is set, every
+signal on it is found once (consecutive route waypoints on a lane with a stop
+waypoint in the IntersectionIndex, the stop line being where that run ends)
+and its distance along the route is stored. Per tick the vehicle is matched
+to the route, the arrival time at the next signal is estimated from the
+current speed, and the junction is handed to the PreemptionScheduler only
+once that estimate drops under lead_time, so cross traffic is held for a few
+seconds per junction rather than from the moment the ambulance turns up.
+
+RunMetrics measures a run the same way whatever controls the lights:
+ambulance travel time per leg, number of stops (speed hysteresis) and the
+cross-traffic delay, i.e. vehicle-seconds of other vehicles standing in a
+queue behind a stop line of a junction near the ambulance that isn't on its
+own direction of travel. Runs are saved as JSON and compared with
+
+    python green_wave.py compare run_reactive/green_wave.json run_corridor/green_wave.json
+"""
+import argparse
+import json
+import math
+
+import numpy as np
+
+from pedestrian_detection import snapshot_arrays
+from preemption import percentile
+
+
+class Corridor:
+    """One vehicle's planned route: xy polyline, distance along it and the signals on it."""
+
+    def __init__(self, xy, distance, signals):
+        self.xy = xy
+        self.distance = distance
+        self.signals = signals  # [(stop row, distance of the stop line along the route)], in route order
+        self.position = 0  # route point the vehicle was last matched to, only moves forward
+        self.next_signal = 0
+        self.cleared_at = None  # when the next signal was pre-cleared for this vehicle
+
+
+class GreenWave:
+    """Pre-clears the signals along planned routes just before the vehicle gets there."""
+
+    def __init__(self, intersection_index, scheduler, lead_time=5.0, min_lead_distance=15.0, min_speed=2.0,
+                 search_points=50):
+        self.index = intersection_index
+        self.scheduler = scheduler
+        self.lead_time = lead_time
+        # a slow or stopped ambulance still gets its green this far out
+        self.min_lead_distance = min_lead_distance
+        self.min_speed = min_speed
+        self.search_points = search_points
+        self.corridors = {}
+
+        self.routes = 0
+        self.signals_planned = 0
+        self.signals_passed = 0
+        self.signals_cleared = 0  # passed while pre-cleared for this vehicle
+        self.requests = {}
+        self.hold_before_arrival = []  # green -> stop line, how long cross traffic was held for nothing
+
+    def signals_on_route(self, route):
+        """Stop rows on a [(waypoint, RoadOption)] route and the distance of each stop line along it."""
+        xy = np.array([(wp.transform.location.x, wp.transform.location.y) for wp, _ in route], dtype=np.float64)
+        steps = np.hypot(*np.diff(xy, axis=0).T) if len(xy) > 1 else np.zeros(0)
+        distance = np.concatenate([[0.0], np.cumsum(steps)])
+        rows = np.array([self._stop_row(wp) for wp, _ in route], dtype=np.int64)
+
+        # a signal is a run of route points on one controlled lane, the stop line is where the run ends
+        ends = np.nonzero((rows >= 0) & np.append(rows[1:] != rows[:-1], True))[0]
+        signals = []
+        for end in ends.tolist():
+            row = int(rows[end])
+            offset = (self.index.stop_locations[row, :2] - xy[end]) @ self.index.stop_forward[row]
+            signals.append((row, float(distance[end] + offset)))
+        return xy, distance, signals
+
+    def _stop_row(self, waypoint):
+        row = self.index.stop_for_lane(waypoint.road_id, waypoint.lane_id)
+        return -1 if row is None else row
+
+    def plan(self, vehicle_id, route):
+        """Take the vehicle's new global plan, replacing its previous one. Returns the number of signals on it."""
+        if not route:
+            self.corridors.pop(vehicle_id, None)
+            return 0
+        xy, distance, signals = self.signals_on_route(route)
+        self.corridors[vehicle_id] = Corridor(xy, distance, signals)
+        self.routes += 1
+        self.signals_planned += len(signals)
+        return len(signals)
+
+    def signals_ahead(self, vehicle_id):
+        """[(light, distance to its stop line)] still ahead of the vehicle on its route."""
+        corridor = self.corridors.get(vehicle_id)
+        if corridor is None:
+            return []
+        travelled = corridor.distance[corridor.position]
+        return [(self.index.lights[int(self.index.stop_light[row])], stop_distance - travelled)
+                for row, stop_distance in corridor.signals[corridor.next_signal:]]
+
+    def update(self, now, vehicle_id, location, speed):
+        """Advance the vehicle along its route and pre-clear the next signal when it's due.
+
+        location is (x, y), speed in m/s. Returns the scheduler's answer when a
+        request was made this tick, else None.
+        """
+        corridor = self.corridors.get(vehicle_id)
+        if corridor is None:
+            return None
+        # nearest route point a little ahead of the last match, a loop in the route can't pull it back
+        lo = corridor.position
+        hi = min(lo + self.search_points, len(corridor.xy))
+        gaps = np.hypot(corridor.xy[lo:hi, 0] - location[0], corridor.xy[lo:hi, 1] - location[1])
+        corridor.position = lo + int(np.argmin(gaps))
+        travelled = corridor.distance[corridor.position]
+
+        while corridor.next_signal < len(corridor.signals) \
+                and corridor.signals[corridor.next_signal][1] <= travelled:
+            self.signals_passed += 1
+            if corridor.cleared_at is not None:
+                self.signals_cleared += 1
+                self.hold_before_arrival.append(now - corridor.cleared_at)
+            corridor.cleared_at = None
+            corridor.next_signal += 1
+        if corridor.next_signal >= len(corridor.signals):
+            return None
+
+        row, stop_distance = corridor.signals[corridor.next_signal]
+        remaining = stop_distance - travelled
+        if remaining > self.min_lead_distance and remaining / max(speed, self.min_speed) > self.lead_time:
+            return None
+        light = self.index.lights[int(self.index.stop_light[row])]
+        if light is None:
+            return None  # light not bound to an actor of this world
+        stop_location = (float(self.index.stop_locations[row, 0]), float(self.index.stop_locations[row, 1]))
+        stop_forward = (float(self.index.stop_forward[row, 0]), float(self.index.stop_forward[row, 1]))
+        state = self.scheduler.request(vehicle_id, light, self.index.intersection(light), stop_location,
+                                       stop_forward, now)
+        if state != "active":
+            self.requests[state] = self.requests.get(state, 0) + 1
+        # a queued request comes back "active" every tick until it is granted
+        if corridor.cleared_at is None and state != "queued" and self.scheduler.is_held(light):
+            corridor.cleared_at = now
+        return state
+
+    def summary(self):
+        holds = self.hold_before_arrival
+        return {
+            "routes": self.routes,
+            "signals_planned": self.signals_planned,
+            "signals_passed": self.signals_passed,
+            "signals_cleared": self.signals_cleared,
+            "requests": dict(self.requests),
+            "hold_before_arrival_mean": sum(holds) / len(holds) if holds else None,
+            "hold_before_arrival_p95": percentile(holds, 95),
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        print(f"Green wave: {stats['signals_planned']} signals on {stats['routes']} routes, "
+              f"{stats['signals_cleared']}/{stats['signals_passed']} passed pre-cleared, requests {stats['requests']}")
+        if stats["hold_before_arrival_mean"] is not None:
+            print(f"Cross traffic held before arrival: mean {stats['hold_before_arrival_mean']:.2f}s, "
+                  f"p95 {stats['hold_before_arrival_p95']:.2f}s")
+
+
+class RunMetrics:
+    """Ambulance travel time and stops plus cross-traffic delay, comparable across signal modes."""
+
+    def __init__(self, intersection_index, mode, sample_every=10, stop_speed=0.5, moving_speed=2.0,
+                 junction_radius=50.0, queue_length=30.0, lane_tolerance=2.0, same_direction_cos=0.7):
+        self.mode = mode
+        self.stop_xy = intersection_index.stop_locations[:, :2].copy()
+        self.stop_forward = intersection_index.stop_forward.copy()
+        self.sample_every = sample_every
+        self.stop_speed = stop_speed
+        self.moving_speed = moving_speed
+        self.junction_radius = junction_radius
+        self.queue_length = queue_length
+        self.lane_tolerance = lane_tolerance
+        self.same_direction_cos = same_direction_cos
+
+        self._ticks = 0
+        self._last_now = None
+        self._last_sample = None
+        self._moving = False
+        self._leg_started = None
+        self.sim_seconds = 0.0
+        self.distance = 0.0
+        self.stops = 0
+        self.stopped_seconds = 0.0
+        self.leg_times = []
+        self.legs_aborted = 0
+        self.cross_traffic_delay = 0.0  # vehicle-seconds
+
+    def finish_leg(self, now, reached=True):
+        """End the current leg, the next update() starts another. A leg cut short (relocation) isn't timed."""
+        if self._leg_started is not None and now is not None:
+            if reached:
+                self.leg_times.append(now - self._leg_started)
+            else:
+                self.legs_aborted += 1
+        self._leg_started = None
+
+    def update(self, now, location, forward, speed, snapshot=None, traffic_ids=()):
+        """One tick of the ambulance (x, y), heading (x, y) and speed, traffic is sampled every sample_every ticks."""
+        dt = now - self._last_now if self._last_now is not None else 0.0
+        self._last_now = now
+        if self._leg_started is None:
+            self._leg_started = now
+        self.sim_seconds += dt
+        self.distance += speed * dt
+        if speed < self.stop_speed:
+            self.stopped_seconds += dt
+            if self._moving:
+                self.stops += 1
+                self._moving = False
+        elif speed > self.moving_speed:
+            self._moving = True
+
+        self._ticks += 1
+        if snapshot is None or not len(traffic_ids) or self._ticks % self.sample_every:
+            return
+        sample_dt = now - self._last_sample if self._last_sample is not None else 0.0
+        self._last_sample = now
+        if sample_dt > 0:
+            self.cross_traffic_delay += self._queued(location, forward, snapshot, traffic_ids) * sample_dt
+
+    def _queued(self, location, forward, snapshot, traffic_ids):
+        """Traffic vehicles standing behind a stop line near the ambulance that isn't its direction of travel."""
+        near = np.hypot(self.stop_xy[:, 0] - location[0], self.stop_xy[:, 1] - location[1]) < self.junction_radius
+        cross = near & (self.stop_forward @ np.asarray(forward, dtype=np.float64) < self.same_direction_cos)
+        if not cross.any():
+            return 0
+        positions, _, velocities, found = snapshot_arrays(snapshot, traffic_ids)
+        waiting = found & (np.hypot(velocities[:, 0], velocities[:, 1]) < self.stop_speed)
+        if not waiting.any():
+            return 0
+        stops, stop_forward = self.stop_xy[cross], self.stop_forward[cross]
+        rel = positions[waiting][:, None, :] - stops[None]  # (waiting, stops, 2)
+        along = (rel * stop_forward[None]).sum(axis=2)
+        lateral = np.abs(rel[..., 0] * stop_forward[None, :, 1] - rel[..., 1] * stop_forward[None, :, 0])
+        queued = (along > -self.queue_length) & (along < 1.0) & (lateral < self.lane_tolerance)
+        return int(queued.any(axis=1).sum())
+
+    def summary(self):
+        km = self.distance / 1000.0
+        legs = self.leg_times
+        return {
+            "mode": self.mode,
+            "sim_seconds": self.sim_seconds,
+            "distance_m": self.distance,
+            "mean_speed": self.distance / self.sim_seconds if self.sim_seconds else 0.0,
+            "legs": len(legs),
+            "legs_aborted": self.legs_aborted,
+            "leg_time_mean": sum(legs) / len(legs) if legs else None,
+            "leg_times": list(legs),
+            "stops": self.stops,
+            "stops_per_km": self.stops / km if km else None,
+            "stopped_seconds": self.stopped_seconds,
+            "cross_traffic_delay": self.cross_traffic_delay,
+            "cross_traffic_delay_per_km": self.cross_traffic_delay / km if km else None,
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        legs = f", mean leg {stats['leg_time_mean']:.1f}s" if stats["leg_time_mean"] is not None else ""
+        print(f"Signals ({stats['mode']}): {stats['distance_m'] / 1000.0:.2f} km in {stats['sim_seconds']:.0f}s sim "
+              f"({stats['mean_speed'] * 3.6:.1f} km/h), {stats['legs']} legs{legs}, {stats['stops']} stops "
+              f"({stats['stopped_seconds']:.0f}s stopped), cross traffic delay {stats['cross_traffic_delay']:.0f} "
+              f"vehicle-seconds")
+
+
+def save_summary(path, metrics, green_wave=None, scheduler=None):
+    """Write the run metrics (and the corridor/preemption stats when used) as JSON for compare()."""
+    data = {"run": metrics.summary()}
+    if green_wave is not None:
+        data["green_wave"] = green_wave.summary()
+    if scheduler is not None:
+        data["preemption"] = scheduler.summary()
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+COMPARE_FIELDS = ("sim_seconds", "distance_m", "mean_speed", "legs", "leg_time_mean", "stops", "stops_per_km",
+                  "stopped_seconds", "cross_traffic_delay", "cross_traffic_delay_per_km")
+
+
+def compare(paths):
+    """Print the run metrics of saved runs side by side, the first one is the reference."""
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            runs.append(json.load(f)["run"])
+    print(f"{'':28s}" + "".join(f"{run['mode']:>14s}" for run in runs))
+    for field in COMPARE_FIELDS:
+        cells = []
+        reference = runs[0].get(field)
+        for run in runs:
+            value = run.get(field)
+            if value is None:
+                cells.append(f"{'-':>14s}")
+            elif run is runs[0] or not reference or not math.isfinite(reference):
+                cells.append(f"{value:14.2f}")
+            else:
+                cells.append(f"{value:8.2f} {(value - reference) / reference:+5.0%}")
+        print(f"{field:28s}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    compare_parser = sub.add_parser("compare", help="compare saved runs, the first is the reference")
+    compare_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Asynchronous image writer for camera sensor callbacks.
+
+The sensor callback only copies the raw BGRA buffer into a bounded queue, a
+pool of worker threads does the colour conversion, JPEG/PNG encode and write
+(OpenCV releases the GIL for both, so threads scale across cores). Each
+worker converts into its own reused frame buffer.
+"""
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from frame_convert import bgra_to, bgra_view
+from runtime_metrics import REGISTRY
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+def write_atomic(path, data):
+    """Write bytes to a temporary file and rename it, readers never see half a file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageFileSink:
+    """Writes each encoded frame to {dataset_path}/{frame}{ext}."""
+
+    def __init__(self, dataset_path, ext=".jpg"):
+        self.dataset_path = dataset_path
+        self.ext = ext
+        os.makedirs(dataset_path, exist_ok=True)
+
+    def write(self, frame, encoded_bytes):
+        write_atomic(os.path.join(self.dataset_path, f"{frame}{self.ext}"), encoded_bytes)
+
+    def close(self):
+        pass
+
+
+class AsyncImageWriter:
+    """Bounded queue feeding a pool of image encoder threads.
+
+    Frames are encoded as JPEG by default, ext=".png" gives lossless frames.
+    to_rgb swaps the channels before encoding like the original dataset script did.
+    """
+
+    def __init__(self, sink, num_workers=4, max_queue=64, policy="block", jpeg_quality=95,
+                 ext=".jpg", to_rgb=True):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {BACKPRESSURE_POLICIES}")
+        self.sink = sink
+        self.policy = policy
+        self.ext = ext
+        self.to_rgb = to_rgb
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality] if ext == ".jpg" else []
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.max_queue_depth = 0
+        self._started = time.perf_counter()
+        self._finished = None
+
+        # live counterparts of the summary, bytes_total gives the disk write rate
+        self._frames_total = {result: REGISTRY.counter("image_writer_frames_total", "Camera frames by outcome",
+                                                       {"result": result})
+                              for result in ("received", "written", "dropped", "failed")}
+        self._bytes_total = REGISTRY.counter("image_writer_bytes_total", "Encoded image bytes written")
+        self._write_seconds = REGISTRY.histogram("image_writer_write_seconds",
+                                                 "Colour conversion, encode and write time of one frame")
+        REGISTRY.gauge("image_writer_queue_depth", "Frames waiting for a writer thread", fn=self._queue.qsize)
+
+        self._workers = [threading.Thread(target=self._run, name=f"image-writer-{i}", daemon=True)
+                         for i in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, image, frame=None):
+        """Queue a carla.Image for encoding, called from the sensor callback.
+
+        frame overrides the file's frame number, e.g. to save a replayed frame under its recorded number.
+        """
+        # raw_data is only valid during the callback so it has to be copied here
+        item = (image.frame if frame is None else frame, image.height, image.width, bytes(image.raw_data))
+        with self._lock:
+            self.received += 1
+        self._frames_total["received"].inc()
+
+        if self.policy == "block":
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self.policy == "drop_oldest":
+                    try:
+                        self._queue.get_nowait()
+                        self._queue.task_done()
+                    except queue.Empty:
+                        pass
+                    self._count_drop()
+                    self._queue.put(item)
+                else:
+                    self._count_drop()
+                    return
+
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+        self._frames_total["dropped"].inc()
+
+    def _run(self):
+        buffers = {}  # per-worker conversion buffer for each frame size
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            start = time.perf_counter()
+            try:
+                frame, height, width, raw = item
+                # BGRA to RGB (or BGR) and alpha drop in one pass
+                if (height, width) not in buffers:
+                    buffers[(height, width)] = np.empty((height, width, 3), dtype=np.uint8)
+                image_data = bgra_to(bgra_view(raw, height, width), "rgb" if self.to_rgb else "bgr",
+                                     dst=buffers[(height, width)])
+                ok, encoded = cv2.imencode(self.ext, image_data, self.encode_params)
+                if not ok:
+                    raise RuntimeError(f"{self.ext} encode failed for frame {frame}")
+                self.sink.write(frame, encoded.tobytes())
+                with self._lock:
+                    self.written += 1
+                    self.bytes_written += encoded.nbytes
+                self._frames_total["written"].inc()
+                self._bytes_total.inc(encoded.nbytes)
+                self._write_seconds.observe(time.perf_counter() - start)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                self._frames_total["failed"].inc()
+                print(f"Failed to write frame {item[0]}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """Drain the queue, stop the workers and close the sink."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._finished = time.perf_counter()
+        self.sink.close()
+
+    def summary(self):
+        elapsed = (self._finished or time.perf_counter()) - self._started
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "elapsed_s": elapsed,
+            "frames_per_s": self.written / elapsed if elapsed > 0 else 0.0,
+            "mb_per_s": self.bytes_written / 1e6 / elapsed if elapsed > 0 else 0.0,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        print(f"Image writer: {stats['written']}/{stats['received']} frames written in {stats['elapsed_s']:.1f}s "
+              f"({stats['frames_per_s']:.1f} fps, {stats['mb_per_s']:.2f} MB/s), "
+              f"{stats['dropped']} dropped, {stats['failed']} failed, max queue depth {stats['max_queue_depth']}")
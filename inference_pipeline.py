@@ -0,0 +1,338 @@
+"""Producer/consumer YOLO inference for camera sensor callbacks.
+
+    sensor callback --submit()--> bounded queue --> inference thread (batched model call)
+                                                        |--> on_result(record, result)  (logging)
+                                                        '--> latest()                  (render stage)
+
+The callback only copies the raw buffer (into a pooled array, see
+frame_convert). The inference thread batches up to
+batch_size queued frames (from any number of cameras) into one model() call.
+Rendering is left to whoever polls latest(), normally the pygame main loop.
+Instead of a fixed "every 4th frame" the stride adapts so the frames let
+through match the measured inference rate. Frames of different sources can
+run at their own imgsz (source_imgsz), a batch then makes one model() call
+per imgsz.
+
+With a tracker (box_tracker.TrackerSet) it decides which frames the model
+runs on, the stride becoming the shortest interval it may pick. The frames
+it skips are still queued, without copying their buffer, so the inference
+thread handles every frame in order and gives them predicted boxes
+(record.boxes) instead of a model result.
+"""
+import collections
+import math
+import queue
+import threading
+import time
+
+from frame_convert import FrameConverter, bgra_to
+from runtime_metrics import REGISTRY
+
+# latencies kept for summary() percentiles, the latency histogram covers the whole run
+LATENCY_SAMPLES = 10000
+
+
+class FrameRecord:
+    """A camera frame waiting for inference."""
+
+    __slots__ = ("source", "frame", "timestamp", "height", "width", "raw", "received_at", "meta", "image", "detect",
+                 "boxes")
+
+    def __init__(self, source, frame, timestamp, height, width, raw, received_at, meta, detect=True):
+        self.source = source
+        self.frame = frame
+        self.timestamp = timestamp
+        self.height = height
+        self.width = width
+        self.raw = raw
+        self.received_at = received_at
+        self.meta = meta
+        self.image = None  # converted model input, set on the inference thread
+        self.detect = detect  # False for frames only the tracker handles
+        self.boxes = None  # box_tracker.FrameBoxes when there is a tracker
+
+    def to_rgb(self):
+        return bgra_to(self.raw, "rgb")
+
+
+class InferencePipeline:
+    """Batches frames from sensor callbacks into model() calls on a worker thread."""
+
+    def __init__(self, model, imgsz=320, conf=0.5, batch_size=4, max_queue=16, device=None,
+                 on_result=None, adaptive_stride=True, stride=1, max_stride=20, channel_order="rgb",
+                 source_imgsz=None, tracker=None):
+        self.model = model
+        self.imgsz = imgsz
+        self.source_imgsz = dict(source_imgsz or {})
+        self.conf = conf
+        self.batch_size = batch_size
+        self.device = device
+        self.on_result = on_result
+        self.tracker = tracker
+        self.adaptive_stride = adaptive_stride
+        self.stride = stride
+        self.max_stride = max_stride
+        # "rgb" matches the frames earlier logs were made with, "bgr" is what ultralytics expects for numpy input
+        self.channel_order = channel_order
+        self.frames = FrameConverter()
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._source_counts = {}
+        self._latest = None
+        self._rendered = None
+        self._stop = threading.Event()
+
+        # rates as exponential moving averages, in frames per wall-clock second
+        self._arrival_rate = None
+        self._window_start = time.perf_counter()
+        self._window_count = 0
+        self._inference_rate = None
+
+        self.received = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.processed = 0
+        self.tracked = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)  # the most recent frames
+        self.sources = {}
+
+        # live counterparts of the summary, labelled by outcome
+        self._frames_total = {result: REGISTRY.counter("inference_frames_total", "Camera frames by outcome",
+                                                       {"result": result})
+                              for result in ("received", "processed", "tracked", "skipped", "dropped")}
+        self._batch_seconds = REGISTRY.histogram("inference_batch_seconds", "Wall time of the model calls of a batch")
+        self._latency_seconds = REGISTRY.histogram("inference_latency_seconds",
+                                                   "Sensor callback to detections handled")
+        REGISTRY.gauge("inference_queue_depth", "Frames waiting for the inference thread", fn=self._queue.qsize)
+        REGISTRY.gauge("inference_fps", "Frames the model gets through per second", fn=lambda: self._inference_rate)
+        REGISTRY.gauge("inference_stride", "Current frame stride", fn=lambda: self.stride)
+
+        self._thread = threading.Thread(target=self._run, name="inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, source="camera", meta=None):
+        """Queue a carla.Image, called from the sensor callback. Returns True if queued."""
+        now = time.perf_counter()
+        self._frames_total["received"].inc()
+        with self._lock:
+            self.received += 1
+            # arrival rate over ~1 s windows, cameras firing in the same tick arrive in bursts
+            self._window_count += 1
+            elapsed = now - self._window_start
+            if elapsed >= 1.0:
+                self._arrival_rate = self._ewma(self._arrival_rate, self._window_count / elapsed, alpha=0.5)
+                self._window_start = now
+                self._window_count = 0
+
+            # per-source counts, cameras of one rig deliver every tick so they keep the same frame ids
+            count = self._source_counts.get(source, 0)
+            self._source_counts[source] = count + 1
+            stats = self._source_stats(source)
+            stats["received"] += 1
+            if self.tracker is not None:
+                detect = self.tracker.should_detect(source, image.frame, meta, min_interval=self.stride)
+            else:
+                detect = count % self.stride == 0
+                if not detect:
+                    self.skipped += 1
+                    stats["skipped"] += 1
+                    self._frames_total["skipped"].inc()
+                    return False
+            stats["queued"] += 1
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], stats["queued"])
+
+        # raw_data is only valid during the callback so it has to be copied here, tracked frames don't need it
+        raw = self.frames.copy_raw(source, image) if detect else None
+        record = FrameRecord(source, image.frame, image.timestamp, image.height, image.width, raw, now, meta, detect)
+        while True:
+            try:
+                self._queue.put_nowait(record)
+                return True
+            except queue.Full:
+                pass
+            # keep the newest frames, the oldest one is already stale. Another camera's callback can take the
+            # freed slot first, then this goes round again instead of raising into the sensor callback
+            try:
+                stale = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            if stale.raw is not None:
+                self.frames.release(stale.raw)
+            self._frames_total["dropped"].inc()
+            with self._lock:
+                self.dropped += 1
+                self.sources[stale.source]["queued"] -= 1
+                self.sources[stale.source]["dropped"] += 1
+
+    def _source_stats(self, source):
+        stats = self.sources.get(source)
+        if stats is None:
+            stats = self.sources[source] = {"received": 0, "skipped": 0, "dropped": 0, "processed": 0, "tracked": 0,
+                                            "queued": 0, "max_queue_depth": 0}
+        return stats
+
+    @staticmethod
+    def _ewma(current, value, alpha=0.1):
+        return value if current is None else (1 - alpha) * current + alpha * value
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            with self._lock:
+                for record in batch:
+                    self.sources[record.source]["queued"] -= 1
+            arrived = batch
+            batch = [record for record in arrived if record.detect]
+            for record in batch:
+                record.image = self.frames.convert(record.source, record.raw, self.channel_order)
+                self.frames.release(record.raw)
+                record.raw = None
+            # one model() call per imgsz, ultralytics letterboxes a whole call to the same size
+            groups = {}
+            for record in batch:
+                groups.setdefault(self.source_imgsz.get(record.source, self.imgsz), []).append(record)
+
+            start = time.perf_counter()
+            batch = []
+            results = []
+            for imgsz, records in groups.items():
+                kwargs = {"imgsz": imgsz, "conf": self.conf, "verbose": False}
+                if self.device is not None:
+                    kwargs["device"] = self.device
+                try:
+                    results.extend(self.model([record.image for record in records], **kwargs))
+                    batch.extend(records)
+                except Exception as e:
+                    print(f"Inference failed for frames {[record.frame for record in records]}: {e}")
+                    for record in records:
+                        self.frames.release(record.image)
+            per_frame = (time.perf_counter() - start) / len(batch) if batch else 0.0
+            if batch:
+                self._batch_seconds.observe(per_frame * len(batch))
+                self._frames_total["processed"].inc(len(batch))
+
+            if self.tracker is not None:
+                self._track(arrived, batch, results)
+            else:
+                for record, result in zip(batch, results):
+                    self._handle(record, result)
+            if not batch:
+                continue
+
+            # results keep a reference to their input frame, only the one published for rendering stays alive
+            for record in batch[:-1]:
+                self.frames.release(record.image)
+            with self._lock:
+                self.processed += len(batch)
+                self.batches += 1
+                for record in batch:
+                    self.sources[record.source]["processed"] += 1
+                superseded, self._latest = self._latest, (batch[-1], results[-1])
+                if superseded is not None:
+                    self.frames.release(superseded[0].image)
+                if per_frame > 0:
+                    self._inference_rate = self._ewma(self._inference_rate, 1.0 / per_frame)
+                if self.adaptive_stride:
+                    self._update_stride()
+
+    def _handle(self, record, result):
+        if self.on_result is not None:
+            try:
+                self.on_result(record, result)
+            except Exception as e:
+                print(f"Failed to handle detections for frame {record.frame}: {e}")
+        self.latencies.append(time.perf_counter() - record.received_at)
+        self._latency_seconds.observe(self.latencies[-1])
+
+    def _track(self, arrived, batch, results):
+        """Feed every frame of a batch to the tracker in arrival order, the detected ones with their result."""
+        result_of = {id(record): result for record, result in zip(batch, results)}
+        tracked = []
+        for record in arrived:
+            result = result_of.get(id(record))
+            if result is not None:
+                record.boxes = self.tracker.detected(record.source, record.frame, result)
+            else:
+                # skipped by the tracker, or the model call for it failed
+                record.boxes = self.tracker.tracked(record.source, record.frame)
+                tracked.append(record)
+            self._handle(record, result)
+        self._frames_total["tracked"].inc(len(tracked))
+        with self._lock:
+            self.tracked += len(tracked)
+            for record in tracked:
+                self.sources[record.source]["tracked"] += 1
+
+    def _update_stride(self):
+        # let through only as many frames as inference can keep up with
+        if self._arrival_rate is None or self._inference_rate is None:
+            return
+        stride = math.ceil(self._arrival_rate / self._inference_rate)
+        self.stride = max(1, min(self.max_stride, stride))
+
+    def latest(self):
+        """Most recent (record, result) since the last call, or None. Used by the render stage.
+
+        The frame behind the result stays valid until the next latest() call.
+        """
+        with self._lock:
+            latest, self._latest = self._latest, None
+            if self._rendered is not None:
+                self.frames.release(self._rendered[0].image)
+            self._rendered = latest
+        return latest
+
+    def close(self):
+        """Finish the queued frames and stop the inference thread."""
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+
+        def pct(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q / 100.0 * len(latencies)))]
+
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "tracked": self.tracked,
+            "skipped_by_stride": self.skipped,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "stride": self.stride,
+            "inference_fps": self._inference_rate,
+            "arrival_fps": self._arrival_rate,
+            "latency_p50_ms": pct(50) * 1000 if latencies else None,
+            "latency_p95_ms": pct(95) * 1000 if latencies else None,
+            "latency_max_ms": latencies[-1] * 1000 if latencies else None,
+            "sources": {source: dict(stats) for source, stats in self.sources.items()},
+            "frame_buffers": self.frames.stats(),
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        print(f"Inference: {stats['processed']}/{stats['received']} frames in {stats['batches']} batches, "
+              f"{stats['skipped_by_stride']} skipped by stride (final stride {stats['stride']}), "
+              f"{stats['tracked']} tracked, {stats['dropped']} dropped")
+        if stats["latency_p50_ms"] is not None:
+            print(f"Sensor -> detection written latency: p50 {stats['latency_p50_ms']:.1f} ms, "
+                  f"p95 {stats['latency_p95_ms']:.1f} ms, max {stats['latency_max_ms']:.1f} ms")
@@ -0,0 +1,213 @@
+"""Precomputed traffic light / intersection index used for signal preemption.
+
+Built once at startup from the map's traffic lights and cached on disk keyed by
+map name, so later runs only have to re-bind the cached entries to the live
+traffic light actors. The cache is validated against the live lights' positions
+rather than a hash of the OpenDRIVE file, which would mean downloading the
+whole map description (megabytes for the larger towns) on every start. A map
+re-import that moves lane ends without moving any light goes unnoticed, delete
+cache/intersections_<map>.npz after one.
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+INDEX_VERSION = 1
+
+
+def location_key(x, y, z):
+    """Rounded (x, y, z) tuple used to match cached lights to live actors."""
+    return (round(x, 1), round(y, 1), round(z, 1))
+
+
+def map_signature(carla_map, traffic_lights):
+    """Hash of the map name and its traffic light positions, all local reads of already fetched actors."""
+    keys = sorted(location_key(location.x, location.y, location.z)
+                  for location in (light.get_transform().location for light in traffic_lights))
+    return hashlib.sha1(repr((carla_map.name, keys)).encode("utf-8")).hexdigest()
+
+
+def cache_path(map_name, cache_dir=CACHE_DIR):
+    """Cache file for a given map name."""
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", map_name)
+    return os.path.join(cache_dir, f"intersections_{safe_name}.npz")
+
+
+def neighbors_within(locations, radius):
+    """Find every point within radius of each point using a uniform grid.
+
+    Returns CSR style (indptr, indices) arrays, so the neighbours of point i are
+    indices[indptr[i]:indptr[i + 1]].
+    """
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    cells = np.floor(locations[:, :2] / radius).astype(np.int64)
+
+    # bucket points into radius sized cells, only the 3x3 block around a cell can match
+    grid = {}
+    for i, cell in enumerate(map(tuple, cells.tolist())):
+        grid.setdefault(cell, []).append(i)
+
+    radius_sq = radius * radius
+    indptr = [0]
+    indices = []
+    for i, (cx, cy) in enumerate(cells.tolist()):
+        candidates = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                candidates.extend(grid.get((cx + dx, cy + dy), ()))
+        candidates = np.array(candidates, dtype=np.int64)
+        dist_sq = ((locations[candidates] - locations[i]) ** 2).sum(axis=1)
+        near = np.sort(candidates[(dist_sq <= radius_sq) & (candidates != i)])
+        indices.extend(near.tolist())
+        indptr.append(len(indices))
+
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64)
+
+
+class IntersectionIndex:
+    """Lane -> controlling light lookup plus light -> intersection groups."""
+
+    def __init__(self, map_name, signature, radius, light_locations, neighbor_ptr,
+                 neighbor_idx, stop_light, stop_road, stop_lane, stop_locations, stop_forward):
+        self.map_name = str(map_name)
+        self.signature = str(signature)
+        self.radius = float(radius)
+        self.light_locations = np.asarray(light_locations, dtype=np.float64).reshape(-1, 3)
+        self.neighbor_ptr = np.asarray(neighbor_ptr, dtype=np.int64)
+        self.neighbor_idx = np.asarray(neighbor_idx, dtype=np.int64)
+
+        # stop waypoints, one row per waypoint, stop_light is the owning light index
+        self.stop_light = np.asarray(stop_light, dtype=np.int64)
+        self.stop_road = np.asarray(stop_road, dtype=np.int64)
+        self.stop_lane = np.asarray(stop_lane, dtype=np.int64)
+        self.stop_locations = np.asarray(stop_locations, dtype=np.float64).reshape(-1, 3)
+        self.stop_forward = np.asarray(stop_forward, dtype=np.float64).reshape(-1, 2)
+
+        # (road_id, lane_id) -> stop waypoint row, first light found wins like the old scan
+        self.lane_to_stop = {}
+        for row, key in enumerate(zip(self.stop_road.tolist(), self.stop_lane.tolist())):
+            self.lane_to_stop.setdefault(key, row)
+
+        self.lights = [None] * len(self.light_locations)
+        self._actor_to_index = {}
+
+    @classmethod
+    def build(cls, carla_map, traffic_lights, radius=30.0, signature=None):
+        """Build the index from the live traffic light actors."""
+        light_locations = []
+        stop_light, stop_road, stop_lane, stop_locations, stop_forward = [], [], [], [], []
+
+        for i, light in enumerate(traffic_lights):
+            location = light.get_transform().location
+            light_locations.append((location.x, location.y, location.z))
+            for w in light.get_stop_waypoints():
+                w_location = w.transform.location
+                forward = w.transform.get_forward_vector()
+                stop_light.append(i)
+                stop_road.append(w.road_id)
+                stop_lane.append(w.lane_id)
+                stop_locations.append((w_location.x, w_location.y, w_location.z))
+                stop_forward.append((forward.x, forward.y))
+
+        light_locations = np.array(light_locations, dtype=np.float64).reshape(-1, 3)
+        neighbor_ptr, neighbor_idx = neighbors_within(light_locations, radius)
+
+        if signature is None:
+            signature = map_signature(carla_map, traffic_lights)
+
+        index = cls(carla_map.name, signature, radius, light_locations, neighbor_ptr,
+                    neighbor_idx, stop_light, stop_road, stop_lane, stop_locations, stop_forward)
+        index.bind(traffic_lights)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """Load a cached index, the lights still have to be bound with bind()."""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"Index cache {path} has an old format")
+            return cls(data["map_name"], data["signature"], data["radius"],
+                       data["light_locations"], data["neighbor_ptr"], data["neighbor_idx"],
+                       data["stop_light"], data["stop_road"], data["stop_lane"],
+                       data["stop_locations"], data["stop_forward"])
+
+    def save(self, path):
+        """Write the index to disk, atomically so a crash never leaves half a cache."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=INDEX_VERSION, map_name=self.map_name,
+                 signature=self.signature, radius=self.radius,
+                 light_locations=self.light_locations, neighbor_ptr=self.neighbor_ptr,
+                 neighbor_idx=self.neighbor_idx, stop_light=self.stop_light,
+                 stop_road=self.stop_road, stop_lane=self.stop_lane,
+                 stop_locations=self.stop_locations, stop_forward=self.stop_forward)
+        os.replace(tmp_path, path)
+
+    def bind(self, traffic_lights):
+        """Attach live traffic light actors to the cached entries by location.
+
+        Returns False if the actors don't match the cached lights one to one.
+        """
+        key_to_index = {location_key(*xyz): i for i, xyz in enumerate(self.light_locations.tolist())}
+        lights = [None] * len(self.light_locations)
+        for light in traffic_lights:
+            location = light.get_transform().location
+            i = key_to_index.get(location_key(location.x, location.y, location.z))
+            if i is None or lights[i] is not None:
+                return False
+            lights[i] = light
+        if any(light is None for light in lights):
+            return False
+
+        self.lights = lights
+        self._actor_to_index = {light.id: i for i, light in enumerate(lights)}
+        return True
+
+    def stop_for_lane(self, road_id, lane_id):
+        """Stop waypoint row controlling a lane, or None."""
+        return self.lane_to_stop.get((road_id, lane_id))
+
+    def approach_for_waypoint(self, waypoint):
+        """(light, stop (x, y), stop forward (x, y)) for the waypoint's lane, or None."""
+        row = self.lane_to_stop.get((waypoint.road_id, waypoint.lane_id))
+        if row is None:
+            return None
+        stop_location = (float(self.stop_locations[row, 0]), float(self.stop_locations[row, 1]))
+        stop_forward = (float(self.stop_forward[row, 0]), float(self.stop_forward[row, 1]))
+        return self.lights[int(self.stop_light[row])], stop_location, stop_forward
+
+    def intersection(self, light):
+        """Other lights within the grouping radius of a light."""
+        i = self._actor_to_index.get(light.id)
+        if i is None:
+            return []
+        members = self.neighbor_idx[self.neighbor_ptr[i]:self.neighbor_ptr[i + 1]]
+        return [self.lights[j] for j in members.tolist()]
+
+
+def load_or_build(world, radius=30.0, cache_dir=CACHE_DIR, carla_map=None):
+    """Load the cached index for the current map, rebuilding it if the map changed."""
+    if carla_map is None:
+        carla_map = world.get_map()
+    traffic_lights = world.get_actors().filter('traffic.traffic_light')
+    path = cache_path(carla_map.name, cache_dir)
+    signature = map_signature(carla_map, traffic_lights)
+
+    if os.path.exists(path):
+        try:
+            index = IntersectionIndex.load(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Ignoring intersection cache {path}: {e}")
+        else:
+            if index.signature == signature and index.radius == radius and index.bind(traffic_lights):
+                print(f"Loaded intersection index for {carla_map.name} ({len(index.lights)} lights).")
+                return index
+            print(f"Map {carla_map.name} changed, rebuilding intersection index.")
+
+    index = IntersectionIndex.build(carla_map, traffic_lights, radius, signature)
+    index.save(path)
+    print(f"Built intersection index for {carla_map.name} ({len(index.lights)} lights).")
+    return index
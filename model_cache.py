@@ -0,0 +1,145 @@
+"""YOLO models exported once to a faster CPU format and cached on disk.
+
+Loading a .pt checkpoint means unpickling it into PyTorch and paying the
+first-call setup (fusing, autotuning) on every launch. Here the checkpoint
+is exported once with ultralytics' exporter and the result is kept in
+cache/models/, keyed by the checkpoint's content hash, the export format and
+imgsz (exported models have a fixed input size):
+
+    cache/models/yolo12m-3f9a1c2b7d10-onnx-320.onnx
+    cache/models/yolo12m-3f9a1c2b7d10-onnx-320.json   export metadata
+
+ONNX is exported with a dynamic batch axis, so partial batches work.
+TorchScript is traced at a fixed batch, which is part of its key, so it
+is only safe with batch 1 (or batches that are always full). A rig
+with several resolutions gets one export per imgsz behind ModelsByImgsz,
+which picks the model from the imgsz argument InferencePipeline passes on
+every call. The default "pt" skips exporting and loads the checkpoint as
+before, exporting is opt-in.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "models")
+MODEL_FORMATS = ("onnx", "torchscript", "pt")
+EXPORT_SUFFIX = {"onnx": ".onnx", "torchscript": ".torchscript"}
+
+# (absolute path, size, mtime_ns) -> sha1, so several resolutions of one checkpoint hash it once
+_hashes = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha1 of a file's contents, so a retrained checkpoint with the same name gets a new export.
+
+    Memoized per (path, size, mtime): a rewritten file is hashed again.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    cached = _hashes.get(key)
+    if cached is not None:
+        return cached
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def export_path(weights, fmt, imgsz, batch=1, cache_dir=CACHE_DIR):
+    """Cache file of one export, None if the checkpoint isn't on disk yet."""
+    if not os.path.exists(weights):
+        return None
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    name = f"{stem}-{file_hash(weights)[:12]}-{fmt}-{imgsz}"
+    if fmt == "torchscript":
+        name += f"-b{batch}"
+    return os.path.join(cache_dir, name + EXPORT_SUFFIX[fmt])
+
+
+def load_model(weights, imgsz, fmt="pt", batch=1, device=None, cache_dir=CACHE_DIR):
+    """YOLO model for one imgsz, exported and cached on first use. Returns (model, info)."""
+    from ultralytics import YOLO
+
+    if fmt not in MODEL_FORMATS:
+        raise ValueError(f"Unknown model format {fmt!r}, expected one of {MODEL_FORMATS}")
+    start = time.perf_counter()
+    if fmt == "pt":
+        return YOLO(weights), {"format": "pt", "path": weights, "cached": False,
+                               "load_s": time.perf_counter() - start}
+
+    path = export_path(weights, fmt, imgsz, batch, cache_dir)
+    meta_path = os.path.splitext(path)[0] + ".json" if path else None
+    if path and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        model = YOLO(path, task=meta["task"])
+        return model, dict(meta, cached=True, load_s=time.perf_counter() - start)
+
+    # first use: load the checkpoint (ultralytics downloads known weights), export, move into the cache
+    source = YOLO(weights)
+    weights = getattr(source, "ckpt_path", None) or weights
+    path = export_path(weights, fmt, imgsz, batch, cache_dir)
+    meta_path = os.path.splitext(path)[0] + ".json"
+    kwargs = {"format": fmt, "imgsz": imgsz, "device": device or "cpu"}
+    if fmt == "onnx":
+        kwargs.update(dynamic=True, simplify=True)
+    else:
+        kwargs["batch"] = batch
+    exported = source.export(**kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    shutil.move(str(exported), tmp_path)
+    os.replace(tmp_path, path)
+    meta = {
+        "format": fmt, "path": path, "weights": os.path.abspath(weights), "task": source.task,
+        "imgsz": imgsz, "batch": batch, "export_s": time.perf_counter() - start, "created": time.time(),
+    }
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    print(f"Exported {weights} to {path} in {meta['export_s']:.1f}s")
+
+    model = YOLO(path, task=source.task)
+    return model, dict(meta, cached=False, load_s=time.perf_counter() - start)
+
+
+class ModelsByImgsz:
+    """One exported model per imgsz behind the model(images, imgsz=...) call InferencePipeline makes."""
+
+    def __init__(self, models):
+        self.models = dict(models)
+
+    def __call__(self, images, imgsz, **kwargs):
+        return self.models[imgsz](images, imgsz=imgsz, **kwargs)
+
+
+def load_models(weights, imgsz_values, fmt="pt", batch=1, device=None, cache_dir=CACHE_DIR):
+    """A model callable for every imgsz of a rig, plus {imgsz: load info}."""
+    imgsz_values = sorted(set(imgsz_values))
+    if fmt == "pt":
+        # a checkpoint runs at any imgsz, one model serves every camera
+        model, info = load_model(weights, imgsz_values[-1], fmt, batch, device, cache_dir)
+        return model, {imgsz: info for imgsz in imgsz_values}
+    models, infos = {}, {}
+    for imgsz in imgsz_values:
+        models[imgsz], infos[imgsz] = load_model(weights, imgsz, fmt, batch, device, cache_dir)
+    return ModelsByImgsz(models), infos
+
+
+def warm_up(model, imgsz_values, batch=1, device=None, conf=0.5, runs=2):
+    """Run blank frames through every imgsz so the first real frame doesn't pay for setup. Returns seconds."""
+    start = time.perf_counter()
+    kwargs = {"conf": conf, "verbose": False}
+    if device is not None:
+        kwargs["device"] = device
+    for imgsz in sorted(set(imgsz_values)):
+        frames = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(batch)]
+        for _ in range(runs):
+            model(frames, imgsz=imgsz, **kwargs)
+    return time.perf_counter() - start
@@ -0,0 +1,206 @@
+"""Batched vehicle -> pedestrian proximity detection.
+
+All actor transforms and velocities are read from one world snapshot per
+tick, then every vehicle/pedestrian pair is tested at once with NumPy: dense
+broadcasting for small scenes, a sorted uniform grid when the pair count is
+large. A pedestrian is a hit for a vehicle when it is within detection_range
+and inside the vehicle's forward cone (half-angle 90 degrees by default, the
+"in front of the vehicle" test the original loop used).
+
+    python pedestrian_detection.py   # micro-benchmark on synthetic positions
+"""
+import math
+import time
+
+import numpy as np
+
+# above this many vehicle x pedestrian pairs the grid wins: about 9k pairs break even
+# (0.2 ms each), 20k pairs take 0.54 ms dense against 0.16 ms on the grid
+DENSE_PAIR_LIMIT = 10000
+
+
+class PedestrianHits:
+    """Per-vehicle detection results for one tick."""
+
+    def __init__(self, num_vehicles, vehicle_idx, pedestrian_idx, distance, ttc):
+        self.vehicle_idx = vehicle_idx
+        self.pedestrian_idx = pedestrian_idx
+        self.distance = distance
+        self.ttc = ttc
+
+        # pairs are ordered by vehicle, so each vehicle's hits are one contiguous slice
+        bounds = np.searchsorted(vehicle_idx, np.arange(num_vehicles + 1))
+        self._bounds = bounds
+        self.any_hit = bounds[1:] > bounds[:-1]
+        self.nearest = np.full(num_vehicles, np.inf)
+        self.min_ttc = np.full(num_vehicles, np.inf)
+        if len(vehicle_idx):
+            starts = bounds[:-1][self.any_hit]
+            self.nearest[self.any_hit] = np.minimum.reduceat(distance, starts)
+            self.min_ttc[self.any_hit] = np.minimum.reduceat(ttc, starts)
+
+    def hits(self, vehicle):
+        """Indices of the pedestrians detected by one vehicle."""
+        return self.pedestrian_idx[self._bounds[vehicle]:self._bounds[vehicle + 1]]
+
+
+def _candidate_pairs_dense(veh_pos, veh_forward, ped_pos, detection_range):
+    """Pairs in range and in front, from a (V, P) broadcast over every pair."""
+    rel_x = ped_pos[None, :, 0] - veh_pos[:, None, 0]
+    rel_y = ped_pos[None, :, 1] - veh_pos[:, None, 1]
+    close = (rel_x * rel_x + rel_y * rel_y < detection_range * detection_range)
+    close &= rel_x * veh_forward[:, None, 0] + rel_y * veh_forward[:, None, 1] > 0
+    return np.nonzero(close)  # row major, so ordered by vehicle
+
+
+def _candidate_pairs_grid(veh_pos, ped_pos, cell_size):
+    """Pairs whose cells are neighbours, found with a sort + searchsorted instead of Python loops."""
+    veh_cells = np.floor(veh_pos / cell_size).astype(np.int64)
+    ped_cells = np.floor(ped_pos / cell_size).astype(np.int64)
+    low = np.minimum(veh_cells.min(axis=0), ped_cells.min(axis=0)) - 1
+    span_y = max(veh_cells[:, 1].max(), ped_cells[:, 1].max()) - low[1] + 2
+
+    def cell_key(cells):
+        return (cells[..., 0] - low[0]) * span_y + (cells[..., 1] - low[1])
+
+    order = np.argsort(cell_key(ped_cells), kind="stable")
+    sorted_keys = cell_key(ped_cells)[order]
+
+    offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=np.int64)
+    query = cell_key(veh_cells[:, None, :] + offsets[None, :, :])  # (V, 9)
+    lo = np.searchsorted(sorted_keys, query, side="left").ravel()
+    hi = np.searchsorted(sorted_keys, query, side="right").ravel()
+    counts = hi - lo
+
+    total = int(counts.sum())
+    vehicle_idx = np.repeat(np.repeat(np.arange(len(veh_pos)), 9), counts)
+    run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    pedestrian_idx = order[np.repeat(lo, counts) + np.arange(total) - run_starts]
+    return vehicle_idx, pedestrian_idx
+
+
+def detect_pedestrians_batch(veh_pos, veh_forward, veh_vel, ped_pos, ped_vel,
+                             detection_range=10.0, cone_half_angle=90.0, dense_pair_limit=DENSE_PAIR_LIMIT):
+    """Test every vehicle against every pedestrian.
+
+    Positions, forward vectors and velocities are (N, 2) arrays in the xy plane.
+    Returns PedestrianHits with per-vehicle hit lists, nearest distance and
+    time to collision (inf when the pedestrian isn't getting closer).
+    """
+    veh_pos = np.asarray(veh_pos, dtype=np.float64).reshape(-1, 2)
+    ped_pos = np.asarray(ped_pos, dtype=np.float64).reshape(-1, 2)
+    num_vehicles, num_pedestrians = len(veh_pos), len(ped_pos)
+    if num_vehicles == 0 or num_pedestrians == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return PedestrianHits(num_vehicles, empty, empty, np.zeros(0), np.zeros(0))
+
+    veh_forward = np.asarray(veh_forward, dtype=np.float64).reshape(-1, 2)
+    if num_vehicles * num_pedestrians <= dense_pair_limit and cone_half_angle <= 90.0:
+        vehicle_idx, pedestrian_idx = _candidate_pairs_dense(veh_pos, veh_forward, ped_pos, detection_range)
+    else:
+        vehicle_idx, pedestrian_idx = _candidate_pairs_grid(veh_pos, ped_pos, detection_range)
+
+    relative = ped_pos[pedestrian_idx] - veh_pos[vehicle_idx]
+    distance = np.hypot(relative[:, 0], relative[:, 1])
+    along = (relative * veh_forward[vehicle_idx]).sum(axis=1)
+
+    # in front: angle to the forward vector below the cone half-angle (90 deg -> dot product > 0)
+    cos_limit = math.cos(math.radians(cone_half_angle))
+    hit = (distance < detection_range) & (along > cos_limit * distance)
+
+    vehicle_idx = vehicle_idx[hit]
+    pedestrian_idx = pedestrian_idx[hit]
+    relative = relative[hit]
+    distance = distance[hit]
+
+    # closing speed along the line of sight, TTC only when the gap is shrinking
+    relative_vel = (np.asarray(ped_vel, dtype=np.float64).reshape(-1, 2)[pedestrian_idx]
+                    - np.asarray(veh_vel, dtype=np.float64).reshape(-1, 2)[vehicle_idx])
+    closing = -(relative * relative_vel).sum(axis=1) / np.maximum(distance, 1e-6)
+    with np.errstate(divide="ignore"):
+        ttc = np.where(closing > 1e-6, distance / np.maximum(closing, 1e-6), np.inf)
+
+    return PedestrianHits(num_vehicles, vehicle_idx, pedestrian_idx, distance, ttc)
+
+
+def snapshot_arrays(snapshot, actor_ids):
+    """(positions, forward vectors, velocities, found) for actor ids from one world snapshot.
+
+    The first three are (N, 2) arrays, found marks the actors present in the snapshot.
+    """
+    row_of = {actor_id: i for i, actor_id in enumerate(actor_ids)}
+    states = np.zeros((len(actor_ids), 5))  # x, y, yaw, vx, vy
+    found = np.zeros(len(actor_ids), dtype=bool)
+    for actor_snapshot in snapshot:
+        i = row_of.get(actor_snapshot.id)
+        if i is None:
+            continue
+        transform = actor_snapshot.get_transform()
+        velocity = actor_snapshot.get_velocity()
+        states[i] = (transform.location.x, transform.location.y, transform.rotation.yaw, velocity.x, velocity.y)
+        found[i] = True
+
+    yaw = np.radians(states[:, 2])
+    forward = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+    return states[:, :2], forward, states[:, 3:5], found
+
+
+class PedestrianMonitor:
+    """Detects pedestrians in front of a fixed set of vehicles, one snapshot per tick."""
+
+    def __init__(self, world, vehicles, detection_range=10.0, cone_half_angle=90.0, refresh_every=20):
+        self.world = world
+        self.vehicle_ids = [vehicle.id for vehicle in vehicles]
+        self.detection_range = detection_range
+        self.cone_half_angle = cone_half_angle
+        self.refresh_every = refresh_every
+        self.pedestrian_ids = []
+        self._ticks = 0
+
+    def refresh_pedestrians(self):
+        """Re-list the pedestrians, walkers come and go much slower than we tick."""
+        self.pedestrian_ids = [walker.id for walker in self.world.get_actors().filter('walker.pedestrian.*')]
+
+    def update(self, snapshot=None):
+        """PedestrianHits for this tick, vehicle i is self.vehicle_ids[i]."""
+        if self._ticks % self.refresh_every == 0:
+            self.refresh_pedestrians()
+        self._ticks += 1
+        if snapshot is None:
+            snapshot = self.world.get_snapshot()
+        veh_pos, veh_forward, veh_vel, found = snapshot_arrays(snapshot, self.vehicle_ids)
+        if not found.all():
+            # destroyed vehicles drop out for good, vehicle_ids stays aligned with the results
+            self.vehicle_ids = [actor_id for actor_id, ok in zip(self.vehicle_ids, found) if ok]
+            veh_pos, veh_forward, veh_vel = veh_pos[found], veh_forward[found], veh_vel[found]
+        ped_pos, _, ped_vel, found = snapshot_arrays(snapshot, self.pedestrian_ids)
+        if not found.all():
+            self.pedestrian_ids = [actor_id for actor_id, ok in zip(self.pedestrian_ids, found) if ok]
+            ped_pos, ped_vel = ped_pos[found], ped_vel[found]
+        return detect_pedestrians_batch(veh_pos, veh_forward, veh_vel, ped_pos, ped_vel,
+                                        self.detection_range, self.cone_half_angle)
+
+
+def benchmark(num_vehicles=500, num_pedestrians=2000, extent=1000.0, repeats=20, seed=0):
+    """Time one detection tick on synthetic positions, no simulator needed."""
+    rng = np.random.default_rng(seed)
+    veh_pos = rng.uniform(0, extent, (num_vehicles, 2))
+    yaw = rng.uniform(-np.pi, np.pi, num_vehicles)
+    veh_forward = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+    veh_vel = veh_forward * rng.uniform(0, 15, (num_vehicles, 1))
+    ped_pos = rng.uniform(0, extent, (num_pedestrians, 2))
+    ped_vel = rng.normal(0, 1.4, (num_pedestrians, 2))
+
+    for name, limit in (("dense", float("inf")), ("grid", 0)):
+        args = (veh_pos, veh_forward, veh_vel, ped_pos, ped_vel)
+        result = detect_pedestrians_batch(*args, dense_pair_limit=limit)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            detect_pedestrians_batch(*args, dense_pair_limit=limit)
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"{name}: {num_vehicles} vehicles x {num_pedestrians} pedestrians, "
+              f"{elapsed * 1000:.2f} ms/tick, {int(result.any_hit.sum())} vehicles with hits")
+
+
+if __name__ == "__main__":
+    benchmark()
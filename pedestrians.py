@@ -1,78 +1,56 @@
 import carla
-import time
-import random
-import math
 
-def get_distance(location1, location2):
-    """Calculate Euclidean distance between two CARLA locations."""
-    return math.sqrt((location1.x - location2.x) ** 2 + (location1.y - location2.y) ** 2)
-
-def detect_pedestrians(vehicle, pedestrians, detection_range=10.0):
-    """Check if there are pedestrians within a given detection range in front of the vehicle."""
-    vehicle_location = vehicle.get_location()
-    vehicle_forward_vector = vehicle.get_transform().get_forward_vector()
-
-    for pedestrian in pedestrians:
-        ped_location = pedestrian.get_location()
-        distance = get_distance(vehicle_location, ped_location)
-
-        # Check if the pedestrian is within range and in front of the vehicle
-        relative_vector = carla.Location(
-            x=ped_location.x - vehicle_location.x,
-            y=ped_location.y - vehicle_location.y
-        )
-        dot_product = relative_vector.x * vehicle_forward_vector.x + relative_vector.y * vehicle_forward_vector.y
-        
-        if distance < detection_range and dot_product > 0:
-            return True  # Pedestrian detected in front of the vehicle
-
-    return False
+from pedestrian_detection import PedestrianMonitor
+from runtime_metrics import start_exporter
+from spawn_manager import SpawnManager
+from tick_runner import TickRunner
 
 
 client = carla.Client('localhost', 2000)
 client.set_timeout(10.0)
 world = client.get_world()
 
-blueprint_library = world.get_blueprint_library()
-
-
-vehicle_blueprints = blueprint_library.filter('vehicle.*')
+number_of_vehicles = 10
+# like the original script, react to the pedestrians already in the world, > 0 spawns extra walkers
+number_of_walkers = 0
+seed = 0  # same vehicles, spawn points and walkers every run
 
-spawn_points = world.get_map().get_spawn_points()
+# simulation is stepped by the tick runner at 0.05s (20 fps), realtime = False ticks as fast as possible
+fixed_delta_seconds = 0.05
+realtime = True
 
-number_of_vehicles = 10
 
+# spawns vehicles and walkers (with AI controllers) in batches and destroys everything on exit
+spawn_manager = SpawnManager(client, world, seed=seed)
+vehicles_list = spawn_manager.spawn_vehicles(number_of_vehicles, 'vehicle.*', autopilot=False)
+if number_of_walkers:
+    spawn_manager.spawn_walkers(number_of_walkers)
+spawn_manager.print_report()
 
-random.shuffle(spawn_points)
-vehicles_list = []
 
-for i in range(number_of_vehicles):
-    bp = random.choice(vehicle_blueprints)
-    spawn_point = spawn_points[i]
-    
-    vehicle = world.try_spawn_actor(bp, spawn_point)
-    if vehicle:
-        vehicle.set_autopilot(False)  
-        vehicles_list.append(vehicle)
-        print(f"Spawned vehicle {vehicle.type_id} at {spawn_point.location}")
-    else:
-        print(f"Failed to spawn vehicle at {spawn_point.location}")
+# checks every vehicle against every pedestrian (10 m, in front) from one snapshot per tick
+pedestrian_monitor = PedestrianMonitor(world, vehicles_list, detection_range=10.0)
 
+def brake_for_pedestrians(snapshot):
+    detections = pedestrian_monitor.update(snapshot)
+    stopped = set(actor_id for actor_id, hit in zip(pedestrian_monitor.vehicle_ids, detections.any_hit) if hit)
+    for vehicle in vehicles_list:
+        if vehicle.id in stopped:
+            vehicle.apply_control(carla.VehicleControl(throttle=0.0, brake=1.0))  
+            print(f"Vehicle {vehicle.id} stopped for pedestrian")
+        else:
+            vehicle.apply_control(carla.VehicleControl(throttle=0.5, brake=0.0))  
 
-pedestrians = world.get_actors().filter('walker.pedestrian.*')
+# tick and controller times live on http://127.0.0.1:METRICS_PORT/metrics
+metrics = start_exporter()
 
 try:
-    for _ in range(600):  
-        for vehicle in vehicles_list:
-            if detect_pedestrians(vehicle, pedestrians):
-                vehicle.apply_control(carla.VehicleControl(throttle=0.0, brake=1.0))  
-                print(f"Vehicle {vehicle.id} stopped for pedestrian")
-            else:
-                vehicle.apply_control(carla.VehicleControl(throttle=0.5, brake=0.0))  
-        
-        time.sleep(0.05)  
+    with TickRunner(world, fixed_delta_seconds, realtime) as runner:
+        runner.add_controller("pedestrian_braking", brake_for_pedestrians)
+        runner.run(600)
+    runner.print_stats()
 finally:
     print("Destroying vehicles...")
-    for vehicle in vehicles_list:
-        vehicle.destroy()
+    spawn_manager.destroy_all()
+    metrics.close()
     print("Done.")
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""Tick driven traffic signal preemption for emergency vehicles.
+
+The scheduler never sleeps: the caller passes the current time to request() and
+update() every poll/tick. Active preemptions sit in a priority queue ordered by
+expiry and are released early once every emergency vehicle they serve has
+passed the stop line. Requests that conflict with a junction that is already
+held for another approach wait in a FIFO until it is released.
+"""
+import heapq
+import itertools
+import random
+from collections import deque
+
+try:
+    import carla
+    GREEN = carla.TrafficLightState.Green
+    RED = carla.TrafficLightState.Red
+except ImportError:
+    # lets the scheduler run against stand-in lights without a CARLA install
+    carla = None
+    GREEN = "Green"
+    RED = "Red"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list, None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+class Preemption:
+    """One held junction: a green approach light and the red cross lights."""
+
+    def __init__(self, vehicle_id, light, cross_lights, stop_location, stop_forward, requested_at):
+        self.vehicle_ids = {vehicle_id}
+        self.light = light
+        self.cross_lights = list(cross_lights)
+        self.stop_location = stop_location
+        self.stop_forward = stop_forward
+        self.requested_at = requested_at
+        self.green_at = None
+        self.expires_at = None
+        self.released_at = None
+        self.release_reason = None
+
+    def light_ids(self):
+        return [self.light.id] + [light.id for light in self.cross_lights]
+
+    def has_passed(self, location, clearance):
+        """True once a vehicle location is past the stop line along the lane direction."""
+        dx = location[0] - self.stop_location[0]
+        dy = location[1] - self.stop_location[1]
+        return dx * self.stop_forward[0] + dy * self.stop_forward[1] > clearance
+
+
+class PreemptionScheduler:
+    """Priority queue of active signal preemptions with expiry times."""
+
+    def __init__(self, hold_time=15.0, clearance=2.0, verbose=True):
+        self.hold_time = hold_time
+        self.clearance = clearance
+        self.verbose = verbose
+
+        self._heap = []  # (expires_at, seq, preemption), stale entries skipped on pop
+        self._seq = itertools.count()
+        self._held = {}  # light id -> preemption holding it
+        self._by_vehicle = {}  # vehicle id -> active or pending preemption
+        self._pending = deque()
+        self.completed = []
+        self.conflicts = 0
+
+    def is_held(self, light):
+        return light.id in self._held
+
+    def active(self):
+        """Distinct preemptions currently holding lights."""
+        return list({id(p): p for p in self._held.values()}.values())
+
+    def request(self, vehicle_id, light, cross_lights, stop_location, stop_forward, now):
+        """Ask for a green at light for vehicle_id.
+
+        Returns "granted", "joined" (another vehicle already holds this approach),
+        "queued" (a conflicting approach holds the junction) or "active" if the
+        vehicle is already being served by this light.
+        """
+        existing = self._by_vehicle.get(vehicle_id)
+        if existing is not None:
+            if existing.light.id == light.id:
+                return "active"
+            # vehicle moved on to another junction before the old one released
+            self._drop_vehicle(existing, vehicle_id, now)
+
+        holder = self._held.get(light.id)
+        if holder is not None and holder.light.id == light.id:
+            holder.vehicle_ids.add(vehicle_id)
+            self._by_vehicle[vehicle_id] = holder
+            self._schedule(holder, now + self.hold_time)
+            return "joined"
+
+        preemption = Preemption(vehicle_id, light, cross_lights, stop_location, stop_forward, now)
+        self._by_vehicle[vehicle_id] = preemption
+        if self._conflicts_with_held(preemption):
+            self.conflicts += 1
+            self._pending.append(preemption)
+            if self.verbose:
+                print(f"Ambulance {vehicle_id} waiting, intersection of light {light.id} is held.")
+            return "queued"
+
+        self._grant(preemption, now)
+        return "granted"
+
+    def update(self, now, vehicle_locations):
+        """Release preemptions whose vehicles cleared the stop line or whose hold expired.
+
+        vehicle_locations maps emergency vehicle id -> (x, y); vehicles missing
+        from it are treated as gone.
+        """
+        for preemption in self.active():
+            for vehicle_id in list(preemption.vehicle_ids):
+                location = vehicle_locations.get(vehicle_id)
+                if location is None or preemption.has_passed(location, self.clearance):
+                    preemption.vehicle_ids.discard(vehicle_id)
+                    self._by_vehicle.pop(vehicle_id, None)
+            if not preemption.vehicle_ids:
+                self._release(preemption, now, "cleared")
+
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, _, preemption = heapq.heappop(self._heap)
+            if preemption.released_at is None and preemption.expires_at == expires_at:
+                self._release(preemption, now, "expired")
+
+        # pending requests whose vehicle disappeared are dropped
+        for preemption in list(self._pending):
+            for vehicle_id in list(preemption.vehicle_ids):
+                if vehicle_id not in vehicle_locations:
+                    preemption.vehicle_ids.discard(vehicle_id)
+                    self._by_vehicle.pop(vehicle_id, None)
+            if not preemption.vehicle_ids:
+                self._pending.remove(preemption)
+
+    def release_all(self, now=None):
+        """Unfreeze every held light, used on shutdown."""
+        for preemption in self.active():
+            self._release(preemption, now, "shutdown")
+        self._pending.clear()
+        self._by_vehicle.clear()
+
+    def _conflicts_with_held(self, preemption):
+        return any(light_id in self._held for light_id in preemption.light_ids())
+
+    def _schedule(self, preemption, expires_at):
+        preemption.expires_at = expires_at
+        heapq.heappush(self._heap, (expires_at, next(self._seq), preemption))
+
+    def _grant(self, preemption, now):
+        preemption.light.set_state(GREEN)
+        preemption.light.freeze(True)
+        for other_light in preemption.cross_lights:
+            other_light.set_state(RED)
+            other_light.freeze(True)
+        for light_id in preemption.light_ids():
+            self._held[light_id] = preemption
+        preemption.green_at = now
+        self._schedule(preemption, now + self.hold_time)
+
+        if self.verbose:
+            vehicles = ", ".join(str(v) for v in sorted(preemption.vehicle_ids))
+            print(f"Ambulance {vehicles} approaching. Traffic light {preemption.light.id} set to GREEN, "
+                  f"{len(preemption.cross_lights)} lights set to RED to prioritize ambulance.")
+
+    def _release(self, preemption, now, reason):
+        preemption.light.freeze(False)
+        for other_light in preemption.cross_lights:
+            other_light.freeze(False)
+        for light_id in preemption.light_ids():
+            if self._held.get(light_id) is preemption:
+                del self._held[light_id]
+        for vehicle_id in preemption.vehicle_ids:
+            if self._by_vehicle.get(vehicle_id) is preemption:
+                del self._by_vehicle[vehicle_id]
+
+        preemption.released_at = now
+        preemption.release_reason = reason
+        self.completed.append(preemption)
+        if self.verbose:
+            print(f"Traffic light {preemption.light.id} set back to normal ({reason}). Normal operation resumed.")
+
+        if now is not None:
+            self._grant_pending(now)
+
+    def _drop_vehicle(self, preemption, vehicle_id, now):
+        preemption.vehicle_ids.discard(vehicle_id)
+        self._by_vehicle.pop(vehicle_id, None)
+        if preemption.vehicle_ids:
+            return
+        if preemption in self._pending:
+            self._pending.remove(preemption)
+        elif preemption.green_at is not None and preemption.released_at is None:
+            self._release(preemption, now, "cleared")
+
+    def _grant_pending(self, now):
+        # FIFO, but a later request can go first if it doesn't conflict with what's held
+        for preemption in list(self._pending):
+            holder = self._held.get(preemption.light.id)
+            if holder is not None and holder.light.id == preemption.light.id:
+                # same approach was granted to an earlier request, ride along with it
+                self._pending.remove(preemption)
+                holder.vehicle_ids.update(preemption.vehicle_ids)
+                for vehicle_id in preemption.vehicle_ids:
+                    self._by_vehicle[vehicle_id] = holder
+                self._schedule(holder, now + self.hold_time)
+                continue
+            if self._conflicts_with_held(preemption):
+                continue
+            self._pending.remove(preemption)
+            self._grant(preemption, now)
+
+    def summary(self):
+        """Latency (request -> green) and hold time statistics of released preemptions."""
+        granted = [p for p in self.completed if p.green_at is not None]
+        latencies = [p.green_at - p.requested_at for p in granted]
+        holds = [p.released_at - p.green_at for p in granted if p.released_at is not None]
+        reasons = {}
+        for p in self.completed:
+            reasons[p.release_reason] = reasons.get(p.release_reason, 0) + 1
+
+        return {
+            "preemptions": len(self.completed),
+            "conflicts": self.conflicts,
+            "pending": len(self._pending),
+            "release_reasons": reasons,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_max": max(latencies) if latencies else None,
+            "hold_mean": sum(holds) / len(holds) if holds else None,
+            "hold_p95": percentile(holds, 95),
+            "hold_max": max(holds) if holds else None,
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        print(f"Preemptions: {stats['preemptions']} (conflicts: {stats['conflicts']}, "
+              f"still pending: {stats['pending']}, release reasons: {stats['release_reasons']})")
+        if stats["latency_mean"] is not None:
+            print(f"Detection -> green latency: mean {stats['latency_mean']:.2f}s, "
+                  f"p95 {stats['latency_p95']:.2f}s, max {stats['latency_max']:.2f}s")
+        if stats["hold_mean"] is not None:
+            print(f"Hold time: mean {stats['hold_mean']:.2f}s, p95 {stats['hold_p95']:.2f}s, "
+                  f"max {stats['hold_max']:.2f}s")
+
+
+class StandInTrafficLight:
+    """Minimal traffic light stand-in (id, set_state, freeze) for replays without CARLA."""
+
+    def __init__(self, light_id):
+        self.id = light_id
+        self.state = RED
+        self.frozen = False
+
+    def set_state(self, state):
+        self.state = state
+
+    def freeze(self, freeze):
+        self.frozen = freeze
+        if not freeze:
+            # a released light goes back to its cycle, which starts at red here
+            self.state = RED
+
+
+def replay(num_ambulances=1000, num_junctions=50, dt=0.05, seed=0, hold_time=15.0):
+    """Replay synthetic ambulances through 4-way junctions of stand-in lights.
+
+    Each ambulance appears 60 m before a random approach's stop line, waits at
+    the line while its light isn't green, and leaves the run 40 m past it.
+    """
+    rng = random.Random(seed)
+    directions = [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)]
+    junctions = []
+    light_ids = itertools.count(1)
+    for j in range(num_junctions):
+        center = (j * 500.0, 0.0)
+        approaches = []
+        for forward in directions:
+            stop = (center[0] - 10.0 * forward[0], center[1] - 10.0 * forward[1])
+            approaches.append((StandInTrafficLight(next(light_ids)), stop, forward))
+        junctions.append(approaches)
+
+    arrivals = sorted((rng.uniform(0.0, num_ambulances * 0.5), vehicle_id)
+                      for vehicle_id in range(num_ambulances))
+    scheduler = PreemptionScheduler(hold_time=hold_time, verbose=False)
+    vehicles = {}  # id -> [approach, distance travelled, speed]
+    arrival_iter = iter(arrivals)
+    next_arrival = next(arrival_iter, None)
+
+    now = 0.0
+    while next_arrival is not None or vehicles:
+        while next_arrival is not None and next_arrival[0] <= now:
+            approaches = rng.choice(junctions)
+            vehicles[next_arrival[1]] = [approaches, rng.randrange(4), 0.0, rng.uniform(8.0, 20.0)]
+            next_arrival = next(arrival_iter, None)
+
+        locations = {}
+        for vehicle_id, state in list(vehicles.items()):
+            approaches, a, travelled, speed = state
+            light, stop, forward = approaches[a]
+            cross = [other for k, (other, _, _) in enumerate(approaches) if k != a]
+            if travelled <= 60.0:
+                scheduler.request(vehicle_id, light, cross, stop, forward, now)
+            new_travelled = travelled + speed * dt
+            if new_travelled >= 60.0 > travelled - 1e-9 and light.state != GREEN:
+                new_travelled = min(new_travelled, 60.0)  # hold at the stop line
+            state[2] = new_travelled
+            if new_travelled > 100.0:
+                del vehicles[vehicle_id]
+                continue
+            offset = new_travelled - 60.0
+            locations[vehicle_id] = (stop[0] + offset * forward[0], stop[1] + offset * forward[1])
+
+        scheduler.update(now, locations)
+        now += dt
+
+    scheduler.release_all(now)
+    return scheduler
+
+
+if __name__ == "__main__":
+    result = replay()
+    result.print_summary()
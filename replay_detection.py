@@ -0,0 +1,167 @@
+"""Offline replay of recorded drives through the YOLO detection/logging pipeline.
+
+A recording is a directory with
+    frames/{frame}.png   camera frames (BGR, lossless)
+    telemetry.csv        frame, timestamp, speed_kmh, location_x/y/z, velocity_x/y/z
+made by drive_with_classification_model.py with DETECTION_RECORD_DIR set.
+
+Every (model, imgsz) combination is evaluated in one pass over the frames and
+written to its own detection CSV with the same 18 columns as the live run
+(DETECTION_COLUMNS). The detector runs on every frame, so box_source is
+always "detected" and track_id -1:
+
+    python replay_detection.py recordings/drive1 --models yolo12n.pt yolo12m.pt --imgsz 224 320 640
+"""
+import argparse
+import csv
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from detection_log import DETECTION_COLUMNS, detection_rows
+from image_writer import AsyncImageWriter, ImageFileSink
+
+TELEMETRY_COLUMNS = [
+    'frame_number', 'timestamp', 'speed_kmh', 'location_x', 'location_y', 'location_z',
+    'velocity_x', 'velocity_y', 'velocity_z'
+]
+
+
+class DriveRecorder:
+    """Records camera frames plus the vehicle telemetry they were taken with."""
+
+    def __init__(self, record_dir, num_workers=2):
+        os.makedirs(record_dir, exist_ok=True)
+        # png, and no rgb swap, so replayed frames are exactly the live camera frames
+        self.image_writer = AsyncImageWriter(ImageFileSink(os.path.join(record_dir, "frames"), ext=".png"),
+                                             num_workers=num_workers, ext=".png", to_rgb=False)
+        self._lock = threading.Lock()
+        self._file = open(os.path.join(record_dir, "telemetry.csv"), "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(TELEMETRY_COLUMNS)
+
+    def record(self, image, state):
+        """Record a carla.Image and its (speed_kmh, location, velocity) state."""
+        speed_kmh, location, velocity = state
+        self.image_writer.submit(image)
+        with self._lock:
+            self._writer.writerow([image.frame, image.timestamp, speed_kmh, *location, *velocity])
+
+    def close(self):
+        self.image_writer.close()
+        with self._lock:
+            self._file.close()
+
+
+def read_telemetry(record_dir):
+    """[(frame, timestamp, state)] in frame order."""
+    rows = []
+    with open(os.path.join(record_dir, "telemetry.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            state = (
+                float(row['speed_kmh']),
+                (float(row['location_x']), float(row['location_y']), float(row['location_z'])),
+                (float(row['velocity_x']), float(row['velocity_y']), float(row['velocity_z'])),
+            )
+            rows.append((int(row['frame_number']), float(row['timestamp']), state))
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def load_frame(record_dir, frame):
+    """Recorded frame converted the same way the live camera callback does it."""
+    image = cv2.imread(os.path.join(record_dir, "frames", f"{frame}.png"), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)  # in place, imread already gave us a fresh array
+
+
+def output_name(model_path, imgsz):
+    model_name = os.path.splitext(os.path.basename(model_path))[0]
+    return f"detection_data_{model_name}_{imgsz}.csv"
+
+
+def replay(record_dir, model_paths, imgsz_values, output_dir, batch_size=8, conf=0.5,
+           device=None, decode_workers=4, load_model=None):
+    """Run every (model, imgsz) over the recording once, returns {(model, imgsz): csv path}."""
+    if load_model is None:
+        from ultralytics import YOLO
+        load_model = YOLO
+    models = {path: load_model(path) for path in model_paths}
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    files = []
+    for path in model_paths:
+        for imgsz in imgsz_values:
+            csv_path = os.path.join(output_dir, output_name(path, imgsz))
+            f = open(csv_path, "w", newline="")
+            files.append(f)
+            writer = csv.writer(f)
+            writer.writerow(DETECTION_COLUMNS)
+            outputs[(path, imgsz)] = (csv_path, writer)
+
+    telemetry = read_telemetry(record_dir)
+    batches = [telemetry[i:i + batch_size] for i in range(0, len(telemetry), batch_size)]
+    kwargs = {"conf": conf, "verbose": False}
+    if device is not None:
+        kwargs["device"] = device
+
+    start = time.perf_counter()
+    frames_done = 0
+    missing = 0
+    try:
+        with ThreadPoolExecutor(decode_workers) as pool:
+            def decode(batch):
+                return [pool.submit(load_frame, record_dir, row[0]) for row in batch]
+
+            # decode the next batch while the models run on the current one
+            pending = decode(batches[0]) if batches else None
+            for i, batch in enumerate(batches):
+                images = [future.result() for future in pending]
+                pending = decode(batches[i + 1]) if i + 1 < len(batches) else None
+
+                kept = [(row, image) for row, image in zip(batch, images) if image is not None]
+                missing += len(batch) - len(kept)
+                if not kept:
+                    continue
+                images = [image for _, image in kept]
+
+                for (path, imgsz), (_, writer) in outputs.items():
+                    results = models[path](images, imgsz=imgsz, **kwargs)
+                    for ((frame, timestamp, state), _), result in zip(kept, results):
+                        writer.writerows(detection_rows(result, frame, timestamp, state, imgsz))
+                frames_done += len(kept)
+    finally:
+        for f in files:
+            f.close()
+
+    elapsed = time.perf_counter() - start
+    rate = frames_done / elapsed if elapsed > 0 else 0.0
+    print(f"Replayed {frames_done} frames x {len(outputs)} model/imgsz combinations in {elapsed:.1f}s "
+          f"({rate:.1f} frames/s, {missing} frames missing)")
+    return {key: csv_path for key, (csv_path, _) in outputs.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded drive through YOLO detection offline")
+    parser.add_argument("record_dir", help="recording made with DETECTION_RECORD_DIR")
+    parser.add_argument("--models", nargs="+", default=["yolo12m.pt"])
+    parser.add_argument("--imgsz", nargs="+", type=int, default=[320])
+    parser.add_argument("--output-dir", default="replay_results")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--device", default=None, help="e.g. cpu or 0")
+    args = parser.parse_args()
+
+    outputs = replay(args.record_dir, args.models, args.imgsz, args.output_dir,
+                     batch_size=args.batch_size, conf=args.conf, device=args.device)
+    for (model_path, imgsz), csv_path in outputs.items():
+        print(f"{model_path} @ {imgsz}: {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Per-map spawn point, route planner and route cache for BehaviorAgent drives.
+
+get_map() and get_spawn_points() are RPCs that copy the whole map and every
+set_destination() replans through a fresh global route planner. A MapCache
+fetches the map, its spawn points and one GlobalRoutePlanner once per map
+(shared across runs in the same process, e.g. a scenario_farm worker) and
+memoizes routes between spawn point pairs with LRU eviction. Destinations
+come from a farthest-point rotation over the spawn points, so consecutive
+drives spread over the whole map instead of clustering.
+
+    cache = map_cache(world)
+    agent = BehaviorAgent(vehicle, behavior="normal", map_inst=cache.map, grp_inst=cache.planner)
+    cache.set_route(agent, start_index, end_index)
+"""
+import collections
+import random
+import time
+
+import numpy as np
+
+DEFAULT_SAMPLING_RESOLUTION = 2.0
+DEFAULT_MAX_ROUTES = 512
+
+_caches_by_episode = {}
+_caches_by_map = {}
+
+
+def farthest_point_order(points, first=0):
+    """Indices of points, each next one the farthest from all picked so far."""
+    points = np.asarray(points, dtype=np.float64)
+    count = len(points)
+    order = np.empty(count, dtype=np.int64)
+    distance = np.full(count, np.inf)
+    current = first
+    for i in range(count):
+        order[i] = current
+        distance = np.minimum(distance, ((points - points[current]) ** 2).sum(axis=1))
+        distance[current] = -1.0  # never pick it again
+        current = int(np.argmax(distance))
+    return order
+
+
+class MapCache:
+    """Spawn points, route planner and an LRU route memo for one map."""
+
+    def __init__(self, carla_map, sampling_resolution=DEFAULT_SAMPLING_RESOLUTION, max_routes=DEFAULT_MAX_ROUTES):
+        self.map = carla_map
+        self.name = carla_map.name
+        self.sampling_resolution = sampling_resolution
+        self.max_routes = max_routes
+        self.spawn_points = carla_map.get_spawn_points()
+        self.locations = np.array([(sp.location.x, sp.location.y, sp.location.z) for sp in self.spawn_points])
+        self._planner = None
+        self._routes = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.planning_time = 0.0
+
+    @property
+    def planner(self):
+        """The map's GlobalRoutePlanner, built (topology + graph) on first use."""
+        if self._planner is None:
+            from agents.navigation.global_route_planner import GlobalRoutePlanner
+            start = time.perf_counter()
+            self._planner = GlobalRoutePlanner(self.map, self.sampling_resolution)
+            self.planning_time += time.perf_counter() - start
+        return self._planner
+
+    def route(self, start_index, end_index):
+        """[(waypoint, RoadOption)] from one spawn point to another, memoized."""
+        key = (start_index, end_index)
+        route = self._routes.get(key)
+        if route is not None:
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return route
+
+        self.misses += 1
+        start = time.perf_counter()
+        route = self.planner.trace_route(self.spawn_points[start_index].location,
+                                         self.spawn_points[end_index].location)
+        self.planning_time += time.perf_counter() - start
+        self._routes[key] = route
+        if len(self._routes) > self.max_routes:
+            self._routes.popitem(last=False)
+            self.evictions += 1
+        return route
+
+    def set_route(self, agent, start_index, end_index):
+        """Give the agent the cached route instead of letting set_destination() replan it."""
+        agent.set_global_plan(self.route(start_index, end_index), stop_waypoint_creation=True, clean_queue=True)
+        return self.spawn_points[end_index].location
+
+    def destination_rotation(self, first=None, rng=random):
+        """Endless iterator of spawn point indices that covers the map evenly, farthest point first."""
+        if first is None:
+            first = rng.randrange(len(self.spawn_points))
+        order = farthest_point_order(self.locations[:, :2], first)
+        while True:
+            yield from order.tolist()
+
+    def clear_spawn_point(self, world, radius=5.0, rng=random, exclude=(), occupied=None):
+        """(index, transform) of a random spawn point with no vehicle within radius, None if all are taken.
+
+        exclude lists spawn point indices already handed out but not occupied yet. occupied is an (N, 2)
+        array of vehicle xy positions, e.g. from this tick's snapshot_arrays (NaN rows are skipped);
+        without it every vehicle's location is queried from the server.
+        """
+        candidates = np.setdiff1d(np.arange(len(self.spawn_points)), np.asarray(exclude, dtype=np.int64))
+        if occupied is None:
+            vehicles = world.get_actors().filter('vehicle.*')
+            occupied = np.array([(location.x, location.y) for location in (v.get_location() for v in vehicles)])
+        else:
+            occupied = np.asarray(occupied, dtype=np.float64).reshape(-1, 2)
+            occupied = occupied[~np.isnan(occupied).any(axis=1)]
+        if len(occupied):
+            gaps = ((self.locations[:, None, :2] - occupied[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+            candidates = candidates[gaps[candidates] > radius * radius]
+        if len(candidates) == 0:
+            return None
+        index = int(candidates[rng.randrange(len(candidates))])
+        return index, self.spawn_points[index]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "map": self.name,
+            "spawn_points": len(self.spawn_points),
+            "routes_cached": len(self._routes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "planning_s": self.planning_time,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats["hit_rate"] is not None else "n/a"
+        print(f"Route cache {stats['map']}: {stats['hits']} hits, {stats['misses']} misses ({hit_rate}), "
+              f"{stats['evictions']} evictions, {stats['routes_cached']} routes kept, "
+              f"{stats['planning_s']:.2f}s planning")
+
+
+def map_cache(world, sampling_resolution=DEFAULT_SAMPLING_RESOLUTION, max_routes=DEFAULT_MAX_ROUTES):
+    """The MapCache of the world's map, only calls get_map() the first time an episode is seen."""
+    cache = _caches_by_episode.get(world.id)
+    if cache is None:
+        carla_map = world.get_map()
+        key = (carla_map.name, sampling_resolution)
+        cache = _caches_by_map.get(key)
+        if cache is None:
+            cache = _caches_by_map[key] = MapCache(carla_map, sampling_resolution, max_routes)
+        _caches_by_episode[world.id] = cache
+    return cache
@@ -0,0 +1,377 @@
+"""Live runtime metrics for long unattended simulation and capture runs.
+
+Counters, gauges and histograms live in one process-wide Registry (REGISTRY).
+Updating one is an add (plus a bisect for histograms) under the metric's own
+lock, well under a microsecond, so the tick loop, sensor callbacks and
+controllers update them directly: a tick's worth of instrumentation stays in
+the tens of microseconds against a 50 ms tick (benchmarks.py --stages
+runtime_metrics measures it). Gauges can instead be given a function that is
+only called when the metrics are read, e.g. a queue depth.
+
+Two ways out, both reading the same registry:
+
+    MetricsServer      http://127.0.0.1:{port}/metrics       Prometheus text format
+                       http://127.0.0.1:{port}/metrics.json  the same as JSON
+    SnapshotWriter     rewrites a JSON file every interval seconds, for runs nobody scrapes
+
+    METRICS_PORT=9100 python ambulance_collect_data2.py
+    curl -s localhost:9100/metrics | grep tick_seconds
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from a fast callback to a stalled tick
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+# frames a sensor callback runs behind the latest tick
+FRAME_LAG_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, e.g. frames written."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Current value, set by the caller or read from fn when the metrics are collected."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels, fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def read(self):
+        if self.fn is None:
+            return self.value
+        try:
+            value = self.fn()
+        except Exception:
+            return float("nan")  # whatever fn reads from may already be closed
+        return float("nan") if value is None else value
+
+    def samples(self):
+        return [(self.name, self.labels, self.read())]
+
+    def snapshot(self):
+        value = self.read()
+        return None if value != value else value  # NaN isn't JSON
+
+
+class Histogram:
+    """Bucketed observations (durations, lags) with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the wall time of its block."""
+        return _Timer(self)
+
+    def _state(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def samples(self):
+        counts, total, count = self._state()
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            samples.append((self.name + "_bucket", dict(self.labels, le=_format_value(bound)), cumulative))
+        samples.append((self.name + "_sum", self.labels, total))
+        samples.append((self.name + "_count", self.labels, count))
+        return samples
+
+    def quantile(self, q, counts=None, count=None):
+        """Upper bound of the bucket holding the q quantile, None without observations."""
+        if counts is None:
+            counts, _, count = self._state()
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        counts, total, count = self._state()
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else None,
+            "p50": self.quantile(0.5, counts, count),
+            "p95": self.quantile(0.95, counts, count),
+            "p99": self.quantile(0.99, counts, count),
+        }
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """Every metric of the process, one per (name, labels). Asking again returns the same metric."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = {key: str(value) for key, value in (labels or {}).items()}
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help="", labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=None, fn=None):
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn  # the newest owner (e.g. the current pipeline) reports
+        return gauge
+
+    def histogram(self, name, help="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """Prometheus text exposition format."""
+        families = {}
+        for metric in self.metrics():
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name in sorted(families):
+            first = families[name][0]
+            if first.help:
+                lines.append(f"# HELP {name} {first.help}")
+            lines.append(f"# TYPE {name} {first.kind}")
+            for metric in families[name]:
+                for sample_name, labels, value in metric.samples():
+                    lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """{name: value} with labelled series keyed "name{label=value}", histograms as count/sum/mean/quantiles."""
+        metrics = {}
+        for metric in self.metrics():
+            metrics[metric.name + _format_labels(metric.labels).replace('"', "")] = metric.snapshot()
+        now = time.time()
+        return {"time": now, "uptime_s": now - self.started, "pid": os.getpid(),
+                "metrics": dict(sorted(metrics.items()))}
+
+
+REGISTRY = Registry()
+
+
+def tick_metrics(registry=REGISTRY):
+    """(world_tick_seconds, tick_seconds, ticks_total), shared by TickRunner and the scripts' own tick loops."""
+    return (registry.histogram("world_tick_seconds", "Wall time of world.tick(), mostly waiting on the server"),
+            registry.histogram("tick_seconds", "Wall time of one simulation step, world.tick() plus the per-tick work"),
+            registry.counter("ticks_total", "Simulation steps run"))
+
+
+def controller_seconds(name, registry=REGISTRY):
+    return registry.histogram("controller_seconds", "Wall time of one call of a per-tick controller",
+                              {"controller": name})
+
+
+def callback_metrics(name, registry=REGISTRY):
+    """(callback_seconds, sensor_frame_lag) of one sensor callback."""
+    return (registry.histogram("callback_seconds", "Wall time spent inside a sensor callback", {"callback": name}),
+            registry.histogram("sensor_frame_lag", "Ticks between world.tick() and the sensor callback for its frame",
+                               {"callback": name}, buckets=FRAME_LAG_BUCKETS))
+
+
+class MetricsServer:
+    """Serves a registry over HTTP on a daemon thread, /metrics (Prometheus) and /metrics.json."""
+
+    def __init__(self, port=9100, host="127.0.0.1", registry=REGISTRY):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] == "/metrics":
+                    body = registry.render().encode()
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif handler.path.split("?")[0] == "/metrics.json":
+                    body = json.dumps(registry.snapshot(), default=str).encode()
+                    content_type = "application/json"
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header("Content-Type", content_type)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass  # no line per scrape
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SnapshotWriter:
+    """Rewrites a JSON snapshot of a registry every interval seconds (and once more on close)."""
+
+    def __init__(self, path, interval=10.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.writes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.registry.snapshot(), f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+        self.writes += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Metrics snapshot {self.path} failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+def start_exporter(snapshot_path=None, port=None, interval=None, registry=REGISTRY):
+    """Exporter configured by METRICS_PORT (default 9100, 0 turns the endpoint off) and METRICS_INTERVAL."""
+    if port is None:
+        port = int(os.environ.get("METRICS_PORT", "9100"))
+    if interval is None:
+        interval = float(os.environ.get("METRICS_INTERVAL", "10"))
+    return Exporter(port, snapshot_path, interval, registry)
+
+
+class Exporter:
+    """The HTTP endpoint and/or snapshot file of one run, close() stops both."""
+
+    def __init__(self, port=None, snapshot_path=None, interval=10.0, registry=REGISTRY):
+        self.server = None
+        self.snapshots = None
+        if port:
+            try:
+                self.server = MetricsServer(port, registry=registry)
+                print(f"Metrics on http://127.0.0.1:{self.server.port}/metrics")
+            except OSError as e:
+                # e.g. a second run on the same machine, the snapshot file still works
+                print(f"Metrics endpoint not started on port {port}: {e}")
+        if snapshot_path:
+            self.snapshots = SnapshotWriter(snapshot_path, interval, registry)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        if self.snapshots is not None:
+            self.snapshots.close()
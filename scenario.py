@@ -0,0 +1,222 @@
+"""Reproducible runs: one seed for everything, CARLA recorder, and sensor re-rendering.
+
+A Scenario seeds Python's random, NumPy, the traffic manager and the
+pedestrian navigation from one seed (a fresh one is picked and saved when
+none is given) and, with record=True, runs CARLA's recorder next to our own
+per-tick logs. Recording is opt-in since the file grows with the run.
+scenario.json holds what's needed to redo or replay the run:
+
+    {"name", "seed", "town", "weather", "fixed_delta_seconds", "recorder_file",
+     "start_frame", "end_frame", "logs": {...}, "params": {...}}
+
+The recorder file lives on the CARLA server (CARLA writes it there). replay()
+plays it back in synchronous mode, as fast as the server can tick, with a new
+sensor rig on the recorded ego vehicle. Frames are saved under the original
+frame numbers, so new camera variants line up with the recorded controls
+without driving the route again:
+
+    python scenario.py replay D:/dataset/scenario.json --rig 224,640 --output D:/dataset/rerender
+    python scenario.py info D:/dataset/scenario.json
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+MANIFEST_FILE = "scenario.json"
+EGO_ROLE_NAME = "ambulance"
+
+
+def new_seed():
+    return int.from_bytes(os.urandom(4), "little") & 0x7fffffff
+
+
+def write_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+    with open(path) as f:
+        return json.load(f)
+
+
+class Scenario:
+    """Seeds a run and records it with CARLA's recorder plus a scenario.json manifest."""
+
+    def __init__(self, client, output_dir, seed=None, name="scenario", record=False, params=None):
+        self.client = client
+        self.output_dir = output_dir
+        self.seed = new_seed() if seed is None else seed
+        self.name = name
+        self.record = record
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        self.manifest = {
+            "name": name,
+            "seed": self.seed,
+            "recorder_file": f"{name}_{self.seed}_{time.strftime('%Y%m%d_%H%M%S')}.log" if record else None,
+            "logs": {},
+            "params": dict(params or {}),
+        }
+        self._recording = False
+
+    def seed_everything(self, world, traffic_manager=None):
+        """Seed every RNG that decides spawns, routes and NPC behaviour. Call before spawning."""
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        world.set_pedestrians_seed(self.seed)
+        if traffic_manager is not None:
+            traffic_manager.set_random_device_seed(self.seed)
+        return self.seed
+
+    def add_log(self, name, path):
+        """Note one of our own logs (controls, telemetry, ...) in the manifest."""
+        self.manifest["logs"][name] = os.path.relpath(path, self.output_dir)
+
+    def start(self, world, weather=None):
+        """Start the recorder, the frame after this call is the first recorded one."""
+        settings = world.get_settings()
+        snapshot = world.get_snapshot()
+        self.manifest.update({
+            "town": world.get_map().name.split("/")[-1],
+            "weather": weather,
+            "fixed_delta_seconds": settings.fixed_delta_seconds,
+            "synchronous_mode": settings.synchronous_mode,
+            "start_frame": snapshot.frame,
+            "started": time.time(),
+        })
+        if self.record:
+            # additional_data also records bounding boxes, lights and controls of every actor
+            self.client.start_recorder(self.manifest["recorder_file"], True)
+            self._recording = True
+        os.makedirs(self.output_dir, exist_ok=True)
+        write_manifest(self.manifest_path, self.manifest)
+        print(f"Scenario {self.name}: seed {self.seed}, recording to {self.manifest['recorder_file']}")
+
+    def stop(self, world=None):
+        """Stop the recorder and finish the manifest, safe to call twice."""
+        if self._recording:
+            self.client.stop_recorder()
+            self._recording = False
+        if world is not None:
+            self.manifest["end_frame"] = world.get_snapshot().frame
+        self.manifest["finished"] = time.time()
+        write_manifest(self.manifest_path, self.manifest)
+
+
+def find_ego(world, role_name=EGO_ROLE_NAME):
+    for actor in world.get_actors().filter("vehicle.*"):
+        if actor.attributes.get("role_name") == role_name:
+            return actor
+    return None
+
+
+def replay(client, manifest_path, specs, output_dir, time_factor=1.0, ext=".jpg", role_name=EGO_ROLE_NAME,
+           num_workers=4):
+    """Re-render a recorded run with new cameras, returns {camera name: frames written}.
+
+    With time_factor 1.0 every recorded tick is rendered once, larger factors skip
+    recorded ticks (a tick then covers time_factor recorded ticks).
+    """
+    import carla
+    from image_writer import AsyncImageWriter, ImageFileSink
+    from sensor_rig import SensorRig
+    from tick_runner import TickRunner
+
+    if os.path.isdir(manifest_path):
+        manifest_path = os.path.join(manifest_path, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    if not manifest.get("recorder_file"):
+        raise ValueError(f"{manifest_path} was not recorded")
+    world = client.get_world()
+    if manifest.get("town") and not world.get_map().name.endswith(manifest["town"]):
+        world = client.load_world(manifest["town"])
+    if manifest.get("weather"):
+        world.set_weather(getattr(carla.WeatherParameters, manifest["weather"]))
+
+    start_frame = manifest["start_frame"]
+    recorded_ticks = manifest["end_frame"] - start_frame
+    num_ticks = int(np.ceil(recorded_ticks / time_factor))
+
+    writers = {}
+    rig = None
+    with TickRunner(world, manifest["fixed_delta_seconds"], realtime=False) as runner:
+        client.set_replayer_time_factor(time_factor)
+        client.replay_file(manifest["recorder_file"], 0.0, 0.0, 0, False)
+        replay_start = world.tick()
+        ego = find_ego(world, role_name)
+        if ego is None:
+            client.stop_replayer(False)
+            raise RuntimeError(f"No vehicle with role_name {role_name!r} in {manifest['recorder_file']}")
+
+        try:
+            rig = SensorRig(world, ego, specs)
+            for spec in specs:
+                writers[spec.name] = AsyncImageWriter(ImageFileSink(os.path.join(output_dir, spec.name), ext=ext),
+                                                      num_workers=num_workers, ext=ext)
+
+            def save(spec, image):
+                # replay tick n shows recorded tick start_frame + n * time_factor
+                original = start_frame + int(round((image.frame - replay_start) * time_factor))
+                writers[spec.name].submit(image, frame=original)
+
+            rig.listen(save)
+            runner.run(num_ticks)
+        finally:
+            if rig is not None:
+                rig.destroy()
+            for writer in writers.values():
+                writer.close()
+            client.stop_replayer(False)
+
+    runner.print_stats()
+    rig.print_summary()
+    written = {name: writer.written for name, writer in writers.items()}
+    manifest.setdefault("replays", []).append({
+        "output_dir": os.path.abspath(output_dir), "time_factor": time_factor,
+        "cameras": {spec.name: spec.resolution for spec in specs}, "frames": written, "created": time.time(),
+    })
+    write_manifest(manifest_path, manifest)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or re-render recorded scenarios")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info = subparsers.add_parser("info", help="print a scenario's manifest and the recorder summary")
+    info.add_argument("manifest")
+    rerender = subparsers.add_parser("replay", help="re-render a recorded run with new cameras")
+    rerender.add_argument("manifest")
+    rerender.add_argument("--rig", default="224", help="cameras, see sensor_rig.py")
+    rerender.add_argument("--output", required=True)
+    rerender.add_argument("--time-factor", type=float, default=1.0)
+    rerender.add_argument("--ext", default=".jpg")
+    for subparser in (info, rerender):
+        subparser.add_argument("--host", default="localhost")
+        subparser.add_argument("--port", type=int, default=2000)
+    args = parser.parse_args()
+
+    import carla
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(30.0)
+    if args.command == "info":
+        manifest = load_manifest(args.manifest)
+        print(json.dumps(manifest, indent=2))
+        if manifest.get("recorder_file"):
+            print(client.show_recorder_file_info(manifest["recorder_file"], False))
+    else:
+        from sensor_rig import parse_rig
+        written = replay(client, args.manifest, parse_rig(args.rig), args.output, args.time_factor, args.ext)
+        for name, frames in written.items():
+            print(f"{name}: {frames} frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Parallel data collection across several CARLA servers.
+
+A scenario matrix (map x seed x traffic density x weather x camera
+resolution) is expanded into jobs and dispatched to one worker process per
+server endpoint, each with its own traffic manager port. Every job writes
+into its own shard directory under the output directory. Failed jobs are
+retried, preferably on a different server, and a server that keeps failing
+is retired so its jobs are reassigned to the others. The per-job manifests
+are merged into output_dir/manifest.json at the end.
+
+    python scenario_farm.py --servers localhost:2000 localhost:2002 --maps Town03 Town05 \\
+        --seeds 0 1 --traffic 0 30 --weathers ClearNoon WetCloudyNoon --frames 5000 --output D:/farm
+
+run_job and use_processes=False let the orchestration run in-process against
+a fake job function, without any CARLA server (test_scenario_farm.py).
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+
+MANIFEST_FILE = "manifest.json"
+
+
+def scenario_matrix(maps, seeds, traffic_densities=(0,), weathers=(None,), resolutions=(224,), frames=5000):
+    """Every combination of the scenario parameters as a list of job dicts."""
+    jobs = []
+    combinations = itertools.product(maps, seeds, traffic_densities, weathers, resolutions)
+    for i, (town, seed, traffic, weather, resolution) in enumerate(combinations):
+        jobs.append({
+            "job_id": f"job-{i:04d}",
+            "town": town,
+            "seed": seed,
+            "traffic_vehicles": traffic,
+            "weather": weather,
+            "image_size": resolution,
+            "frames": frames,
+        })
+    return jobs
+
+
+def parse_endpoint(endpoint):
+    """"host:port" or "port" -> (host, port)."""
+    if isinstance(endpoint, (tuple, list)):
+        return endpoint[0], int(endpoint[1])
+    host, _, port = str(endpoint).rpartition(":")
+    return host or "localhost", int(port)
+
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_collection_job(endpoint, tm_port, job, output_path):
+    """Run ambulance_collect_data2.main() for one job, returns its writer summary."""
+    import ambulance_collect_data2
+    host, port = endpoint
+    # workers would fight over one metrics port, every job still writes metrics.json into its shard
+    return ambulance_collect_data2.main(
+        host=host, port=port, tm_port=tm_port, output_path=output_path, frames=job["frames"],
+        town=job["town"], weather=job["weather"], image_size=job["image_size"],
+        traffic_vehicles=job["traffic_vehicles"], seed=job["seed"], metrics_port=0)
+
+
+def _worker(worker_id, endpoint, tm_port, inbox, results, output_dir, run_job):
+    """Runs jobs from its inbox until it gets None."""
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+        shard_dir = os.path.join(output_dir, job["job_id"])
+        result = {"job_id": job["job_id"], "worker": worker_id, "endpoint": f"{endpoint[0]}:{endpoint[1]}",
+                  "shard": os.path.relpath(shard_dir, output_dir), "started": time.time()}
+        try:
+            # a retry starts from an empty shard, not on top of what the failed attempt left
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            os.makedirs(shard_dir)
+            result["summary"] = run_job(endpoint, tm_port, job, shard_dir)
+            result["status"] = "ok"
+        except BaseException as e:
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+            result["traceback"] = traceback.format_exc()
+        result["elapsed_s"] = time.time() - result["started"]
+        if result["status"] == "ok":
+            write_json(os.path.join(shard_dir, MANIFEST_FILE), dict(job, **result))
+        results.put(result)
+
+
+class ScenarioFarm:
+    """Dispatches scenario jobs to one worker per server and merges the results."""
+
+    def __init__(self, endpoints, jobs, output_dir, run_job=run_collection_job, max_attempts=3,
+                 max_server_failures=2, tm_port_base=8000, use_processes=True):
+        self.endpoints = [parse_endpoint(endpoint) for endpoint in endpoints]
+        self.jobs = {job["job_id"]: dict(job) for job in jobs}
+        self.output_dir = output_dir
+        self.run_job = run_job
+        self.max_attempts = max_attempts
+        self.max_server_failures = max_server_failures
+        self.tm_port_base = tm_port_base
+        self.use_processes = use_processes
+
+        self.attempts = {job_id: [] for job_id in self.jobs}
+        self.completed = {}
+        self.failed = {}
+
+    def _start_workers(self):
+        if self.use_processes:
+            context = multiprocessing.get_context("spawn")
+            make_queue, make_worker = context.Queue, context.Process
+        else:
+            make_queue, make_worker = queue.Queue, threading.Thread
+        results = make_queue()
+        workers = {}
+        for worker_id, endpoint in enumerate(self.endpoints):
+            inbox = make_queue()
+            # every server gets its own traffic manager port so workers on one host don't collide
+            tm_port = self.tm_port_base + worker_id
+            worker = make_worker(target=_worker, daemon=True,
+                                 args=(worker_id, endpoint, tm_port, inbox, results, self.output_dir, self.run_job))
+            worker.start()
+            workers[worker_id] = {"worker": worker, "inbox": inbox, "job": None, "failures": 0, "alive": True}
+        return workers, results
+
+    def _next_job_for(self, pending, worker_id):
+        """First pending job that hasn't already failed on this worker, else the first pending job."""
+        for job_id in pending:
+            if all(attempt["worker"] != worker_id for attempt in self.attempts[job_id]):
+                return job_id
+        return pending[0] if pending else None
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        start = time.time()
+        pending = list(self.jobs)
+        workers, results = self._start_workers()
+
+        try:
+            while pending or any(state["job"] for state in workers.values()):
+                live = [worker_id for worker_id, state in workers.items() if state["alive"]]
+                if not live:
+                    print("No servers left, giving up on the remaining jobs.")
+                    for job_id in pending:
+                        self.failed[job_id] = self.attempts[job_id]
+                    break
+
+                for worker_id in live:
+                    state = workers[worker_id]
+                    if state["job"] is None and pending:
+                        job_id = self._next_job_for(pending, worker_id)
+                        pending.remove(job_id)
+                        state["job"] = job_id
+                        state["inbox"].put(self.jobs[job_id])
+
+                try:
+                    result = results.get(timeout=1.0)
+                except queue.Empty:
+                    # a worker process that died without reporting counts as a failed attempt
+                    for worker_id, state in workers.items():
+                        if state["alive"] and state["job"] and not state["worker"].is_alive():
+                            self._handle({"job_id": state["job"], "worker": worker_id, "status": "failed",
+                                          "error": "worker exited", "endpoint": None}, workers, pending)
+                    continue
+                self._handle(result, workers, pending)
+        finally:
+            for state in workers.values():
+                if state["alive"]:
+                    state["inbox"].put(None)
+            for state in workers.values():
+                state["worker"].join(timeout=5.0)
+
+        manifest = self.merge_manifests(time.time() - start)
+        print(f"Farm finished: {len(self.completed)} jobs ok, {len(self.failed)} failed "
+              f"in {manifest['elapsed_s']:.1f}s on {len(self.endpoints)} servers.")
+        return manifest
+
+    def _handle(self, result, workers, pending):
+        job_id = result["job_id"]
+        state = workers[result["worker"]]
+        state["job"] = None
+        self.attempts[job_id].append(result)
+
+        if result["status"] == "ok":
+            state["failures"] = 0
+            self.completed[job_id] = result
+            return
+
+        state["failures"] += 1
+        print(f"{job_id} failed on {result['endpoint']}: {result['error']}")
+        if state["failures"] >= self.max_server_failures or not state["worker"].is_alive():
+            print(f"Retiring worker {result['worker']} after {state['failures']} consecutive failures.")
+            state["alive"] = False
+            if state["worker"].is_alive():
+                state["inbox"].put(None)
+
+        if len(self.attempts[job_id]) < self.max_attempts:
+            pending.insert(0, job_id)  # retry before starting new work
+        else:
+            self.failed[job_id] = self.attempts[job_id]
+
+    def merge_manifests(self, elapsed):
+        """Combine the per-shard manifests into one manifest for the whole run."""
+        jobs = []
+        for job_id, job in self.jobs.items():
+            attempts = self.attempts[job_id]
+            entry = dict(job, attempts=len(attempts), status="pending")
+            if job_id in self.completed:
+                shard_manifest = os.path.join(self.output_dir, self.completed[job_id]["shard"], MANIFEST_FILE)
+                with open(shard_manifest) as f:
+                    entry.update(json.load(f))
+                entry["attempts"] = len(attempts)
+            elif job_id in self.failed:
+                entry["status"] = "failed"
+                entry["errors"] = [attempt["error"] for attempt in attempts]
+            jobs.append(entry)
+
+        manifest = {
+            "created": time.time(),
+            "elapsed_s": elapsed,
+            "endpoints": [f"{host}:{port}" for host, port in self.endpoints],
+            "completed": len(self.completed),
+            "failed": len(self.failed),
+            "jobs": jobs,
+        }
+        write_json(os.path.join(self.output_dir, MANIFEST_FILE), manifest)
+        return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect ambulance driving data on several CARLA servers")
+    parser.add_argument("--servers", nargs="+", required=True, help="host:port of each CARLA server")
+    parser.add_argument("--maps", nargs="+", required=True)
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--traffic", nargs="+", type=int, default=[0], help="background vehicles per job")
+    parser.add_argument("--weathers", nargs="+", default=[None], help="carla.WeatherParameters presets")
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[224])
+    parser.add_argument("--frames", type=int, default=5000, help="frames per job")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--tm-port-base", type=int, default=8000)
+    args = parser.parse_args()
+
+    jobs = scenario_matrix(args.maps, args.seeds, args.traffic, args.weathers, args.resolutions, args.frames)
+    print(f"{len(jobs)} jobs on {len(args.servers)} servers")
+    farm = ScenarioFarm(args.servers, jobs, args.output, max_attempts=args.max_attempts,
+                        tm_port_base=args.tm_port_base)
+    farm.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Several RGB cameras on one vehicle, ticking together.
+
+Every camera of the rig is attached to the same vehicle. In synchronous mode
+all of them render on the same world.tick(), so their frames share frame
+ids and a resolution comparison sees exactly the same scene. Frames from all
+cameras go to a single callback, normally InferencePipeline.submit() with
+the camera name as the source.
+
+A rig is written as comma separated cameras, RESOLUTION[@x:y:z[:yaw[:pitch]]]:
+
+    320                     one 320x320 camera at the default bonnet pose
+    224,320,640             three cameras, same pose, one per resolution
+    320,320@-2.0:0:2.0:180  front and rear camera
+"""
+import threading
+import time
+
+import carla
+
+DEFAULT_POSE = (1.5, 0.0, 2.0, 0.0, 0.0)  # x, y, z, yaw, pitch
+
+
+class CameraSpec:
+    """One camera of the rig."""
+
+    def __init__(self, name, resolution, pose=DEFAULT_POSE, fov=90):
+        self.name = name
+        self.resolution = resolution
+        self.pose = pose
+        self.fov = fov
+
+    def transform(self):
+        x, y, z, yaw, pitch = self.pose
+        return carla.Transform(carla.Location(x=x, y=y, z=z), carla.Rotation(pitch=pitch, yaw=yaw))
+
+
+def parse_rig(text):
+    """[CameraSpec] from a rig string, see the module docstring."""
+    specs = []
+    for entry in text.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        resolution, _, pose_text = entry.partition("@")
+        pose = list(DEFAULT_POSE)
+        if pose_text:
+            values = [float(value) for value in pose_text.split(":")]
+            pose[:len(values)] = values
+        name = f"camera_{resolution}"
+        if any(spec.name == name for spec in specs):
+            name = f"{name}_{len(specs)}"
+        specs.append(CameraSpec(name, int(resolution), tuple(pose)))
+    if not specs:
+        raise ValueError(f"No cameras in sensor rig {text!r}")
+    return specs
+
+
+class SensorStats:
+    """Frame counts and rates for one camera."""
+
+    def __init__(self):
+        self.frames = 0
+        self.first_wall = None
+        self.last_wall = None
+        self.first_sim = None
+        self.last_sim = None
+        self.last_frame = None
+        self.skipped_frames = 0
+
+    def add(self, image, now):
+        if self.first_wall is None:
+            self.first_wall, self.first_sim = now, image.timestamp
+        elif image.frame > self.last_frame + 1:
+            self.skipped_frames += image.frame - self.last_frame - 1
+        self.last_wall, self.last_sim, self.last_frame = now, image.timestamp, image.frame
+        self.frames += 1
+
+    def summary(self):
+        wall = (self.last_wall - self.first_wall) if self.frames > 1 else 0.0
+        sim = (self.last_sim - self.first_sim) if self.frames > 1 else 0.0
+        return {
+            "frames": self.frames,
+            "wall_fps": (self.frames - 1) / wall if wall > 0 else None,
+            "sim_fps": (self.frames - 1) / sim if sim > 0 else None,
+            "missed_ticks": self.skipped_frames,
+        }
+
+
+class SensorRig:
+    """Spawns the cameras of a rig and routes all their frames to one callback."""
+
+    def __init__(self, world, vehicle, specs, spawn_manager=None, pending_ticks=100):
+        self.world = world
+        self.vehicle = vehicle
+        self.specs = {spec.name: spec for spec in specs}
+        self.spawn_manager = spawn_manager
+        self.pending_ticks = pending_ticks
+        self.cameras = {}
+        self.stats = {spec.name: SensorStats() for spec in specs}
+
+        # frame id -> cameras delivered so far, to check the rig really ticks together
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.complete_ticks = 0
+        self.incomplete_ticks = 0
+
+        blueprint_library = world.get_blueprint_library()
+        for spec in specs:
+            camera_bp = blueprint_library.find('sensor.camera.rgb')
+            camera_bp.set_attribute('image_size_x', str(spec.resolution))
+            camera_bp.set_attribute('image_size_y', str(spec.resolution))
+            camera_bp.set_attribute('fov', str(spec.fov))
+            camera_bp.set_attribute('role_name', spec.name)
+            camera = world.spawn_actor(camera_bp, spec.transform(), attach_to=vehicle,
+                                       attachment_type=carla.AttachmentType.Rigid)
+            if spawn_manager is not None:
+                spawn_manager.register(camera)
+            self.cameras[spec.name] = camera
+
+    @property
+    def primary(self):
+        """The highest resolution camera, e.g. the one worth recording for replay."""
+        return max(self.specs.values(), key=lambda spec: spec.resolution)
+
+    def imgsz_by_source(self):
+        return {name: spec.resolution for name, spec in self.specs.items()}
+
+    def listen(self, on_image):
+        """Call on_image(spec, image) for every frame of every camera, on CARLA's sensor threads."""
+        for name, camera in self.cameras.items():
+            camera.listen(lambda image, spec=self.specs[name]: self._on_image(spec, image, on_image))
+
+    def _on_image(self, spec, image, on_image):
+        now = time.perf_counter()
+        with self._lock:
+            self.stats[spec.name].add(image, now)
+            delivered = self._pending.get(image.frame, 0) + 1
+            if delivered == len(self.specs):
+                self._pending.pop(image.frame, None)
+                self.complete_ticks += 1
+            else:
+                self._pending[image.frame] = delivered
+            # frames that never completed within pending_ticks lost a camera
+            stale = [frame for frame in self._pending if frame < image.frame - self.pending_ticks]
+            for frame in stale:
+                del self._pending[frame]
+                self.incomplete_ticks += 1
+        on_image(spec, image)
+
+    def stop(self):
+        for camera in self.cameras.values():
+            if camera.is_listening:
+                camera.stop()
+
+    def destroy(self):
+        """Stop and destroy the cameras, unless a SpawnManager owns them."""
+        self.stop()
+        if self.spawn_manager is None:
+            for camera in self.cameras.values():
+                camera.destroy()
+        self.cameras = {}
+
+    def summary(self):
+        return {
+            "sensors": {name: dict(stats.summary(), resolution=self.specs[name].resolution)
+                        for name, stats in self.stats.items()},
+            "complete_ticks": self.complete_ticks,
+            "incomplete_ticks": self.incomplete_ticks + len(self._pending),
+        }
+
+    def print_summary(self, pipeline_stats=None):
+        """Per-camera rates, plus the per-source queue stats of an InferencePipeline summary."""
+        stats = self.summary()
+        print(f"Sensor rig: {stats['complete_ticks']} ticks with every camera, "
+              f"{stats['incomplete_ticks']} with frames missing")
+        sources = (pipeline_stats or {}).get("sources", {})
+        for name, sensor in stats["sensors"].items():
+            fps = f"{sensor['sim_fps']:.1f} fps sim" if sensor["sim_fps"] else "n/a fps"
+            if sensor["wall_fps"]:
+                fps += f", {sensor['wall_fps']:.1f} fps wall"
+            line = f"  {name} ({sensor['resolution']}px): {sensor['frames']} frames, {fps}"
+            source = sources.get(name)
+            if source:
+                line += (f", {source['processed']} inferred, {source['tracked']} tracked, {source['skipped']} skipped, "
+                         f"{source['dropped']} dropped, max queue depth {source['max_queue_depth']}")
+            print(line)
@@ -0,0 +1,192 @@
+"""Batched actor spawning and teardown.
+
+Vehicles, walkers and walker AI controllers are spawned with
+client.apply_batch_sync (one round trip per batch instead of one blocking
+RPC per actor) and every actor is kept in a registry that is destroyed in
+one batch on exit, including on KeyboardInterrupt or an uncaught exception.
+Blueprint and spawn point choices come from a seeded RNG so runs repeat.
+"""
+import atexit
+import random
+import time
+
+import carla
+
+SpawnActor = carla.command.SpawnActor
+SetAutopilot = carla.command.SetAutopilot
+DestroyActor = carla.command.DestroyActor
+FutureActor = carla.command.FutureActor
+
+
+class SpawnManager:
+    """Spawns actors in batches and guarantees they are destroyed again."""
+
+    def __init__(self, client, world=None, seed=None, tm_port=8000):
+        self.client = client
+        self.world = world if world is not None else client.get_world()
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.tm_port = tm_port
+
+        self.vehicle_ids = []
+        self.walker_ids = []
+        self.controller_ids = []
+        self.other_actors = []
+        self._used_spawn_points = set()
+        self.failures = []
+        self.setup_time = 0.0
+        self._destroyed = False
+        atexit.register(self.destroy_all)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.destroy_all()
+        return False
+
+    def _apply(self, batch):
+        """apply_batch_sync, ticking if the world is synchronous so the actors really exist."""
+        do_tick = self.world.get_settings().synchronous_mode
+        responses = self.client.apply_batch_sync(batch, do_tick)
+        actor_ids = []
+        for response in responses:
+            if response.error:
+                self.failures.append(response.error)
+                actor_ids.append(None)
+            else:
+                actor_ids.append(response.actor_id)
+        return actor_ids
+
+    @staticmethod
+    def _spawn_key(spawn_point):
+        location = spawn_point.location
+        return (round(location.x, 1), round(location.y, 1), round(location.z, 1))
+
+    def _blueprints(self, pattern):
+        # sorted so the seeded choice doesn't depend on the server's listing order
+        return sorted(self.world.get_blueprint_library().filter(pattern), key=lambda bp: bp.id)
+
+    def spawn_vehicles(self, count, blueprint_filter="vehicle.*", autopilot=True, spawn_points=None, role_name=None):
+        """Spawn up to count vehicles at distinct spawn points, returns the vehicle actors.
+
+        role_name defaults to "autopilot" or "manual", e.g. "ambulance" lets scenario.py replay find the ego.
+        """
+        start = time.perf_counter()
+        blueprints = self._blueprints(blueprint_filter)
+        if spawn_points is None:
+            spawn_points = self.world.get_map().get_spawn_points()
+        # skip spawn points this manager already filled, later batches would only collide there
+        spawn_points = [sp for sp in spawn_points if self._spawn_key(sp) not in self._used_spawn_points]
+        self.rng.shuffle(spawn_points)
+        if count > len(spawn_points):
+            print(f"Requested {count} vehicles but only {len(spawn_points)} spawn points are free")
+            count = len(spawn_points)
+
+        batch = []
+        for spawn_point in spawn_points[:count]:
+            self._used_spawn_points.add(self._spawn_key(spawn_point))
+            bp = self.rng.choice(blueprints)
+            if bp.has_attribute('color'):
+                bp.set_attribute('color', self.rng.choice(bp.get_attribute('color').recommended_values))
+            bp.set_attribute('role_name', role_name or ('autopilot' if autopilot else 'manual'))
+            batch.append(SpawnActor(bp, spawn_point).then(SetAutopilot(FutureActor, autopilot, self.tm_port)))
+
+        actor_ids = [actor_id for actor_id in self._apply(batch) if actor_id is not None]
+        self.vehicle_ids.extend(actor_ids)
+        self.setup_time += time.perf_counter() - start
+        return list(self.world.get_actors(actor_ids)) if actor_ids else []
+
+    def spawn_vehicle(self, blueprint, spawn_point, autopilot=False):
+        """Spawn a single vehicle (e.g. the ambulance), returns None if the spot is taken."""
+        start = time.perf_counter()
+        self._used_spawn_points.add(self._spawn_key(spawn_point))
+        actor_ids = self._apply([SpawnActor(blueprint, spawn_point).then(
+            SetAutopilot(FutureActor, autopilot, self.tm_port))])
+        self.setup_time += time.perf_counter() - start
+        if actor_ids[0] is None:
+            return None
+        self.vehicle_ids.append(actor_ids[0])
+        return self.world.get_actor(actor_ids[0])
+
+    def spawn_walkers(self, count, blueprint_filter="walker.pedestrian.*", running_ratio=0.0):
+        """Spawn walkers plus their AI controllers and send them walking, returns the walker actors."""
+        start = time.perf_counter()
+        if self.seed is not None:
+            self.world.set_pedestrians_seed(self.seed)
+        blueprints = self._blueprints(blueprint_filter)
+
+        batch = []
+        speeds = []
+        for _ in range(count):
+            location = self.world.get_random_location_from_navigation()
+            if location is None:
+                continue
+            bp = self.rng.choice(blueprints)
+            if bp.has_attribute('is_invincible'):
+                bp.set_attribute('is_invincible', 'false')
+            speed = 0.0
+            if bp.has_attribute('speed'):
+                recommended = bp.get_attribute('speed').recommended_values
+                # index 1 is walking, 2 is running
+                speed = float(recommended[2] if self.rng.random() < running_ratio else recommended[1])
+            speeds.append(speed)
+            batch.append(SpawnActor(bp, carla.Transform(location)))
+        walker_ids = self._apply(batch)
+        speeds = [speed for walker_id, speed in zip(walker_ids, speeds) if walker_id is not None]
+        walker_ids = [walker_id for walker_id in walker_ids if walker_id is not None]
+        self.walker_ids.extend(walker_ids)
+
+        controller_bp = self.world.get_blueprint_library().find('controller.ai.walker')
+        controller_ids = self._apply([SpawnActor(controller_bp, carla.Transform(), walker_id)
+                                      for walker_id in walker_ids])
+        self.controller_ids.extend(controller_id for controller_id in controller_ids if controller_id is not None)
+
+        # controllers need a tick before they can be started
+        if self.world.get_settings().synchronous_mode:
+            self.world.tick()
+        else:
+            self.world.wait_for_tick()
+        for controller_id, speed in zip(controller_ids, speeds):
+            if controller_id is None:
+                continue
+            controller = self.world.get_actor(controller_id)
+            controller.start()
+            controller.go_to_location(self.world.get_random_location_from_navigation())
+            controller.set_max_speed(speed)
+
+        self.setup_time += time.perf_counter() - start
+        return list(self.world.get_actors(walker_ids)) if walker_ids else []
+
+    def register(self, actor):
+        """Track an actor spawned elsewhere (e.g. a sensor) so it's destroyed with the rest."""
+        self.other_actors.append(actor)
+        return actor
+
+    def destroy_all(self):
+        """Destroy everything spawned through the manager in one batch, safe to call twice."""
+        if self._destroyed:
+            return
+        self._destroyed = True
+        start = time.perf_counter()
+
+        for actor in self.other_actors:
+            # sensors have to stop listening before they go away
+            if actor.is_alive and hasattr(actor, 'stop') and actor.type_id.startswith('sensor.'):
+                actor.stop()
+        for controller in self.world.get_actors(self.controller_ids):
+            controller.stop()
+
+        actor_ids = ([actor.id for actor in self.other_actors] + self.controller_ids
+                     + self.walker_ids + self.vehicle_ids)
+        if actor_ids:
+            self.client.apply_batch_sync([DestroyActor(actor_id) for actor_id in actor_ids], False)
+        atexit.unregister(self.destroy_all)
+        print(f"Destroyed {len(actor_ids)} actors in {time.perf_counter() - start:.2f}s.")
+
+    def print_report(self):
+        print(f"Spawned {len(self.vehicle_ids)} vehicles, {len(self.walker_ids)} walkers and "
+              f"{len(self.controller_ids)} walker controllers in {self.setup_time:.2f}s "
+              f"(seed {self.seed}, {len(self.failures)} failures)")
+        for error in sorted(set(self.failures)):
+            print(f"  {self.failures.count(error)}x {error}")
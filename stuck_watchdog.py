@@ -0,0 +1,216 @@
+"""Stuck and crashed vehicle watchdog for long unattended runs.
+
+Once per tick the positions of every watched vehicle are read from the world
+snapshot into a rolling (window, vehicles, 2) NumPy history, so the net
+displacement over the last suspect_seconds / stuck_seconds is one vectorized
+subtraction for the whole fleet:
+
+    suspect   moved less than min_displacement over suspect_seconds
+              (frames of a suspect ego vehicle are not worth capturing)
+    stuck     moved less than min_displacement over stuck_seconds
+    collision a collision sensor fired and the vehicle became suspect within
+              collision_grace_seconds of the impact (a vehicle that was
+              already standing when it got bumped, e.g. at a red light, isn't)
+
+Stuck and collided vehicles are moved to clear spawn points with one batch
+of ApplyTransform commands. Every event records the frames the vehicle stood
+still and the sim time lost to it. A flagged vehicle that isn't moved
+(recover=False or no clear spawn point) stays flagged until it drives off
+again, so one episode is one event and its lost time is counted once.
+"""
+import threading
+
+import carla
+import numpy as np
+
+from pedestrian_detection import snapshot_arrays
+from telemetry_sink import CATEGORY
+
+ApplyTransform = carla.command.ApplyTransform
+ApplyTargetVelocity = carla.command.ApplyTargetVelocity
+
+# telemetry_sink table of watchdog events, frames first_frame..frame are the ones the vehicle stood still
+EVENT_SCHEMA = [
+    ("actor_id", np.int64), ("reason", CATEGORY), ("first_frame", np.int64), ("frame", np.int64),
+    ("lost_seconds", np.float32), ("spawn_index", np.int32),
+]
+
+
+class StuckWatchdog:
+    """Flags stuck or crashed vehicles from per-tick snapshots and relocates them in one batch."""
+
+    def __init__(self, client, world, vehicles, route_cache, fixed_delta_seconds=0.05, stuck_seconds=30.0,
+                 suspect_seconds=5.0, min_displacement=1.0, collision_vehicles=(), spawn_manager=None,
+                 recover=True, collision_grace_seconds=10.0):
+        self.client = client
+        self.world = world
+        self.route_cache = route_cache
+        self.vehicle_ids = [vehicle.id for vehicle in vehicles]
+        self._row = {actor_id: i for i, actor_id in enumerate(self.vehicle_ids)}
+        self.fixed_delta_seconds = fixed_delta_seconds
+        self.window = max(1, int(round(stuck_seconds / fixed_delta_seconds)))
+        self.suspect_ticks = min(self.window, max(1, int(round(suspect_seconds / fixed_delta_seconds))))
+        self.min_displacement = min_displacement
+        self.recover = recover
+        self.collision_grace_ticks = max(1, int(round(collision_grace_seconds / fixed_delta_seconds)))
+
+        # history[t % window] is every vehicle's xy at tick t, NaN until seen (or right after a relocation)
+        self._history = np.full((self.window, len(self.vehicle_ids), 2), np.nan)
+        self._ticks = 0
+        self.suspect = np.zeros(len(self.vehicle_ids), dtype=bool)
+        # flagged and not moved yet, not reported again until the vehicle moves
+        self._flagged = np.zeros(len(self.vehicle_ids), dtype=bool)
+
+        # frame of each vehicle's last collision as reported by the sensor thread, NaN if none
+        self._collision_frame = np.full(len(self.vehicle_ids), np.nan)
+        # the collision being watched: its frame and whether the vehicle already stood still then
+        self._impact_frame = np.full(len(self.vehicle_ids), np.nan)
+        self._impact_while_suspect = np.zeros(len(self.vehicle_ids), dtype=bool)
+        self._lock = threading.Lock()
+        self.collisions = 0
+        self.sensors = []
+        blueprint = world.get_blueprint_library().find('sensor.other.collision')
+        for vehicle in collision_vehicles:
+            sensor = world.spawn_actor(blueprint, carla.Transform(), attach_to=vehicle)
+            if spawn_manager is not None:
+                spawn_manager.register(sensor)
+            sensor.listen(lambda event, row=self._row[vehicle.id]: self._on_collision(row, event.frame))
+            self.sensors.append(sensor)
+
+        self.events = []
+        self.lost_seconds = 0.0
+        self.first_frame = None
+        self.last_frame = None
+
+    def _on_collision(self, row, frame):
+        with self._lock:
+            self._collision_frame[row] = frame
+            self.collisions += 1
+
+    def is_suspect(self, actor_id):
+        """True while the vehicle has barely moved for suspect_seconds, e.g. to pause capture."""
+        row = self._row.get(actor_id)
+        return row is not None and bool(self.suspect[row])
+
+    def _displacement(self, positions, ticks_back):
+        past = self._history[(self._ticks - ticks_back) % self.window]
+        # NaN (not enough history yet) compares False, so such vehicles are never flagged
+        return np.hypot(positions[:, 0] - past[:, 0], positions[:, 1] - past[:, 1])
+
+    def _still_ticks(self, row, position):
+        """How many ticks back the vehicle has stayed within min_displacement of where it is now."""
+        for back in range(1, self.window):
+            past = self._history[(self._ticks - back) % self.window, row]
+            if np.isnan(past[0]) or np.hypot(*(position - past)) >= self.min_displacement:
+                return back
+        return self.window
+
+    def update(self, snapshot):
+        """Check the fleet against one world snapshot, returns the events (relocations) of this tick."""
+        frame = snapshot.frame
+        if self.first_frame is None:
+            self.first_frame = frame
+        self.last_frame = frame
+
+        positions, _, _, found = snapshot_arrays(snapshot, self.vehicle_ids)
+        positions[~found] = np.nan
+        self._ticks += 1
+
+        suspect = self._displacement(positions, self.suspect_ticks) < self.min_displacement
+        stuck = self._displacement(positions, self.window) < self.min_displacement if self._ticks > self.window \
+            else np.zeros(len(self.vehicle_ids), dtype=bool)
+        self._history[self._ticks % self.window] = positions
+
+        with self._lock:
+            collision_frame = self._collision_frame.copy()
+            self._collision_frame[:] = np.nan
+        # latch new impacts with whether the vehicle was standing already (last tick's suspect)
+        hit = ~np.isnan(collision_frame)
+        self._impact_frame[hit] = collision_frame[hit]
+        self._impact_while_suspect[hit] = self.suspect[hit]
+        with np.errstate(invalid="ignore"):
+            in_grace = frame - self._impact_frame <= self.collision_grace_ticks
+        self._impact_frame[~in_grace] = np.nan
+        crashed = in_grace & suspect & ~self._impact_while_suspect
+        self.suspect = suspect
+
+        # an episode ends once the vehicle moves again
+        self._flagged &= suspect
+        events = []
+        flagged = np.nonzero((stuck | crashed) & ~self._flagged)[0]
+        if len(flagged):
+            events = self._handle(flagged, positions, crashed, frame)
+        return events
+
+    def _handle(self, rows, positions, crashed, frame):
+        events = []
+        batch = []
+        used = []
+        for row in rows.tolist():
+            still_ticks = self._still_ticks(row, positions[row])
+            event = {
+                "actor_id": self.vehicle_ids[row],
+                "reason": "collision" if crashed[row] else "stuck",
+                "first_frame": frame - still_ticks,
+                "frame": frame,
+                "lost_seconds": still_ticks * self.fixed_delta_seconds,
+                "spawn_index": None,
+            }
+            self._flagged[row] = True
+            self._impact_frame[row] = np.nan
+            if self.recover:
+                # the watched fleet's positions from this snapshot, no per-vehicle location queries
+                spot = self.route_cache.clear_spawn_point(self.world, exclude=used, occupied=positions)
+                if spot is not None:
+                    index, transform = spot
+                    used.append(index)
+                    event["spawn_index"] = index
+                    batch.append(ApplyTransform(event["actor_id"], transform))
+                    batch.append(ApplyTargetVelocity(event["actor_id"], carla.Vector3D()))
+                    # start the window over, the jump would otherwise count as movement
+                    self._history[:, row] = np.nan
+                    self.suspect[row] = False
+                    self._flagged[row] = False
+            self.lost_seconds += event["lost_seconds"]
+            events.append(event)
+
+        if batch:
+            for response in self.client.apply_batch_sync(batch, False):
+                if response.error:
+                    print(f"Watchdog relocation failed: {response.error}")
+        for event in events:
+            print(f"Watchdog: vehicle {event['actor_id']} {event['reason']} at frame {event['frame']}, "
+                  f"{event['lost_seconds']:.1f}s sim time lost"
+                  + (f", moved to spawn point {event['spawn_index']}" if event["spawn_index"] is not None else ""))
+        self.events.extend(events)
+        return events
+
+    @staticmethod
+    def event_record(event):
+        """One EVENT_SCHEMA row, spawn_index -1 when the vehicle wasn't moved."""
+        spawn_index = event["spawn_index"] if event["spawn_index"] is not None else -1
+        return (event["actor_id"], event["reason"], event["first_frame"], event["frame"],
+                event["lost_seconds"], spawn_index)
+
+    def summary(self):
+        sim_seconds = ((self.last_frame - self.first_frame) * self.fixed_delta_seconds
+                       if self.first_frame is not None else 0.0)
+        reasons = {}
+        for event in self.events:
+            reasons[event["reason"]] = reasons.get(event["reason"], 0) + 1
+        return {
+            "vehicles": len(self.vehicle_ids),
+            "events": len(self.events),
+            "reasons": reasons,
+            "collisions": self.collisions,
+            "lost_seconds": self.lost_seconds,
+            "sim_seconds": sim_seconds,
+            "lost_fraction": self.lost_seconds / sim_seconds / max(len(self.vehicle_ids), 1) if sim_seconds else 0.0,
+        }
+
+    def print_summary(self):
+        stats = self.summary()
+        reasons = ", ".join(f"{count} {reason}" for reason, count in stats["reasons"].items()) or "no events"
+        print(f"Watchdog: {stats['vehicles']} vehicles over {stats['sim_seconds']:.0f}s sim, {reasons}, "
+              f"{stats['collisions']} collisions, {stats['lost_seconds']:.1f} vehicle-seconds lost "
+              f"({stats['lost_fraction']:.1%} of fleet time)")
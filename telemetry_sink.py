@@ -0,0 +1,337 @@
+"""Buffered, columnar telemetry logging.
+
+Records are appended into preallocated NumPy column buffers and written out
+in bulk, one part file per full buffer, instead of one csv.writer.writerow()
+per record from the hot loops. Parts are Parquet when pyarrow is installed,
+npz otherwise:
+
+    telemetry/
+        frames/part-00000.parquet
+        detections/part-00000.parquet
+
+Every part is written to a temp file and renamed. A table flushes once it
+holds chunk_rows rows or its oldest buffered row is flush_seconds old, checked
+on every append and by a background thread (so rows still reach the disk
+when the producer stalls), and the sink flushes on close(), on leaving a with
+block and at interpreter exit, so a crash, kill or server hang loses at most
+the last few seconds of rows. Each table also keeps its column names in
+schema.json, so an empty table still exports a CSV header. String columns ("category")
+are stored as int16 codes plus the category list.
+
+read_table() loads a table back as a dict of arrays, export_csv() writes the
+plain CSV the rest of the tooling reads (float32 columns in their shortest
+form, 0.9 rather than 0.8999999761581421).
+"""
+import atexit
+import csv
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from runtime_metrics import REGISTRY
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+CATEGORY = "category"
+SCHEMA_FILE = "schema.json"
+DEFAULT_CHUNK_ROWS = 4096
+DEFAULT_FLUSH_SECONDS = 5.0
+
+
+def default_format():
+    return "parquet" if pa is not None else "npz"
+
+
+def _write_atomic(path, write):
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+class Table:
+    """One append-only table backed by fixed-size column buffers."""
+
+    def __init__(self, name, schema, directory, chunk_rows=DEFAULT_CHUNK_ROWS, fmt="npz",
+                 flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.name = name
+        self.schema = list(schema)
+        self.columns = [column for column, _ in self.schema]
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.fmt = fmt
+        self.flush_seconds = flush_seconds
+        self._flush_due = None  # monotonic time the buffered rows have to be on disk by
+
+        self.categories = {column: [] for column, dtype in self.schema if dtype == CATEGORY}
+        self._codes = {column: {} for column in self.categories}
+        self._buffers = {
+            column: np.empty(chunk_rows, dtype=np.int16 if dtype == CATEGORY else dtype)
+            for column, dtype in self.schema
+        }
+        self.size = 0
+        self.rows = 0
+        self.parts = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._bytes_total = REGISTRY.counter("telemetry_bytes_total", "Bytes of telemetry parts written",
+                                             {"table": name})
+
+        # a new sink replaces the previous run's table, like opening a csv with "w"
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "part-*")):
+            os.remove(path)
+        _write_atomic(os.path.join(directory, SCHEMA_FILE),
+                      lambda tmp_path: _write_json(tmp_path, {"columns": self.columns}))
+
+    def _encode(self, column, values):
+        codes = self._codes[column]
+        categories = self.categories[column]
+        encoded = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(categories)
+                categories.append(value)
+            encoded.append(code)
+        return encoded
+
+    def append(self, *values):
+        """Append one row, values in schema order."""
+        with self._lock:
+            i = self.size
+            for column, value in zip(self.columns, values):
+                if column in self._codes:
+                    value = self._encode(column, (value,))[0]
+                self._buffers[column][i] = value
+            self.size += 1
+            self.rows += 1
+            self._flush_if_due()
+
+    def extend(self, **columns):
+        """Append many rows given as equal-length column arrays/lists."""
+        with self._lock:
+            columns = {column: (self._encode(column, values) if column in self._codes else values)
+                       for column, values in columns.items()}
+            count = len(next(iter(columns.values()))) if columns else 0
+            done = 0
+            while done < count:
+                take = min(count - done, self.chunk_rows - self.size)
+                for column in self.columns:
+                    self._buffers[column][self.size:self.size + take] = columns[column][done:done + take]
+                self.size += take
+                self.rows += take
+                done += take
+                if self.size == self.chunk_rows:
+                    self._flush()
+            self._flush_if_due()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_if_due(self):
+        with self._lock:
+            self._flush_if_due()
+
+    def _flush_if_due(self):
+        if self.size == self.chunk_rows:
+            self._flush()
+        elif self.size:
+            now = time.monotonic()
+            if self._flush_due is None:
+                self._flush_due = now + self.flush_seconds
+            elif now >= self._flush_due:
+                self._flush()
+
+    def _flush(self):
+        self._flush_due = None
+        if self.size == 0:
+            return
+        data = {column: self._buffers[column][:self.size] for column in self.columns}
+        path = os.path.join(self.directory, f"part-{self.parts:05d}.{self.fmt}")
+        if self.fmt == "parquet":
+            arrays = {}
+            for column, values in data.items():
+                if column in self.categories:
+                    arrays[column] = pa.DictionaryArray.from_arrays(
+                        pa.array(values), pa.array(self.categories[column], type=pa.string()))
+                else:
+                    arrays[column] = pa.array(values)
+            _write_atomic(path, lambda tmp_path: pq.write_table(pa.table(arrays), tmp_path))
+        else:
+            for column in self.categories:
+                data[f"__categories__{column}"] = np.array(self.categories[column], dtype=str)
+
+            def write(tmp_path):
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **data)
+            _write_atomic(path, write)
+        size = os.path.getsize(path)
+        self.bytes_written += size
+        self._bytes_total.inc(size)
+        self.parts += 1
+        self.size = 0
+
+
+class TelemetrySink:
+    """A directory of columnar tables, flushed in bulk every few seconds and on exit."""
+
+    def __init__(self, directory, schemas, chunk_rows=DEFAULT_CHUNK_ROWS, fmt=None,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.directory = directory
+        self.fmt = fmt or default_format()
+        if self.fmt == "parquet" and pa is None:
+            raise RuntimeError("Parquet telemetry needs pyarrow, use fmt='npz' or pip install pyarrow")
+        self.tables = {name: Table(name, schema, os.path.join(directory, name), chunk_rows, self.fmt,
+                                   flush_seconds)
+                       for name, schema in schemas.items()}
+        self._closed = False
+        # flushes tables whose producer went quiet, appends only check their own table when they happen
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_seconds,), name="telemetry-flush",
+                                         daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def append(self, table, *values):
+        self.tables[table].append(*values)
+
+    def extend(self, table, **columns):
+        self.tables[table].extend(**columns)
+
+    def flush(self):
+        for table in self.tables.values():
+            table.flush()
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval / 2):
+            for table in self.tables.values():
+                try:
+                    table.flush_if_due()
+                except OSError as e:
+                    print(f"Telemetry flush of {table.name} failed: {e}")
+
+    def close(self):
+        """Flush whatever is buffered, safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def summary(self):
+        return {name: {"rows": table.rows, "parts": table.parts, "bytes_written": table.bytes_written}
+                for name, table in self.tables.items()}
+
+    def print_summary(self):
+        for name, stats in self.summary().items():
+            print(f"Telemetry {name}: {stats['rows']} rows in {stats['parts']} {self.fmt} parts "
+                  f"({stats['bytes_written'] / 1e6:.1f} MB)")
+
+
+def iter_parts(directory, name, columns=None, decode=True):
+    """Each part of a table as {column: array} in write order, so big tables can be streamed."""
+    paths = sorted(glob.glob(os.path.join(directory, name, "part-*.parquet"))
+                   + glob.glob(os.path.join(directory, name, "part-*.npz")))
+    for path in paths:
+        part = {}
+        categories = {}
+        if path.endswith(".parquet"):
+            if pq is None:
+                raise RuntimeError(f"{path} needs pyarrow to read")
+            # like np.load below, columns an older part doesn't have are left out instead of failing
+            names = pq.read_schema(path).names
+            table = pq.read_table(path, columns=[column for column in columns if column in names]
+                                  if columns is not None else None)
+            for column in table.column_names:
+                array = table.column(column).combine_chunks()
+                if pa.types.is_dictionary(array.type):
+                    categories[column] = array.dictionary.to_pylist()
+                    array = array.indices
+                part[column] = array.to_numpy(zero_copy_only=False)
+        else:
+            with np.load(path) as data:
+                for key in data.files:
+                    if key.startswith("__categories__"):
+                        categories[key[len("__categories__"):]] = data[key].tolist()
+                    elif columns is None or key in columns:
+                        part[key] = data[key]
+        for column, names in categories.items():
+            if column not in part:
+                continue
+            if decode:
+                part[column] = np.array(names, dtype=object)[part[column]]
+            else:
+                part[f"{column}_categories"] = names
+        yield part
+
+
+def read_table(directory, name, columns=None, decode=True):
+    """All parts of a table as {column: array}, category columns decoded to strings unless decode=False."""
+    parts = {}
+    categories = {}
+    for part in iter_parts(directory, name, columns, decode):
+        for column, values in part.items():
+            if column.endswith("_categories") and not decode:
+                # categories only ever grow, so the latest part's list covers every earlier code
+                categories[column] = values
+            else:
+                parts.setdefault(column, []).append(values)
+    result = {column: np.concatenate(arrays) for column, arrays in parts.items()}
+    result.update(categories)
+    return result
+
+
+def table_columns(directory, name):
+    """Column names of a table from its schema.json, None for tables written before it existed."""
+    path = os.path.join(directory, name, SCHEMA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["columns"]
+
+
+def csv_values(values):
+    """A column as a list for csv.writer, float32 in its shortest repr (0.9, not 0.8999999761581421)."""
+    if values.dtype == np.float32:
+        return values.astype(str).tolist()
+    return values.tolist()
+
+
+def export_csv(directory, name, csv_path, columns=None, header=None):
+    """Write a table (or some of its columns) as a plain CSV, returns the row count.
+
+    An empty table (e.g. no rows were ever appended) still gets its header row.
+    """
+    data = read_table(directory, name, columns)
+    columns = columns or list(data) or table_columns(directory, name) or []
+    rows = len(data[columns[0]]) if data and columns else 0
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header or columns)
+        if rows:
+            writer.writerows(zip(*(csv_values(data[column]) for column in columns)))
+    return rows
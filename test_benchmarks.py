@@ -0,0 +1,64 @@
+"""The baseline regression check of benchmarks.py.
+
+    python -m pytest -q test_benchmarks.py
+"""
+import json
+from types import SimpleNamespace
+
+import benchmarks
+from benchmarks import compare, run, save_baseline, scale_of
+
+STATS = {"p50_us": 100.0, "p95_us": 200.0, "alloc_bytes_per_call": 4096, "throughput_per_s": 10000.0}
+
+
+def baseline_of(stages):
+    return {"scale": {}, "stages": stages}
+
+
+def test_unchanged_results_pass():
+    assert compare(baseline_of({"stage": STATS}), {"stage": dict(STATS)}, threshold=0.2) == []
+
+
+def test_slower_and_bigger_results_are_regressions():
+    results = {"stage": dict(STATS, p50_us=130.0, alloc_bytes_per_call=8192)}
+    regressions = compare(baseline_of({"stage": STATS}), results, threshold=0.2)
+    assert sorted(regressions) == [("stage", "alloc_bytes_per_call", 4096, 8192), ("stage", "p50_us", 100.0, 130.0)]
+
+
+def test_lower_throughput_is_a_regression_higher_is_not():
+    baseline = baseline_of({"stage": STATS})
+    assert compare(baseline, {"stage": dict(STATS, throughput_per_s=8000.0)}, threshold=0.2) == [
+        ("stage", "throughput_per_s", 10000.0, 8000.0)]
+    assert compare(baseline, {"stage": dict(STATS, throughput_per_s=50000.0)}, threshold=0.2) == []
+
+
+def test_absolute_slack_absorbs_noise_on_tiny_numbers():
+    baseline = baseline_of({"stage": dict(STATS, p50_us=1.0, alloc_bytes_per_call=0)})
+    # 1.0 -> 2.1 us is +110%, but within 20% + 1 us of slack
+    results = {"stage": dict(STATS, p50_us=2.1, alloc_bytes_per_call=200)}
+    assert compare(baseline, results, threshold=0.2) == []
+    results = {"stage": dict(STATS, p50_us=2.3, alloc_bytes_per_call=300)}
+    assert [metric for _, metric, _, _ in compare(baseline, results, threshold=0.2)] == [
+        "p50_us", "alloc_bytes_per_call"]
+
+
+def test_threshold_and_missing_stages_or_metrics():
+    results = {"stage": dict(STATS, p95_us=230.0), "new_stage": dict(STATS, p50_us=1e9)}
+    assert compare(baseline_of({"stage": STATS}), results, threshold=0.2) == []
+    assert compare(baseline_of({"stage": STATS}), results, threshold=0.1) == [("stage", "p95_us", 200.0, 230.0)]
+    # a baseline from before a metric existed doesn't flag it
+    old = {key: value for key, value in STATS.items() if key != "alloc_bytes_per_call"}
+    assert compare(baseline_of({"stage": old}), {"stage": dict(STATS, alloc_bytes_per_call=1e9)}) == []
+
+
+def test_saved_baseline_round_trip(tmp_path):
+    args = SimpleNamespace(stages=["get_intersection"], iterations=20, vehicles=5, pedestrians=10, junctions=4,
+                           ambulances=1, resolution=64, seed=0, profile=False, profile_top=5)
+    results = run(args)
+    assert set(results["get_intersection"]) >= set(benchmarks.TRACKED_METRICS)
+
+    path = tmp_path / "cache" / "baseline.json"
+    save_baseline(str(path), args, results)
+    baseline = json.loads(path.read_text())
+    assert baseline["scale"] == scale_of(args)
+    assert compare(baseline, results) == []
@@ -0,0 +1,93 @@
+"""BoxTracker, DetectionSchedule and the offline evaluation on synthetic detections.
+
+    python -m pytest -q test_box_tracker.py
+"""
+import csv
+
+import numpy as np
+
+from box_tracker import BoxTracker, DetectionSchedule, evaluate, read_detections
+from detection_log import DETECTION_COLUMNS
+
+FRAMES = 600
+
+
+def synthetic_detections(seed=0, frames=FRAMES):
+    """Six objects drifting and growing across the image, each missed by the detector 5% of the time."""
+    rng = np.random.default_rng(seed)
+    objects = []
+    for k in range(6):
+        start, life = rng.integers(0, frames - 100), rng.integers(60, 300)
+        objects.append((start, life, rng.uniform(20, 280, 2), rng.normal(0, 1.5, 2), rng.normal(0, 0.03, 2),
+                        rng.uniform(15, 60, 2), rng.normal(0, 0.003), ("car", "person")[k % 2]))
+    speed = 30 + 25 * np.sin(np.arange(frames) / 80)
+    detections = {}
+    for frame in range(frames):
+        xyxy, classes = [], []
+        for start, life, position, velocity, accel, size, growth, name in objects:
+            t = frame - start
+            if not 0 <= t < life or rng.random() < 0.05:
+                continue
+            center = position + velocity * t + accel * t * t / 2 + rng.normal(0, 1, 2)
+            half = size * (1 + growth) ** t / 2
+            xyxy.append([*(center - half), *(center + half)])
+            classes.append(name)
+        if xyxy:
+            detections[frame] = (np.array(xyxy), np.full(len(xyxy), 0.8, dtype=np.float32), classes)
+    return list(range(frames)), speed, detections
+
+
+def test_tracker_follows_a_moving_box():
+    tracker = BoxTracker()
+    for frame in range(0, 10, 2):
+        x = 100 + 4 * frame
+        boxes = tracker.update(frame, np.array([[x, 50, x + 40, 90]]), np.array([0.9], np.float32), ["car"])
+    assert len(boxes) == 1
+    predicted = tracker.propagate(9)
+    assert predicted.classes == ["car"]
+    assert abs(predicted.xyxy[0, 0] - (100 + 4 * 9)) < 2.0
+    assert predicted.track_ids[0] == boxes.track_ids[0]
+
+
+def test_schedule_detects_more_often_at_speed_and_when_uncertain():
+    schedule = DetectionSchedule(max_interval=8, min_interval=2, fast_speed_kmh=60.0, max_uncertainty=0.3)
+    assert schedule.interval(0.0) == 8
+    assert schedule.interval(120.0) == 2
+    assert schedule.should_detect(None, 0.0, 0.0)
+    assert not schedule.should_detect(4, 0.0, 0.0)
+    assert schedule.should_detect(8, 0.0, 0.0)
+    assert schedule.should_detect(4, 0.0, 0.5)
+    assert not schedule.should_detect(1, 0.0, 0.5, min_interval=2)
+
+
+def test_tracker_beats_a_fixed_stride_at_similar_detector_cost():
+    frames, speed, detections = synthetic_detections()
+    results = evaluate(frames, speed, detections, stride=4)
+    tracker, stride = results["tracker"], results["stride 4"]
+    assert tracker["detector_runs"] <= 1.25 * stride["detector_runs"]
+    assert tracker["recall"] > 0.9
+    assert tracker["recall"] > stride["recall"] + 0.3
+    assert tracker["mean_iou"] > 0.6
+
+
+def test_read_detections_skips_tracked_rows(tmp_path):
+    csv_path = tmp_path / "detection_data.csv"
+    row = dict.fromkeys(DETECTION_COLUMNS, 0)
+    rows = [
+        {**row, "frame_number": 1, "class": "car", "confidence": 0.9, "x2": 10, "y2": 10, "speed_kmh": 20,
+         "box_source": "detected"},
+        {**row, "frame_number": 2, "class": "car", "confidence": 0.9, "x2": 10, "y2": 10, "speed_kmh": 25,
+         "box_source": "tracked"},
+        {**row, "frame_number": 3, "class": "car", "confidence": 0.5, "x2": 10, "y2": 10, "speed_kmh": 30,
+         "box_source": "detected"},
+    ]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, DETECTION_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    frames, speed, detections = read_detections(str(csv_path))
+    assert frames == [1, 2, 3]
+    assert sorted(detections) == [1, 3]
+    # the tracked frame still has its speed
+    assert list(speed) == [20.0, 25.0, 30.0]
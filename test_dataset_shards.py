@@ -0,0 +1,90 @@
+"""ShardWriter/ShardReader round trip on synthetic JPEG bytes.
+
+    python -m pytest -q test_dataset_shards.py
+"""
+import os
+
+import numpy as np
+import pytest
+
+from dataset_shards import ShardReader, ShardWriter, convert_flat_dataset
+
+
+def jpeg(frame):
+    # any bytes do, sizes vary so offsets don't land on block boundaries
+    return bytes([frame % 256]) * (700 + 37 * frame)
+
+
+def write_dataset(directory, frames, samples_per_shard=4, **kwargs):
+    writer = ShardWriter(str(directory), samples_per_shard, **kwargs)
+    for frame in frames:
+        writer.add_controls(frame, frame / 100, 0.5, 0.0)
+        writer.add_image(frame, jpeg(frame))
+    writer.close()
+    return writer
+
+
+@pytest.mark.parametrize("mode", ["mmap", "read"])
+def test_round_trip(tmp_path, mode):
+    write_dataset(tmp_path, range(10))
+    reader = ShardReader(str(tmp_path), mode)
+    assert len(reader) == 10
+    assert len(reader.shards) == 3
+    assert reader.frames() == list(range(10))
+    samples = [(frame, bytes(data), controls) for frame, data, controls in reader]
+    assert samples == [(frame, jpeg(frame), (frame / 100, 0.5, 0.0)) for frame in range(10)]
+
+
+def test_images_and_controls_pair_up_in_any_order(tmp_path):
+    writer = ShardWriter(str(tmp_path), samples_per_shard=100)
+    writer.add_image(2, jpeg(2))
+    writer.add_controls(1, 0.1, 0.5, 0.0)
+    writer.add_controls(2, 0.2, 0.5, 0.0)
+    writer.add_image(1, jpeg(1))
+    writer.close()
+    assert ShardReader(str(tmp_path)).frames() == [2, 1]
+    assert writer.unlabeled == 0
+
+
+def test_unpaired_frames_are_dropped(tmp_path):
+    writer = ShardWriter(str(tmp_path), samples_per_shard=100, reorder_frames=4)
+    writer.add_controls(0, 0.0, 0.0, 0.0)  # capture paused, never gets an image
+    writer.add_image(1, jpeg(1))  # never gets controls
+    for frame in range(2, 12):
+        writer.add_controls(frame, 0.0, 0.5, 0.0)
+        writer.add_image(frame, jpeg(frame))
+    # both were pruned while writing, not only counted on close
+    assert writer._controls == {} and writer._images == {}
+    assert writer.unlabeled == 2
+    writer.close()
+    assert ShardReader(str(tmp_path)).frames() == list(range(2, 12))
+
+
+@pytest.mark.parametrize("mode", ["mmap", "read"])
+def test_held_exports_do_not_break_the_reader(tmp_path, mode):
+    write_dataset(tmp_path, range(10))
+    reader = ShardReader(str(tmp_path), mode)
+    held = []
+    for frame, data, _ in reader:
+        held.append((frame, np.frombuffer(data, np.uint8)))
+        if frame == 5:
+            break  # leaves the shard generator with exports still alive
+    assert [int(array[0]) for _, array in held] == list(range(6))
+    assert all(len(array) == len(jpeg(frame)) for frame, array in held)
+
+
+def test_convert_flat_dataset(tmp_path):
+    source = tmp_path / "flat"
+    source.mkdir()
+    with open(source / "controls.csv", "w") as f:
+        f.write("frame,steering,throttle,brake\n")
+        for frame in range(5):
+            f.write(f"{frame},0.1,0.5,0.0\n")
+    for frame in (0, 1, 3, 4):
+        (source / f"{frame}.jpg").write_bytes(jpeg(frame))
+
+    convert_flat_dataset(str(source), str(tmp_path / "shards"), samples_per_shard=2)
+    reader = ShardReader(str(tmp_path / "shards"))
+    assert reader.frames() == [0, 1, 3, 4]
+    assert os.path.exists(tmp_path / "shards" / "shard-000001.tar")
+    assert [bytes(data) for _, data, _ in reader] == [jpeg(frame) for frame in (0, 1, 3, 4)]
@@ -0,0 +1,75 @@
+"""Dense and grid candidate search against a brute force loop over every pair.
+
+    python -m pytest -q test_pedestrian_detection.py
+"""
+import math
+
+import numpy as np
+import pytest
+
+from pedestrian_detection import detect_pedestrians_batch
+
+
+def scene(num_vehicles, num_pedestrians, extent, seed=0):
+    rng = np.random.default_rng(seed)
+    veh_pos = rng.uniform(0, extent, (num_vehicles, 2))
+    yaw = rng.uniform(-np.pi, np.pi, num_vehicles)
+    veh_forward = np.stack([np.cos(yaw), np.sin(yaw)], axis=1)
+    veh_vel = veh_forward * rng.uniform(0, 15, (num_vehicles, 1))
+    ped_pos = rng.uniform(0, extent, (num_pedestrians, 2))
+    ped_vel = rng.normal(0, 1.4, (num_pedestrians, 2))
+    return veh_pos, veh_forward, veh_vel, ped_pos, ped_vel
+
+
+def brute_force(veh_pos, veh_forward, veh_vel, ped_pos, ped_vel, detection_range, cone_half_angle):
+    """{(vehicle, pedestrian): (distance, ttc)} the way the original per-actor loop tested them."""
+    hits = {}
+    cos_limit = math.cos(math.radians(cone_half_angle))
+    for v in range(len(veh_pos)):
+        for p in range(len(ped_pos)):
+            relative = ped_pos[p] - veh_pos[v]
+            distance = math.hypot(*relative)
+            if distance >= detection_range or relative @ veh_forward[v] <= cos_limit * distance:
+                continue
+            closing = -(relative @ (ped_vel[p] - veh_vel[v])) / max(distance, 1e-6)
+            hits[(v, p)] = (distance, distance / max(closing, 1e-6) if closing > 1e-6 else math.inf)
+    return hits
+
+
+def as_dict(result):
+    return {(v, p): (d, t) for v, p, d, t in zip(result.vehicle_idx.tolist(), result.pedestrian_idx.tolist(),
+                                                 result.distance.tolist(), result.ttc.tolist())}
+
+
+@pytest.mark.parametrize("method, limit", [("dense", float("inf")), ("grid", 0)])
+@pytest.mark.parametrize("cone_half_angle", [90.0, 45.0])
+def test_matches_brute_force(method, limit, cone_half_angle):
+    args = scene(40, 300, 150.0)
+    expected = brute_force(*args, 10.0, cone_half_angle)
+    result = detect_pedestrians_batch(*args, detection_range=10.0, cone_half_angle=cone_half_angle,
+                                      dense_pair_limit=limit)
+    found = as_dict(result)
+    assert expected  # the scene is dense enough to have hits
+    assert found.keys() == expected.keys()
+    for pair, (distance, ttc) in expected.items():
+        assert found[pair][0] == pytest.approx(distance)
+        assert found[pair][1] == pytest.approx(ttc)
+
+
+def test_per_vehicle_summaries():
+    args = scene(40, 300, 150.0, seed=1)
+    result = detect_pedestrians_batch(*args, dense_pair_limit=0)
+    expected = brute_force(*args, 10.0, 90.0)
+    for vehicle in range(40):
+        mine = {p: d for (v, p), d in expected.items() if v == vehicle}
+        assert sorted(result.hits(vehicle).tolist()) == sorted(mine)
+        assert bool(result.any_hit[vehicle]) == bool(mine)
+        nearest = min((d for d, _ in mine.values()), default=math.inf)
+        assert result.nearest[vehicle] == pytest.approx(nearest)
+
+
+def test_empty_inputs():
+    result = detect_pedestrians_batch(np.zeros((3, 2)), np.ones((3, 2)), np.zeros((3, 2)),
+                                      np.zeros((0, 2)), np.zeros((0, 2)))
+    assert not result.any_hit.any()
+    assert np.isinf(result.nearest).all()
@@ -0,0 +1,86 @@
+"""PreemptionScheduler against stand-in lights, no CARLA server needed.
+
+    python -m pytest -q test_preemption.py
+"""
+import pytest
+
+from preemption import GREEN, RED, PreemptionScheduler, StandInTrafficLight, replay
+
+# one junction, approaching along +x with the stop line at x=0
+STOP = (0.0, 0.0)
+FORWARD = (1.0, 0.0)
+
+
+def junction():
+    light = StandInTrafficLight(1)
+    cross = [StandInTrafficLight(light_id) for light_id in (2, 3, 4)]
+    return light, cross
+
+
+def test_grant_holds_the_junction_until_the_vehicle_passes():
+    scheduler = PreemptionScheduler(hold_time=15.0, verbose=False)
+    light, cross = junction()
+    assert scheduler.request(7, light, cross, STOP, FORWARD, now=1.0) == "granted"
+    assert light.state == GREEN and light.frozen
+    assert all(other.state == RED and other.frozen for other in cross)
+    assert scheduler.request(7, light, cross, STOP, FORWARD, now=1.5) == "active"
+
+    scheduler.update(3.0, {7: (-5.0, 0.0)})  # still before the stop line
+    assert scheduler.is_held(light)
+
+    scheduler.update(4.0, {7: (5.0, 0.0)})  # past the line plus clearance
+    assert not scheduler.is_held(light)
+    assert not light.frozen and not any(other.frozen for other in cross)
+    preemption, = scheduler.completed
+    assert preemption.release_reason == "cleared"
+    assert preemption.green_at == 1.0 and preemption.released_at == 4.0
+
+
+def test_hold_expires():
+    scheduler = PreemptionScheduler(hold_time=15.0, verbose=False)
+    light, cross = junction()
+    scheduler.request(7, light, cross, STOP, FORWARD, now=0.0)
+    scheduler.update(14.9, {7: (-1.0, 0.0)})
+    assert scheduler.is_held(light)
+    scheduler.update(15.0, {7: (-1.0, 0.0)})
+    assert not scheduler.is_held(light)
+    assert scheduler.completed[0].release_reason == "expired"
+    assert scheduler.summary()["hold_max"] == pytest.approx(15.0)
+
+
+def test_conflicting_request_waits_for_the_release():
+    scheduler = PreemptionScheduler(hold_time=15.0, verbose=False)
+    light, cross = junction()
+    scheduler.request(7, light, cross, STOP, FORWARD, now=0.0)
+    other_cross = [light] + cross[1:]
+    assert scheduler.request(8, cross[0], other_cross, (0.0, 10.0), (0.0, -1.0), now=1.0) == "queued"
+    assert scheduler.conflicts == 1
+
+    scheduler.update(2.0, {7: (5.0, 0.0), 8: (0.0, 20.0)})
+    assert scheduler.is_held(cross[0]) and cross[0].state == GREEN
+    granted, = scheduler.active()
+    assert granted.requested_at == 1.0 and granted.green_at == 2.0
+
+
+def test_release_all_counts_held_preemptions_at_the_given_time():
+    scheduler = PreemptionScheduler(hold_time=15.0, verbose=False)
+    light, cross = junction()
+    scheduler.request(7, light, cross, STOP, FORWARD, now=2.0)
+    scheduler.release_all(now=6.5)
+    assert not light.frozen
+    stats = scheduler.summary()
+    assert stats["release_reasons"] == {"shutdown": 1}
+    assert stats["hold_mean"] == pytest.approx(4.5)
+
+
+def test_replay_serves_every_ambulance():
+    scheduler = replay(num_ambulances=60, num_junctions=5, seed=1)
+    stats = scheduler.summary()
+    assert stats["pending"] == 0
+    assert not scheduler.active()
+    assert stats["preemptions"] > 0
+    assert stats["hold_max"] <= scheduler.hold_time + 1e-9
+    assert stats["release_reasons"].get("cleared", 0) > stats["release_reasons"].get("expired", 0)
+    for preemption in scheduler.completed:
+        assert preemption.released_at is not None
+        assert preemption.green_at is None or preemption.green_at <= preemption.released_at
@@ -0,0 +1,86 @@
+"""ScenarioFarm orchestration against an in-process fake job function, no CARLA server needed.
+
+    python -m pytest -q test_scenario_farm.py
+"""
+import json
+import os
+
+from scenario_farm import MANIFEST_FILE, ScenarioFarm, scenario_matrix
+
+DOWN_PORT = 2002
+
+
+def fake_job(endpoint, tm_port, job, output_path):
+    """Succeeds on every server but DOWN_PORT, where it leaves a partial file behind and fails."""
+    if endpoint[1] == DOWN_PORT:
+        with open(os.path.join(output_path, "partial.bin"), "wb") as f:
+            f.write(b"\0" * 16)
+        raise RuntimeError("server down")
+    return {"written": job["frames"], "tm_port": tm_port, "found": sorted(os.listdir(output_path))}
+
+
+def run_farm(tmp_path, endpoints, jobs, **kwargs):
+    farm = ScenarioFarm(endpoints, jobs, str(tmp_path), run_job=fake_job, use_processes=False, **kwargs)
+    return farm, farm.run()
+
+
+def test_failed_jobs_are_retried_on_another_server(tmp_path):
+    jobs = scenario_matrix(["Town03", "Town05"], [0, 1], [0, 30], frames=10)
+    farm, manifest = run_farm(tmp_path, ["localhost:2000", f"localhost:{DOWN_PORT}"], jobs)
+
+    assert manifest["completed"] == len(jobs)
+    assert manifest["failed"] == 0
+    retried = [job_id for job_id, attempts in farm.attempts.items() if len(attempts) > 1]
+    assert retried
+    for job_id in retried:
+        attempts = farm.attempts[job_id]
+        assert [attempt["status"] for attempt in attempts] == ["failed", "ok"]
+        assert attempts[0]["worker"] == 1 and attempts[1]["worker"] == 0
+
+
+def test_failing_server_is_retired(tmp_path):
+    jobs = scenario_matrix(["Town03"], list(range(8)), frames=10)
+    farm, manifest = run_farm(tmp_path, ["localhost:2000", f"localhost:{DOWN_PORT}"], jobs, max_server_failures=2)
+
+    on_down_server = [attempt for attempts in farm.attempts.values() for attempt in attempts
+                      if attempt["worker"] == 1]
+    assert len(on_down_server) == 2
+    assert manifest["completed"] == len(jobs)
+
+
+def test_retry_starts_from_an_empty_shard(tmp_path):
+    jobs = scenario_matrix(["Town03"], list(range(4)), frames=10)
+    farm, manifest = run_farm(tmp_path, ["localhost:2000", f"localhost:{DOWN_PORT}"], jobs)
+
+    for entry in manifest["jobs"]:
+        assert entry["summary"]["found"] == []
+        assert not os.path.exists(os.path.join(str(tmp_path), entry["job_id"], "partial.bin"))
+
+
+def test_jobs_fail_after_max_attempts(tmp_path):
+    jobs = scenario_matrix(["Town03"], [0, 1], frames=10)
+    farm, manifest = run_farm(tmp_path, [f"localhost:{DOWN_PORT}"], jobs, max_attempts=2, max_server_failures=10)
+
+    assert manifest["completed"] == 0
+    assert manifest["failed"] == len(jobs)
+    for entry in manifest["jobs"]:
+        assert entry["status"] == "failed"
+        assert entry["attempts"] == 2
+        assert entry["errors"] == ["RuntimeError: server down"] * 2
+
+
+def test_manifests_are_merged(tmp_path):
+    jobs = scenario_matrix(["Town03", "Town05"], [0], [0, 30], frames=10)
+    farm, manifest = run_farm(tmp_path, ["localhost:2000", "localhost:2001"], jobs, tm_port_base=9000)
+
+    with open(os.path.join(str(tmp_path), MANIFEST_FILE)) as f:
+        assert json.load(f) == manifest
+    assert manifest["endpoints"] == ["localhost:2000", "localhost:2001"]
+    assert [entry["job_id"] for entry in manifest["jobs"]] == [job["job_id"] for job in jobs]
+    for job, entry in zip(jobs, manifest["jobs"]):
+        assert entry["status"] == "ok"
+        assert entry["attempts"] == 1
+        assert entry["town"] == job["town"] and entry["traffic_vehicles"] == job["traffic_vehicles"]
+        assert entry["shard"] == job["job_id"]
+        assert entry["summary"]["written"] == 10
+        assert entry["summary"]["tm_port"] == 9000 + entry["worker"]
@@ -0,0 +1,123 @@
+"""StuckWatchdog on a fake_carla world, no CARLA server needed.
+
+    python -m pytest -q test_stuck_watchdog.py
+"""
+import types
+
+import pytest
+
+import fake_carla
+
+carla = fake_carla.install()  # before stuck_watchdog imports carla
+
+from route_cache import MapCache  # noqa: E402
+from stuck_watchdog import StuckWatchdog  # noqa: E402
+
+DT = 0.05
+
+
+@pytest.fixture
+def world():
+    fake_carla.install(vehicles=3, junctions=4)
+    client = carla.Client("localhost", 2000)
+    world = client.get_world()
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = DT
+    world.apply_settings(settings)
+    vehicles = list(world.get_actors().filter("vehicle.*"))
+    for vehicle in vehicles:
+        vehicle.set_autopilot(False)
+        vehicle.set_target_velocity(carla.Vector3D())
+    return client, world, vehicles
+
+
+def run(world, watchdog, ticks):
+    events = []
+    for _ in range(ticks):
+        world.tick()
+        events += watchdog.update(world.get_snapshot())
+    return events
+
+
+def drive(vehicle, speed):
+    vehicle.set_target_velocity(carla.Vector3D(speed, 0.0, 0.0))
+
+
+def collide(world, watchdog, sensor=0):
+    # what the collision sensor delivers, only its frame is used
+    watchdog.sensors[sensor]._callback(types.SimpleNamespace(frame=world.get_snapshot().frame))
+
+
+def test_stuck_episode_is_reported_once_when_not_moved(world):
+    client, world, vehicles = world
+    watchdog = StuckWatchdog(client, world, vehicles, MapCache(world.get_map()), DT, stuck_seconds=1.0,
+                             suspect_seconds=0.5, recover=False)
+    events = run(world, watchdog, 100)
+    assert sorted(event["actor_id"] for event in events) == sorted(vehicle.id for vehicle in vehicles)
+    assert all(event["reason"] == "stuck" and event["spawn_index"] is None for event in events)
+    assert watchdog.summary()["lost_seconds"] == pytest.approx(3 * 1.0)
+    assert all(watchdog.is_suspect(vehicle.id) for vehicle in vehicles)
+
+
+def test_new_episode_after_the_vehicle_moved(world):
+    client, world, vehicles = world
+    watchdog = StuckWatchdog(client, world, vehicles[:1], MapCache(world.get_map()), DT, stuck_seconds=1.0,
+                             suspect_seconds=0.5, recover=False)
+    assert len(run(world, watchdog, 40)) == 1
+    drive(vehicles[0], 10.0)
+    assert run(world, watchdog, 20) == []
+    drive(vehicles[0], 0.0)
+    assert len(run(world, watchdog, 40)) == 1
+
+
+def test_stuck_vehicle_is_relocated_to_a_clear_spawn_point(world):
+    client, world, vehicles = world
+    route_cache = MapCache(world.get_map())
+    watchdog = StuckWatchdog(client, world, vehicles, route_cache, DT, stuck_seconds=1.0, suspect_seconds=0.5)
+    events = run(world, watchdog, 21)
+    assert len(events) == 3
+    used = [event["spawn_index"] for event in events]
+    assert None not in used and len(set(used)) == 3
+    for event in events:
+        location = world.get_actor(event["actor_id"]).get_location()
+        spawn = route_cache.spawn_points[event["spawn_index"]].location
+        assert (location.x, location.y) == pytest.approx((spawn.x, spawn.y))
+    # the jump isn't movement and the window starts over, so nothing is flagged again right away
+    assert run(world, watchdog, 10) == []
+
+
+def test_crash_is_flagged_once_the_vehicle_stops_within_the_grace_period(world):
+    client, world, vehicles = world
+    watchdog = StuckWatchdog(client, world, vehicles[:1], MapCache(world.get_map()), DT, stuck_seconds=20.0,
+                             suspect_seconds=0.5, collision_vehicles=vehicles[:1], recover=False,
+                             collision_grace_seconds=2.0)
+    drive(vehicles[0], 10.0)
+    run(world, watchdog, 20)
+    collide(world, watchdog)
+    drive(vehicles[0], 0.0)
+    events = run(world, watchdog, 40)
+    assert [event["reason"] for event in events] == ["collision"]
+    assert watchdog.collisions == 1
+
+
+def test_bump_while_standing_is_not_a_crash(world):
+    client, world, vehicles = world
+    watchdog = StuckWatchdog(client, world, vehicles[:1], MapCache(world.get_map()), DT, stuck_seconds=20.0,
+                             suspect_seconds=0.5, collision_vehicles=vehicles[:1], recover=False)
+    run(world, watchdog, 20)  # waiting at a red light
+    collide(world, watchdog)
+    assert run(world, watchdog, 100) == []
+
+
+def test_collision_outside_the_grace_period_is_ignored(world):
+    client, world, vehicles = world
+    watchdog = StuckWatchdog(client, world, vehicles[:1], MapCache(world.get_map()), DT, stuck_seconds=20.0,
+                             suspect_seconds=0.5, collision_vehicles=vehicles[:1], recover=False,
+                             collision_grace_seconds=1.0)
+    drive(vehicles[0], 10.0)
+    run(world, watchdog, 20)
+    collide(world, watchdog)  # a scrape, the vehicle drives on
+    run(world, watchdog, 40)
+    drive(vehicles[0], 0.0)
+    assert run(world, watchdog, 40) == []
@@ -0,0 +1,96 @@
+"""TelemetrySink buffering, flushing and CSV export (npz parts, pyarrow isn't needed).
+
+    python -m pytest -q test_telemetry_sink.py
+"""
+import csv
+import glob
+import os
+import time
+
+import numpy as np
+
+from detection_log import DETECTION_COLUMNS, DETECTION_SCHEMA, FRAME_SCHEMA, export_detection_csv
+from telemetry_sink import CATEGORY, TelemetrySink, export_csv, read_table
+
+SCHEMA = {"events": [("sensor", CATEGORY), ("frame", np.int64), ("value", np.float32)]}
+
+
+def parts(directory, table="events"):
+    return sorted(glob.glob(os.path.join(directory, table, "part-*")))
+
+
+def read_csv(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_round_trip_across_parts(tmp_path):
+    with TelemetrySink(str(tmp_path), SCHEMA, chunk_rows=4, fmt="npz") as sink:
+        for frame in range(6):
+            sink.append("events", "front" if frame % 2 else "rear", frame, frame / 2)
+        sink.extend("events", sensor=["left"] * 5, frame=np.arange(6, 11), value=np.zeros(5))
+    assert len(parts(str(tmp_path))) == 3
+    assert sink.summary()["events"]["rows"] == 11
+
+    table = read_table(str(tmp_path), "events")
+    assert table["frame"].tolist() == list(range(11))
+    assert table["sensor"].tolist()[:3] == ["rear", "front", "rear"]
+    assert table["value"].dtype == np.float32
+
+    codes = read_table(str(tmp_path), "events", decode=False)
+    assert codes["sensor"].dtype == np.int16
+    assert codes["sensor_categories"] == ["rear", "front", "left"]
+
+
+def test_new_sink_replaces_the_previous_run(tmp_path):
+    with TelemetrySink(str(tmp_path), SCHEMA, fmt="npz") as sink:
+        sink.append("events", "front", 1, 1.0)
+    with TelemetrySink(str(tmp_path), SCHEMA, fmt="npz") as sink:
+        sink.append("events", "front", 2, 2.0)
+    assert read_table(str(tmp_path), "events")["frame"].tolist() == [2]
+
+
+def test_stalled_producer_is_flushed_in_the_background(tmp_path):
+    sink = TelemetrySink(str(tmp_path), SCHEMA, fmt="npz", flush_seconds=0.05)
+    try:
+        sink.append("events", "front", 1, 1.0)
+        deadline = time.monotonic() + 2.0
+        while not parts(str(tmp_path)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # on disk without another append, flush or close
+        assert read_table(str(tmp_path), "events")["frame"].tolist() == [1]
+    finally:
+        sink.close()
+    sink.close()
+    assert len(parts(str(tmp_path))) == 1
+
+
+def test_export_formats_floats_and_keeps_the_header_of_empty_tables(tmp_path):
+    with TelemetrySink(str(tmp_path), {**SCHEMA, "empty": SCHEMA["events"]}, fmt="npz") as sink:
+        sink.append("events", "front", 1, 0.9)
+        sink.append("events", "rear", 2, 1.0 / 3)
+
+    assert export_csv(str(tmp_path), "events", str(tmp_path / "events.csv")) == 2
+    assert read_csv(tmp_path / "events.csv") == [["sensor", "frame", "value"], ["front", "1", "0.9"],
+                                                 ["rear", "2", "0.33333334"]]
+    assert export_csv(str(tmp_path), "empty", str(tmp_path / "empty.csv")) == 0
+    assert read_csv(tmp_path / "empty.csv") == [["sensor", "frame", "value"]]
+
+
+def test_export_detection_csv_joins_frames_per_sensor(tmp_path):
+    schemas = {"frames": FRAME_SCHEMA, "detections": DETECTION_SCHEMA}
+    with TelemetrySink(str(tmp_path), schemas, fmt="npz") as sink:
+        for sensor, speed in (("front", 36.0), ("rear", 18.0)):
+            sink.append("frames", sensor, 7, 0.35, speed, 1.0, 2.0, 0.0, 10.0, 0.0, 0.0, 320)
+        sink.append("detections", "rear", 7, "person", 0.9, 1.0, 2.0, 3.0, 4.0, "detected", -1)
+        sink.append("detections", "front", 7, "car", 0.5, 5.0, 6.0, 7.0, 8.0, "tracked", 3)
+        # a box whose frame row never got flushed
+        sink.append("detections", "front", 8, "car", 0.5, 5.0, 6.0, 7.0, 8.0, "detected", -1)
+
+    assert export_detection_csv(str(tmp_path), str(tmp_path / "detection_data.csv")) == 2
+    header, *rows = read_csv(tmp_path / "detection_data.csv")
+    assert header == DETECTION_COLUMNS
+    rows = [dict(zip(header, row)) for row in rows]
+    assert [(row["class"], row["speed_kmh"], row["box_source"], row["track_id"]) for row in rows] == [
+        ("person", "18.0", "detected", "-1"), ("car", "36.0", "tracked", "3")]
+    assert rows[0]["confidence"] == "0.9"
@@ -0,0 +1,155 @@
+"""Synchronous, tick-locked control loop shared by the simulation scripts.
+
+The runner puts the world (and traffic manager) in synchronous mode with a
+fixed time step, owns world.tick() and calls every registered controller
+once per tick (or every n ticks) with the tick's world snapshot. Controllers
+therefore always see the same simulation steps no matter how loaded the
+server is. With realtime=False the loop ticks as fast as the controllers
+allow, so batch experiments aren't tied to wall-clock speed. Tick and
+controller times also go to runtime_metrics for the live endpoint.
+"""
+import time
+
+from runtime_metrics import controller_seconds, tick_metrics
+
+
+class Controller:
+    """A registered per-tick callback plus its timing stats."""
+
+    def __init__(self, name, callback, every_n_ticks=1):
+        self.name = name
+        self.callback = callback
+        self.every_n_ticks = every_n_ticks
+        self.calls = 0
+        self.cpu_times = []
+        self.wall_times = []
+        self.seconds = controller_seconds(name)
+
+
+class TickRunner:
+    """Owns world.tick() and runs controllers on every simulation step."""
+
+    def __init__(self, world, fixed_delta_seconds=0.05, realtime=True, traffic_manager=None):
+        self.world = world
+        self.fixed_delta_seconds = fixed_delta_seconds
+        self.realtime = realtime
+        self.traffic_manager = traffic_manager
+        self.controllers = []
+        self.ticks = 0
+        self.last_snapshot = None
+        self.tick_wall_times = []
+        self._world_tick_seconds, self._tick_seconds, self._ticks_total = tick_metrics()
+        self._original_settings = None
+        self._stop = False
+        self._started = None
+        self._sim_started = None
+        self._sim_elapsed = 0.0
+
+    def add_controller(self, name, callback, every_n_ticks=1):
+        """Register callback(snapshot) to run every every_n_ticks ticks, in registration order."""
+        controller = Controller(name, callback, every_n_ticks)
+        self.controllers.append(controller)
+        return controller
+
+    def __enter__(self):
+        self._original_settings = self.world.get_settings()
+        settings = self.world.get_settings()
+        settings.synchronous_mode = True
+        settings.fixed_delta_seconds = self.fixed_delta_seconds
+        self.world.apply_settings(settings)
+        if self.traffic_manager is not None:
+            self.traffic_manager.set_synchronous_mode(True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.traffic_manager is not None:
+            self.traffic_manager.set_synchronous_mode(False)
+        if self._original_settings is not None:
+            self.world.apply_settings(self._original_settings)  # back to asynchronous mode
+        return False
+
+    def stop(self):
+        """Ask run() to return after the current tick, callable from a controller."""
+        self._stop = True
+
+    def tick(self):
+        """Advance the simulation one step and run the controllers that are due."""
+        start = time.perf_counter()
+        self.world.tick()
+        self._world_tick_seconds.observe(time.perf_counter() - start)
+        snapshot = self.last_snapshot = self.world.get_snapshot()
+        if self._sim_started is None:
+            self._sim_started = snapshot.timestamp.elapsed_seconds
+        self._sim_elapsed = snapshot.timestamp.elapsed_seconds - self._sim_started
+
+        for controller in self.controllers:
+            if self.ticks % controller.every_n_ticks != 0:
+                continue
+            cpu_start = time.thread_time()
+            wall_start = time.perf_counter()
+            controller.callback(snapshot)
+            controller.wall_times.append(time.perf_counter() - wall_start)
+            controller.seconds.observe(controller.wall_times[-1])
+            controller.cpu_times.append(time.thread_time() - cpu_start)
+            controller.calls += 1
+
+        self.ticks += 1
+        self.tick_wall_times.append(time.perf_counter() - start)
+        self._tick_seconds.observe(self.tick_wall_times[-1])
+        self._ticks_total.inc()
+        return snapshot
+
+    def run(self, num_ticks=None):
+        """Tick until num_ticks ticks have run or stop() is called."""
+        self._stop = False
+        self._started = time.perf_counter()
+        next_deadline = self._started
+        ticks_run = 0
+        while not self._stop and (num_ticks is None or ticks_run < num_ticks):
+            self.tick()
+            ticks_run += 1
+            if self.realtime:
+                # sleep to the next step boundary instead of a fixed sleep, so the rate doesn't drift
+                next_deadline += self.fixed_delta_seconds
+                delay = next_deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_deadline = time.perf_counter()
+
+    def stats(self):
+        """Per-controller CPU/wall time per call and overall tick throughput."""
+        def summarize(times):
+            if not times:
+                return {"mean_ms": None, "p95_ms": None, "max_ms": None}
+            ordered = sorted(times)
+            return {
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+
+        wall_elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "ticks": self.ticks,
+            "sim_seconds": self._sim_elapsed,
+            "wall_seconds": wall_elapsed,
+            "speedup": self._sim_elapsed / wall_elapsed if wall_elapsed > 0 else None,
+            "tick": summarize(self.tick_wall_times),
+            "controllers": {
+                controller.name: dict(calls=controller.calls, cpu=summarize(controller.cpu_times),
+                                      wall=summarize(controller.wall_times))
+                for controller in self.controllers
+            },
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        speedup = f", {stats['speedup']:.1f}x real time" if stats["speedup"] else ""
+        print(f"{stats['ticks']} ticks, {stats['sim_seconds']:.1f}s sim in {stats['wall_seconds']:.1f}s wall{speedup}")
+        for name, controller in stats["controllers"].items():
+            cpu = controller["cpu"]
+            if cpu["mean_ms"] is None:
+                continue
+            print(f"  {name}: {controller['calls']} calls, CPU mean {cpu['mean_ms']:.2f} ms, "
+                  f"p95 {cpu['p95_ms']:.2f} ms, max {cpu['max_ms']:.2f} ms")
@@ -1,7 +1,13 @@
+import os
+
 import carla
-import time
-import math
-import random
+
+from intersection_index import load_or_build
+from preemption import PreemptionScheduler
+from runtime_metrics import start_exporter
+from scenario import EGO_ROLE_NAME, Scenario
+from spawn_manager import SpawnManager
+from tick_runner import TickRunner
 
 # Connect to the CARLA server
 client = carla.Client('localhost', 2000)
@@ -9,122 +15,89 @@ client.set_timeout(10.0)  # Set a timeout for the connection
 
 world = client.get_world()
 
-# Get vehicle blueprints
-blueprint_library = world.get_blueprint_library()
-vehicle_blueprints = blueprint_library.filter("vehicle.*")
-
-# Get spawn points
-spawn_points = world.get_map().get_spawn_points()
-
-# Store vehicles
-vehicle_list = []
-
-# Spawn vehicles
-for i in range(10):
-    # Create random vehicles and spawn points from blueprints
-    vehicle_bp = random.choice(vehicle_blueprints)
-    spawn_point = random.choice(spawn_points)
-
-    # Spawn vehicle in random location
-    vehicle = world.try_spawn_actor(vehicle_bp, spawn_point)
-    # Set it on auto pilot
-    if vehicle:
-        vehicle.set_autopilot(True)
-        vehicle_list.append(vehicle)
-
-# Add 1 emergency vehicle to test function
-emergency_vehicle_blueprint = blueprint_library.filter("vehicle.*ambulance*")[0]
-emergency_spawn_point = random.choice(spawn_points)
-
-emergency_vehicle = world.try_spawn_actor(emergency_vehicle_blueprint, emergency_spawn_point)
-
-if emergency_vehicle:
-    emergency_vehicle.set_autopilot(True)
-    vehicle_list.append(emergency_vehicle)
-
-# Get all the traffic light
-traffic_lights = world.get_actors().filter('traffic.traffic_light')
-
-# Create distance function in 3d space
-def get_distance(dist1, dist2):
-    dx = dist1.x - dist2.x
-    dy = dist1.y - dist2.y
-    dz = dist1.z - dist2.z
-
-    return math.sqrt(dx * dx + dy * dy + dz * dz)
-
-# Function that gets the lights in an intersection
-def get_intersection(start_light, start_light_location):
-    # Finds distance between each lights
-    # Create a new array
-    new_array = []
-    # add lights to array if distance is less than or equal to 30
-    for light in traffic_lights:
-        if light.id != start_light.id:
-            light_location = light.get_transform().location
-            distance = get_distance(start_light_location, light_location)
-        
-            if distance <= 30:
-                new_array.append(light)
-    # return array
-    return new_array
+# simulation is stepped by the tick runner at 0.05s (20 fps), realtime = False ticks as fast as possible
+fixed_delta_seconds = 0.05
+realtime = True
+traffic_manager = client.get_trafficmanager()
+
+# Seed spawns and traffic manager decisions, RECORD_SCENARIO=1 also records the run for replay (scenario.py)
+seed = 0  # same vehicles at the same spawn points every run
+record_scenario = os.environ.get("RECORD_SCENARIO", "0") == "1"
+scenario = Scenario(client, "recordings/traffic_lights", seed=seed, name="traffic_lights", record=record_scenario)
+scenario.seed_everything(world, traffic_manager)
+
+# Spawns vehicles in batches and destroys everything on exit
+spawn_manager = SpawnManager(client, world, seed=seed, tm_port=traffic_manager.get_port())
+
+# Spawn vehicles on auto pilot
+vehicle_list = spawn_manager.spawn_vehicles(10, "vehicle.*", autopilot=True)
+
+# Add 1 emergency vehicle to test function, its role_name is how scenario.py replay finds it
+emergency_vehicles = spawn_manager.spawn_vehicles(1, "vehicle.*ambulance*", autopilot=True, role_name=EGO_ROLE_NAME)
+vehicle_list.extend(emergency_vehicles)
+spawn_manager.print_report()
+
+# Fetch the map once, get_map() is an RPC that copies the whole map
+carla_map = world.get_map()
+
+# Index of lane -> traffic light and light -> intersection, cached on disk per map
+intersection_index = load_or_build(world, radius=30.0, carla_map=carla_map)
+
+# Function that gets the lights in an intersection (lights within 30 of start light)
+def get_intersection(start_light):
+    return intersection_index.intersection(start_light)
          
+# Holds preempted intersections without blocking the polling loop
+preemption_scheduler = PreemptionScheduler(hold_time=15.0)
+
 # Manages all traffic lights next to vehicle
-def traffic_light_controller(vehicle):
+def traffic_light_controller(vehicle, now):
     # Get vehicle waypoint
-    vehicle_waypoint = world.get_map().get_waypoint(vehicle.get_location())
-    current = None
-
-    # checks for closest traffic light for vehicle
-    for light in traffic_lights:
-        waypoints = light.get_stop_waypoints()
-        for w in waypoints:
-            if w.road_id == vehicle_waypoint.road_id and w.lane_id == vehicle_waypoint.lane_id:
-                current = light
-                break
-        if current:
-            break
-
-    # If traffic light was found for vehicle
-    if current:
-        # Call intersection function with current light to get the lights nearby
-        current_location = current.get_transform().location
-        intersection = get_intersection(current, current_location)
-
-        print(f"Ambulance {vehicle.id} approaching. Traffic light {current.id} set to GREEN.")
-
-        # Set closest traffic light to green for 15 seconds
-        current.set_state(carla.TrafficLightState.Green)
-        current.freeze(True)
-
-        # Make other traffic lights in intersection red for 15 seconds
-        for other_light in intersection:
-            other_light.set_state(carla.TrafficLightState.Red)
-            other_light.freeze(True)
-            print(f"Traffic light {other_light.id} set to RED to prioritize ambulance.")
-
-        time.sleep(15)
-
-        # Put them back to normal after
-        current.freeze(False)
-        for other_light in intersection:
-            other_light.freeze(False)
-
-        print(f"Traffic light {current.id} set back to normal. Normal operation resumed.")
+    vehicle_waypoint = carla_map.get_waypoint(vehicle.get_location())
+
+    # look up the traffic light controlling the vehicle's lane
+    approach = intersection_index.approach_for_waypoint(vehicle_waypoint)
+
+    # If traffic light was found for vehicle, turn it green and the rest of the intersection red
+    # until the ambulance passes the stop line (or 15 seconds at most)
+    if approach:
+        current, stop_location, stop_forward = approach
+        intersection = get_intersection(current)
+        preemption_scheduler.request(vehicle.id, current, intersection, stop_location, stop_forward, now)
+
+# Checks every ambulance against the traffic lights, runs every 10 ticks (0.5s of sim time)
+def signal_preemption(snapshot):
+    now = snapshot.timestamp.elapsed_seconds
+    ambulance_locations = {}
+    # List in case there's multiple emergency vehicles
+    all_vehicles = world.get_actors().filter("vehicle.*")
+    for vehicle in all_vehicles:
+        if "ambulance" in vehicle.type_id.lower():
+            location = vehicle.get_location()
+            ambulance_locations[vehicle.id] = (location.x, location.y)
+            traffic_light_controller(vehicle, now)
+    # put intersections back to normal once their ambulances are through
+    preemption_scheduler.update(now, ambulance_locations)
+
+# tick and controller times live on http://127.0.0.1:METRICS_PORT/metrics and in the recording's metrics.json
+metrics = start_exporter("recordings/traffic_lights/metrics.json")
 
 # Destroy vehicles when done with simulation
+runner = TickRunner(world, fixed_delta_seconds, realtime, traffic_manager)
 try:
-    while True:
-        # List in case there's multiple emergency vehicles
-        all_vehicles = world.get_actors().filter("vehicle.*")
-        for vehicle in all_vehicles:
-            if "ambulance" in vehicle.type_id.lower():
-                traffic_light_controller(vehicle)
-        time.sleep(0.5)
+    with runner:
+        runner.add_controller("signal_preemption", signal_preemption, every_n_ticks=10)
+        scenario.start(world)
+        runner.run()
 except KeyboardInterrupt:
     print("\nKeyboardInterrupt caught, stopping simulation...")
 finally:
-    for vehicle in vehicle_list:
-        if vehicle.is_alive:
-            vehicle.destroy()
+    scenario.stop(world)
+    # held lights are released at the last tick's sim time, so they still count in the hold times
+    preemption_scheduler.release_all(
+        runner.last_snapshot.timestamp.elapsed_seconds if runner.last_snapshot is not None else None)
+    preemption_scheduler.print_summary()
+    runner.print_stats()
+    spawn_manager.destroy_all()
     print("All vehicles destroyed.")
+    metrics.close()
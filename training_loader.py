@@ -0,0 +1,422 @@
+"""Streaming training batches for the ambulance imitation-learning data.
+
+Reads a dataset written by ambulance_collect_data2.py, either flat
+({frame}.jpg + controls.csv) or sharded (dataset_shards.py), joins every
+frame to its steering/throttle/brake by frame number and yields batches:
+
+    loader = TrainingLoader("D:/dataset", batch_size=64, image_size=(224, 224),
+                            cache_path="cache/train_224.u8")
+    for epoch in range(10):
+        for images, labels in loader.epoch(epoch):  # (B, H, W, 3) uint8, (B, 3) float32
+            ...
+    loader.close()
+    loader.print_stats()
+
+Worker processes decode JPEGs straight into a fixed set of batch slots in
+shared memory. The arrays handed out are views of those slots, so they are
+only valid until the next batch is requested. The data is mostly straight
+driving, so by default an epoch draws samples with weights inversely
+proportional to the size of their steering bin. With cache_path set, each
+decoded (and resized) image is also written to a memory-mapped uint8 array.
+Later epochs (and later runs) copy from that array instead of decoding
+again.
+
+    python training_loader.py bench --count 2000   # samples/s on a synthetic dataset, CPU only
+    python training_loader.py stats D:/dataset     # steering histogram, raw vs balanced
+"""
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from dataset_shards import INDEX_FILE
+
+LABEL_COLUMNS = ("steering", "throttle", "brake")
+STEERING_BINS = 21
+
+_worker = {}  # per-process decode state, see _setup_worker()
+
+
+def load_samples(dataset_dir):
+    """Dataset description {kind, frames, labels, ...} of a flat or sharded dataset."""
+    if os.path.exists(os.path.join(dataset_dir, INDEX_FILE)):
+        with open(os.path.join(dataset_dir, INDEX_FILE)) as f:
+            shards = json.load(f)["shards"]
+        rows = [(shard_number, *sample) for shard_number, shard in enumerate(shards) for sample in shard["samples"]]
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 7)
+        return {
+            "kind": "shards",
+            "directory": dataset_dir,
+            "shard_paths": [os.path.join(dataset_dir, shard["name"]) for shard in shards],
+            "frames": rows[:, 1].astype(np.int64),
+            "shard_of": rows[:, 0].astype(np.int64),
+            "offsets": rows[:, 2].astype(np.int64),
+            "sizes": rows[:, 3].astype(np.int64),
+            "labels": rows[:, 4:7].astype(np.float32),
+        }
+
+    # flat dataset: controls rows that have an image, the watchdog pauses both so they normally all do
+    images = {entry.name for entry in os.scandir(dataset_dir) if entry.name.endswith(".jpg")}
+    frames, labels = [], []
+    with open(os.path.join(dataset_dir, "controls.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            frame = int(row["frame"])
+            if f"{frame}.jpg" in images:
+                frames.append(frame)
+                labels.append([float(row[column]) for column in LABEL_COLUMNS])
+    return {
+        "kind": "files",
+        "directory": dataset_dir,
+        "frames": np.array(frames, dtype=np.int64),
+        "labels": np.array(labels, dtype=np.float32).reshape(-1, 3),
+    }
+
+
+def balanced_weights(steering, bins=STEERING_BINS, max_ratio=50.0):
+    """Sampling probability per sample, equal total weight per steering bin over [-1, 1].
+
+    max_ratio caps how much more often a sample from a rare bin is drawn than one from the largest bin.
+    """
+    edges = np.linspace(-1.0, 1.0, bins + 1)
+    which = np.clip(np.searchsorted(edges, steering, side="right") - 1, 0, bins - 1)
+    counts = np.bincount(which, minlength=bins)
+    per_bin = 1.0 / np.maximum(counts, 1)
+    per_bin = np.minimum(per_bin, per_bin[counts > 0].min() * max_ratio)
+    weights = per_bin[which]
+    return weights / weights.sum()
+
+
+def _read_jpeg(index):
+    dataset = _worker["dataset"]
+    if dataset["kind"] == "files":
+        with open(os.path.join(dataset["directory"], f"{dataset['frames'][index]}.jpg"), "rb") as f:
+            return f.read()
+    shard = int(dataset["shard_of"][index])
+    buffer = _worker["shards"].get(shard)
+    if buffer is None:
+        with open(dataset["shard_paths"][shard], "rb") as f:
+            buffer = _worker["shards"][shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    offset = int(dataset["offsets"][index])
+    return buffer[offset:offset + int(dataset["sizes"][index])]
+
+
+def _setup_worker(dataset, slots, cache_path, cache_shape):
+    _worker.update(dataset=dataset, slots=slots, shards={},
+                   cache=np.memmap(cache_path, np.uint8, "r+", shape=cache_shape) if cache_path else None)
+
+
+def _init_worker(dataset, slots_name, slots_shape, cache_path, cache_shape):
+    try:
+        shm = shared_memory.SharedMemory(name=slots_name, track=False)
+    except TypeError:
+        # before Python 3.13, pool workers share the parent's resource tracker, registering again is harmless
+        shm = shared_memory.SharedMemory(name=slots_name)
+    _worker["shm"] = shm
+    _setup_worker(dataset, np.ndarray(slots_shape, np.uint8, buffer=shm.buf), cache_path, cache_shape)
+    cv2.setNumThreads(1)  # parallelism comes from the processes
+
+
+def _decode_batch(slot, indices, cached):
+    """Fill batch slot with the samples' images, from the decoded cache where available."""
+    out = _worker["slots"][slot]
+    cache = _worker["cache"]
+    height, width = out.shape[1:3]
+    decoded = 0
+    for i, (index, hit) in enumerate(zip(indices.tolist(), cached.tolist())):
+        if hit:
+            out[i] = cache[index]
+            continue
+        image = cv2.imdecode(np.frombuffer(_read_jpeg(index), np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Can't decode the image of frame {_worker['dataset']['frames'][index]}")
+        if image.shape[:2] == (height, width):
+            out[i] = image
+        else:
+            cv2.resize(image, (width, height), dst=out[i], interpolation=cv2.INTER_AREA)
+        if cache is not None:
+            cache[index] = out[i]
+        decoded += 1
+    return decoded
+
+
+class TrainingLoader:
+    """Balanced, prefetched (images, labels) batches decoded by worker processes."""
+
+    def __init__(self, dataset_dir, batch_size=64, image_size=None, num_workers=4, prefetch=None,
+                 balance=True, seed=0, cache_path=None, drop_last=False):
+        self.dataset = load_samples(dataset_dir)
+        self.labels = self.dataset.pop("labels")
+        if len(self.labels) == 0:
+            raise ValueError(f"No samples with both an image and controls in {dataset_dir}")
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.balance = balance
+        self.seed = seed
+        self.drop_last = drop_last
+        self.weights = balanced_weights(self.labels[:, 0]) if balance else None
+
+        if image_size is None:
+            _setup_worker(self.dataset, None, None, None)
+            probe = cv2.imdecode(np.frombuffer(_read_jpeg(0), np.uint8), cv2.IMREAD_COLOR)
+            image_size = (probe.shape[1], probe.shape[0])
+        self.image_size = tuple(image_size)  # (width, height)
+        width, height = self.image_size
+
+        # one slot per batch in flight plus the one the caller is holding
+        self.num_slots = (prefetch or max(2, num_workers)) + 1
+        slots_shape = (self.num_slots, batch_size, height, width, 3)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slots_shape)))
+        self.slots = np.ndarray(slots_shape, np.uint8, buffer=self._shm.buf)
+        self.label_slots = np.empty((self.num_slots, batch_size, 3), dtype=np.float32)
+
+        self.cache_path = cache_path
+        self.cached = np.zeros(len(self.labels), dtype=bool)
+        cache_shape = (len(self.labels), height, width, 3)
+        if cache_path:
+            self._open_cache(cache_shape)
+
+        if num_workers > 0:
+            context = multiprocessing.get_context()
+            self._pool = context.Pool(num_workers, initializer=_init_worker,
+                                      initargs=(self.dataset, self._shm.name, slots_shape, cache_path, cache_shape))
+        else:
+            self._pool = None
+            _setup_worker(self.dataset, self.slots, cache_path, cache_shape)
+
+        self.samples = 0
+        self.batches = 0
+        self.decoded = 0
+        self.cache_hits = 0
+        self.wait_time = 0.0
+        self.epoch_rates = []
+
+    def _fingerprint(self):
+        """What the cached images were decoded from: the dataset, its frames and (size, mtime) of every file.
+
+        A re-collected or re-converted dataset in the same directory keeps the
+        frame numbers but not the file stats, so it invalidates the cache too.
+        One stat per JPEG of a flat dataset, one per shard of a sharded one.
+        """
+        if self.dataset["kind"] == "shards":
+            paths = self.dataset["shard_paths"]
+        else:
+            directory = self.dataset["directory"]
+            paths = [os.path.join(directory, f"{frame}.jpg") for frame in self.dataset["frames"].tolist()]
+        stats = [os.stat(path) for path in paths]
+        files = np.array([(stat.st_size, stat.st_mtime_ns) for stat in stats], dtype=np.int64).reshape(-1, 2)
+        return {
+            "dataset": os.path.abspath(self.dataset["directory"]),
+            "samples": len(self.labels),
+            "image_size": list(self.image_size),
+            "frames_sha1": hashlib.sha1(self.dataset["frames"].tobytes()).hexdigest(),
+            "files_sha1": hashlib.sha1(files.tobytes()).hexdigest(),
+        }
+
+    def _open_cache(self, cache_shape):
+        """Memory-mapped decoded images plus which of them are filled, reset if the dataset changed."""
+        meta_path = self.cache_path + ".json"
+        filled_path = self.cache_path + ".filled.npy"
+        fingerprint = self._fingerprint()
+        valid = False
+        if os.path.exists(self.cache_path) and os.path.exists(meta_path) and os.path.exists(filled_path):
+            with open(meta_path) as f:
+                valid = json.load(f) == fingerprint
+        if valid:
+            self.cached = np.load(filled_path)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        np.memmap(self.cache_path, np.uint8, "w+", shape=cache_shape).flush()
+        with open(meta_path, "w") as f:
+            json.dump(fingerprint, f)
+        self._save_cache_state()
+
+    def _save_cache_state(self):
+        if self.cache_path:
+            np.save(self.cache_path + ".filled.npy", self.cached)
+
+    def __len__(self):
+        """Batches per epoch."""
+        full, rest = divmod(len(self.labels), self.batch_size)
+        return full + (1 if rest and not self.drop_last else 0)
+
+    def epoch_order(self, epoch):
+        """Sample indices of one epoch, balanced draws with replacement or a plain shuffle."""
+        rng = np.random.default_rng((self.seed, epoch))
+        if self.weights is not None:
+            return rng.choice(len(self.labels), size=len(self.labels), replace=True, p=self.weights)
+        return rng.permutation(len(self.labels))
+
+    def _submit(self, slot, indices):
+        cached = self.cached[indices]
+        self.label_slots[slot, :len(indices)] = self.labels[indices]
+        if self._pool is None:
+            return _decode_batch(slot, indices, cached)
+        return self._pool.apply_async(_decode_batch, (slot, indices, cached))
+
+    def epoch(self, epoch=0):
+        """Yield (images, labels) views for one epoch, valid until the next batch is requested."""
+        order = self.epoch_order(epoch)
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        start = time.perf_counter()
+        samples = 0
+        pending = deque()
+        next_batch = 0
+        try:
+            while next_batch < min(self.num_slots, len(batches)):
+                pending.append((next_batch, self._submit(next_batch % self.num_slots, batches[next_batch])))
+                next_batch += 1
+            while pending:
+                number, result = pending.popleft()
+                wait_start = time.perf_counter()
+                decoded = result if self._pool is None else result.get()
+                self.wait_time += time.perf_counter() - wait_start
+
+                indices = batches[number]
+                self.decoded += decoded
+                self.cache_hits += len(indices) - decoded
+                if self.cache_path:
+                    self.cached[indices] = True
+                samples += len(indices)
+                self.samples += len(indices)
+                self.batches += 1
+                slot = number % self.num_slots
+                yield self.slots[slot, :len(indices)], self.label_slots[slot, :len(indices)]
+
+                # the caller is done with the previous batch, its slot takes the next one
+                if next_batch < len(batches):
+                    pending.append((next_batch, self._submit(next_batch % self.num_slots, batches[next_batch])))
+                    next_batch += 1
+        finally:
+            # never leave a worker writing into a slot the next epoch hands out
+            for _, result in pending:
+                if self._pool is not None:
+                    result.wait()
+            self._save_cache_state()
+        elapsed = time.perf_counter() - start
+        self.epoch_rates.append(samples / elapsed if elapsed > 0 else 0.0)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._save_cache_state()
+        self.slots = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "batches": self.batches,
+            "decoded": self.decoded,
+            "cache_hits": self.cache_hits,
+            "cached_fraction": float(self.cached.mean()) if len(self.cached) else 0.0,
+            "wait_s": self.wait_time,
+            "epoch_samples_per_s": list(self.epoch_rates),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        rates = ", ".join(f"{rate:.0f}" for rate in stats["epoch_samples_per_s"]) or "n/a"
+        print(f"Training loader: {stats['samples']} samples in {stats['batches']} batches, "
+              f"{stats['decoded']} decoded, {stats['cache_hits']} from the decoded cache "
+              f"({stats['cached_fraction']:.0%} cached), {stats['wait_s']:.2f}s waiting on workers, "
+              f"samples/s per epoch: {rates}")
+
+
+def make_synthetic_dataset(directory, count=2000, size=(320, 320), seed=0, quality=95):
+    """Flat dataset of count noisy gradient JPEGs and mostly-straight controls.csv, like a collection run."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    with open(os.path.join(directory, "controls.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("frame",) + LABEL_COLUMNS)
+        for frame in range(count):
+            image = np.clip(ramp + rng.normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8)
+            cv2.imwrite(os.path.join(directory, f"{frame}.jpg"), image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            # ~85% straight driving, the rest spread over turns
+            steering = rng.normal(0, 0.02) if rng.random() < 0.85 else rng.uniform(-0.8, 0.8)
+            writer.writerow((frame, f"{steering:.4f}", f"{rng.uniform(0.3, 0.7):.4f}", "0.0"))
+    return directory
+
+
+def steering_histogram(steering, bins=STEERING_BINS):
+    return np.histogram(steering, bins=bins, range=(-1.0, 1.0))[0]
+
+
+def benchmark(directory=None, count=2000, size=(320, 320), image_size=(224, 224), batch_size=64,
+              workers=(0, 4), epochs=2):
+    """samples/s on a synthetic dataset: per worker count, first epoch (decode) vs later epochs (cache)."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or os.path.join(tmp, "dataset")
+        if not os.path.exists(os.path.join(directory, "controls.csv")):
+            start = time.perf_counter()
+            make_synthetic_dataset(directory, count, size)
+            print(f"Wrote {count} synthetic {size[0]}x{size[1]} frames in {time.perf_counter() - start:.1f}s")
+        for num_workers in workers:
+            for cache_path in (None, os.path.join(tmp, f"decoded_{num_workers}.u8")):
+                with TrainingLoader(directory, batch_size, image_size, num_workers=num_workers,
+                                    cache_path=cache_path) as loader:
+                    for epoch in range(epochs):
+                        for _ in loader.epoch(epoch):
+                            pass
+                rates = ", ".join(f"{rate:.0f}" for rate in loader.epoch_rates)
+                print(f"{num_workers} workers, {'decoded cache' if cache_path else 'no cache'}: "
+                      f"samples/s per epoch {rates}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training data loader tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("bench", help="samples/s on a synthetic (or given) dataset")
+    bench.add_argument("--dataset", help="existing flat dataset instead of a synthetic one")
+    bench.add_argument("--count", type=int, default=2000)
+    bench.add_argument("--size", type=int, default=320, help="synthetic frame size")
+    bench.add_argument("--image-size", type=int, default=224, help="training image size")
+    bench.add_argument("--batch-size", type=int, default=64)
+    bench.add_argument("--workers", type=int, nargs="+", default=[0, 4])
+    bench.add_argument("--epochs", type=int, default=2)
+    stats = subparsers.add_parser("stats", help="steering histogram of a dataset, raw vs balanced")
+    stats.add_argument("dataset")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.dataset, args.count, (args.size, args.size), (args.image_size, args.image_size),
+                  args.batch_size, args.workers, args.epochs)
+    else:
+        labels = load_samples(args.dataset)["labels"]
+        steering = labels[:, 0]
+        drawn = steering[np.random.default_rng(0).choice(len(steering), len(steering), p=balanced_weights(steering))]
+        edges = np.linspace(-1.0, 1.0, STEERING_BINS + 1)
+        print(f"{len(steering)} samples")
+        for low, high, raw, balanced in zip(edges[:-1], edges[1:], steering_histogram(steering),
+                                            steering_histogram(drawn)):
+            print(f"  [{low:+.2f}, {high:+.2f}): raw {raw:7d}, balanced {balanced:7d}")
+
+
+if __name__ == "__main__":
+    main()